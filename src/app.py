@@ -30,33 +30,299 @@
 # - Devemos usar instruções SQL para interagir com o banco de dados
 # Este é o arquivo principal da aplicação, onde a aplicação é inicializada e as rotas são definidas
 
-from flask import Flask, request, jsonify
+from flask import Blueprint, Flask, Response, current_app, g, request, jsonify, send_file
+from werkzeug.local import LocalProxy
+from werkzeug.middleware.proxy_fix import ProxyFix
+from config import Config
+from log import setup_logging
+from metrics import REGISTRY
+from profiling import PROFILE_HEADER, RequestProfiler
+from serialize import encode, list_response
+from service.attachment import AttachmentService
 from service.auth import AuthService
-from service.cypher import CypherService
+from service.cypher import CypherService, HashQueueFull
+from service.invalidation import InvalidationLog
 from service.message import MessageService
+from service.ratelimit import RateLimiter, parse_rules
 from service.user import UserService
-from storage.message import MessageStorage
+from storage.attachment import AttachmentStorage
+from storage.database import UnitOfWork, link
+from storage.message import MessageStorage, open_pool
+from storage.ratelimit import RateLimitStorage
 from storage.user import UserStorage
+from storage import slowquery
+import atexit
 import logging
+import math
+import os
+import re
+import time
+import zlib
 from datetime import datetime
 
-app = Flask(__name__)
+# As rotas ficam num blueprint; create_app monta a aplicação e os serviços.
+# Nada abre conexão com o banco na importação: cada processo (worker) chama
+# create_app depois do fork e tem seu próprio pool de conexões.
+api = Blueprint('chatao', __name__)
 
-# Configuração de logs
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+def create_app(config: Config = None) -> Flask:
+    config = config or Config.from_env()
+    app = Flask(__name__)
 
-# Inicialização dos serviços
-user_storage = UserStorage()
-message_storage = MessageStorage()
-cypher_service = CypherService()
-user_service = UserService(user_storage, cypher_service)
-auth_service = AuthService(user_service, cypher_service)
-message_service = MessageService(message_storage, auth_service)
+    # Configuração de logs (nível e formato vêm da configuração; console colorido ou JSON)
+    setup_logging(config.log_level, config.log_format)
 
-@app.route('/user', methods=['POST'])
+    # Diagnóstico: log de consultas lentas (antes de abrir os bancos) e perfil das requisições
+    slowquery.configure(config.slow_query_ms)
+    profiler = RequestProfiler(config.profile_rate, config.profile_token, config.profile_dir)
+
+    # Inicialização dos serviços
+    archive = config.archive_after > 0
+    if config.database:
+        #banco único: os dois storages dividem o pool e as transações
+        pool = open_pool(config.database, config.pool_size, archive)
+        user_storage = UserStorage(config.database, pool=pool)
+        message_storage = MessageStorage(config.database, config.pool_size,
+                                         config.write_behind, config.batch_size, config.flush_interval,
+                                         config.message_shards, archive, pool=pool)
+        link(pool)
+        atexit.register(pool.close)
+    else:
+        user_storage = UserStorage(config.user_db, config.pool_size)
+        message_storage = MessageStorage(config.message_db, config.pool_size,
+                                         config.write_behind, config.batch_size, config.flush_interval,
+                                         config.message_shards, archive)
+    atexit.register(message_storage.close) # grava as mensagens pendentes ao desligar
+    unit_of_work = UnitOfWork(user_storage.pool, *message_storage.pools)
+    cypher_service = CypherService(config.jwt_secret, config.token_ttl, hash_params={
+        'algorithm': config.hash_algorithm,
+        'scrypt_n': config.scrypt_n,
+        'scrypt_r': config.scrypt_r,
+        'scrypt_p': config.scrypt_p,
+        'pbkdf2_iterations': config.pbkdf2_iterations,
+    }, hash_workers=config.hash_workers, hash_queue=config.hash_queue)
+    #caches e revogações por processo, sincronizados entre workers pelo banco
+    invalidations = InvalidationLog(user_storage, config.invalidation_interval, config.token_ttl)
+    user_service = UserService(user_storage, cypher_service, config.user_cache_size, config.user_cache_ttl,
+                               invalidations, unit_of_work)
+    #no banco único, remover um usuário leva junto as mensagens e conversas dele
+    #(inclusive as do arquivo morto), no mesmo commit; com bancos separados as
+    #mensagens ficam, como antes
+    if config.database:
+        user_service.on_delete(message_storage.delete_user_messages)
+    auth_service = AuthService(user_service, cypher_service, config.token_cache_size, invalidations)
+    #com bancos separados não há transação que cubra a consulta dos destinatários e os inserts
+    message_service = MessageService(message_storage, auth_service,
+                                     unit_of_work=unit_of_work if config.database else None,
+                                     wake_interval=config.wake_interval)
+    #anexos: conteúdo no disco (endereçado pelo hash), metadados num SQLite à parte
+    attachment_storage = AttachmentStorage(config.attachment_dir, config.attachment_db, config.pool_size)
+    atexit.register(attachment_storage.close)
+    attachment_service = AttachmentService(attachment_storage, message_storage, auth_service,
+                                           config.attachment_max_size)
+    #limitação de taxa: compartilhada via SQLite entre os workers; em memória só
+    #quando há um processo
+    rules = parse_rules(config.rate_limits)
+    buckets = None
+    rate_limit_db = config.rate_limit_db
+    if not rate_limit_db and config.workers > 1:
+        rate_limit_db = os.path.join(os.path.dirname(config.database or config.user_db), 'ratelimit.db')
+    if rules and rate_limit_db:
+        retention = max([rule.per for limits in rules.values() for rule in limits], default=3600)
+        buckets = RateLimitStorage(rate_limit_db, config.pool_size, retention)
+        atexit.register(buckets.close)
+    rate_limiter = RateLimiter(rules, buckets)
+    #atrás de proxies confiáveis, remote_addr passa a ser o IP do cliente
+    if config.trusted_proxies > 0:
+        n = config.trusted_proxies
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=n, x_proto=n, x_host=n, x_port=n, x_prefix=n)
+
+    app.config['CHATAO'] = config
+    #com um proxy na frente (nginx X-Accel/X-Sendfile), o download nem passa pelo worker
+    app.config['USE_X_SENDFILE'] = config.x_sendfile
+    app.extensions['chatao'] = {
+        'user_storage': user_storage,
+        'message_storage': message_storage,
+        'cypher_service': cypher_service,
+        'user_service': user_service,
+        'auth_service': auth_service,
+        'message_service': message_service,
+        'rate_limiter': rate_limiter,
+        'profiler': profiler,
+        'attachment_service': attachment_service,
+    }
+    app.register_blueprint(api)
+    return app
+
+def _service(name: str) -> LocalProxy:
+    return LocalProxy(lambda: current_app.extensions['chatao'][name])
+
+# Serviços da aplicação corrente, usados pelas rotas
+user_service = _service('user_service')
+auth_service = _service('auth_service')
+message_service = _service('message_service')
+cypher_service = _service('cypher_service')
+rate_limiter = _service('rate_limiter')
+profiler = _service('profiler')
+attachment_service = _service('attachment_service')
+
+# Métricas de requisições, medidas uma única vez para todas as rotas
+REQUEST_SECONDS = REGISTRY.histogram(
+    'chatao_request_seconds', 'Request latency by route', ('method', 'route'))
+REQUESTS_TOTAL = REGISTRY.counter(
+    'chatao_requests_total', 'Requests by route and status code', ('method', 'route', 'status'))
+REQUESTS_IN_FLIGHT = REGISTRY.gauge(
+    'chatao_requests_in_flight', 'Requests currently being served')
+USER_CACHE = REGISTRY.gauge(
+    'chatao_user_cache', 'User cache statistics', ('stat',))
+STREAM_SUBSCRIBERS = REGISTRY.gauge(
+    'chatao_stream_subscribers', 'Open SSE/long-poll subscriptions')
+RATE_LIMITED = REGISTRY.counter(
+    'chatao_rate_limited_total', 'Requests rejected by the rate limiter', ('route',))
+
+@REGISTRY.collector
+def collect_user_cache():
+    for stat, value in user_service.cache_stats().items():
+        USER_CACHE.set(value, stat)
+    STREAM_SUBSCRIBERS.set(message_service.hub.subscribers())
+
+@api.before_app_request
+def start_profile():
+    #perfil cProfile opcional (ver profiling.py); cobre a rota e a serialização, mas
+    #não o corpo das respostas em stream (NDJSON/SSE), gerado depois
+    if profiler.enabled and profiler.wanted(request.headers.get(PROFILE_HEADER)):
+        g.profile = profiler.start()
+
+@api.before_app_request
+def start_timer():
+    g.start = time.perf_counter()
+    REQUESTS_IN_FLIGHT.inc()
+
+def client_user() -> str:
+    #quem faz a requisição: o dono do token (assinatura conferida, sem banco) ou,
+    #nas rotas sem token (/auth), o email do corpo
+    token = request.headers.get('Authorization') or request.args.get('token')
+    if token:
+        claims = cypher_service.verify_token(token.removeprefix('Bearer '))
+        if claims:
+            return claims.get('sub')
+    data = request.get_json(silent=True)
+    return data.get('email') if isinstance(data, dict) else None
+
+@api.before_app_request
+def rate_limit():
+    endpoint = request.endpoint.rpartition('.')[2] if request.endpoint else None
+    if endpoint not in rate_limiter.rules:
+        return None
+    wait = rate_limiter.check(endpoint, client_user(), request.remote_addr)
+    if not wait:
+        return None
+    RATE_LIMITED.inc(endpoint)
+    logging.warning('[rate_limit] %s from %s limited for %.1fs', endpoint, request.remote_addr, wait)
+    response = jsonify({
+        'error': 'Too many requests',
+        'retry_after': math.ceil(wait),
+        'time': datetime.now().isoformat(),
+        'elapsed': (time.perf_counter() - g.start)
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(math.ceil(wait))
+    return response
+
+@api.app_errorhandler(HashQueueFull)
+def hash_queue_full(error):
+    #rajada de logins/cadastros: recusa na hora em vez de prender a thread da requisição
+    logging.warning('[%s] Password hashing queue is full', request.endpoint)
+    response = jsonify({
+        'error': 'Server busy, try again',
+        'retry_after': 1,
+        'time': datetime.now().isoformat(),
+        'elapsed': (time.perf_counter() - g.start)
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+@api.after_app_request
+def record_request(response):
+    #usa o padrão da rota (/user/<email>) e não a URL, para não explodir a cardinalidade
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    REQUEST_SECONDS.observe(time.perf_counter() - g.start, request.method, route)
+    REQUESTS_TOTAL.inc(request.method, route, str(response.status_code))
+    return response
+
+@api.after_app_request
+def stop_profile(response):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        path = profiler.stop(profile, request.method, route)
+        if path:
+            response.headers[PROFILE_HEADER] = os.path.basename(path)
+    return response
+
+@api.teardown_app_request
+def stop_timer(exc):
+    if 'start' in g:
+        REQUESTS_IN_FLIGHT.dec()
+    #a rota levantou uma exceção antes do after_request: o perfil ainda está ligado
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profiler.stop(profile, request.method, 'error')
+
+@api.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+# Paginação das listagens de mensagens (?after=<id>&limit=N)
+# Campos de cada listagem, escritos direto dos objetos para o JSON (ver serialize.py)
+RECEIVED_FIELDS = ('id', 'source', 'message', 'created_at', 'attachment')
+SENT_FIELDS = ('id', 'target', 'message', 'created_at', 'attachment')
+SEARCH_FIELDS = ('id', 'source', 'target', 'message', 'created_at', 'attachment')
+USER_FIELDS = ('email', 'nickname')
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+def page_args() -> tuple[int, int]:
+    after = request.args.get('after', type=int)
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    return after, max(1, min(limit, MAX_PAGE_SIZE))
+
+def wants_stream() -> bool:
+    #modo NDJSON opcional: ?stream=1 ou Accept: application/x-ndjson
+    return bool(request.args.get('stream', type=int)) or \
+        request.accept_mimetypes.best == 'application/x-ndjson'
+
+def ndjson(messages, fields) -> Response:
+    #escreve uma mensagem por linha conforme o cursor do SQLite avança
+    def generate():
+        for message in messages:
+            yield encode(message, fields) + '\n'
+    return Response(generate(), mimetype='application/x-ndjson')
+
+# Requisições condicionais: a ETag é a versão do recurso (contador de mudanças
+# mantido por triggers nos bancos) mais a variação pedida (query e formato)
+def etag_for(version) -> str:
+    if version is None:
+        return None
+    variant = zlib.crc32(request.query_string + (request.accept_mimetypes.best or '').encode())
+    return f'{version}-{variant:08x}'
+
+def not_modified(etag) -> Response:
+    #If-None-Match com a mesma ETag: 304 sem consultar a listagem
+    if etag is None or not request.if_none_match.contains_weak(etag):
+        return None
+    return with_etag(Response(status=304), etag)
+
+def with_etag(response, etag) -> Response:
+    if etag is not None:
+        response.set_etag(etag, weak=True)
+        #o cliente pode guardar a resposta, mas sempre revalida
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@api.route('/user', methods=['POST'])
 def create_user():
     start = datetime.now()
     data = request.json
@@ -96,24 +362,34 @@ def create_user():
         'elapsed': (datetime.now() - start).total_seconds()
     }), 201
 
-@app.route('/user', methods=['GET'])
+@api.route('/user', methods=['GET'])
 def list_users():
     start = datetime.now()
-    users = user_service.get_all_users()
-    if not users:
+    etag = etag_for(user_service.get_version())
+    response = not_modified(etag)
+    if response is not None:
+        return response
+
+    #paginação por email: ?after=<último email da página>&limit=N; ?q= busca por prefixo
+    prefix = request.args.get('q', '').strip()
+    after = request.args.get('after')
+    limit = max(1, min(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+    users = user_service.list_users(prefix, after, limit)
+    if users is None:
         logging.error('[GET:list_users] Error getting users')
         return jsonify({
             'error': 'Error getting users',
             'time': datetime.now().isoformat(),
             'elapsed': (datetime.now() - start).total_seconds()
             }), 500
-    return jsonify({
-        'users': [{'email': user.email, 'nickname': user.nickname} for user in users],
-        'time': datetime.now().isoformat(),
-        'elapsed': (datetime.now() - start).total_seconds()
-    })
+    return with_etag(list_response('users', users, USER_FIELDS,
+        next=users[-1].email if len(users) == limit else None,
+        #o total (sem filtro) vem de um contador, não de COUNT(*)
+        total=None if prefix else user_service.count_users(),
+        time=datetime.now().isoformat(),
+        elapsed=(datetime.now() - start).total_seconds()), etag)
 
-@app.route('/user/<email>', methods=['PUT'])
+@api.route('/user/<email>', methods=['PUT'])
 def update_user(email):
     start = datetime.now()
     data = request.json
@@ -144,7 +420,7 @@ def update_user(email):
         'elapsed': (datetime.now() - start).total_seconds()
     })
 
-@app.route('/user/<email>', methods=['DELETE'])
+@api.route('/user/<email>', methods=['DELETE'])
 def delete_user(email):
     start = datetime.now()
     if not user_service.get_user(email):
@@ -164,9 +440,14 @@ def delete_user(email):
     })
 
 
-@app.route('/user/<email>', methods=['GET'])
+@api.route('/user/<email>', methods=['GET'])
 def get_user(email):
     start = datetime.now()
+    etag = etag_for(user_service.get_version(email))
+    response = not_modified(etag)
+    if response is not None:
+        return response
+
     user = user_service.get_user(email)
     if not user:
         logging.error('[GET:get_user] User not found')
@@ -175,14 +456,14 @@ def get_user(email):
             'time': datetime.now().isoformat(),
             'elapsed': (datetime.now() - start).total_seconds()
             }), 404
-    return jsonify({
+    return with_etag(jsonify({
         'email': user.email,
         'nickname': user.nickname,
         'time': datetime.now().isoformat(),
         'elapsed': (datetime.now() - start).total_seconds()
-    })
+    }), etag)
 
-@app.route('/auth', methods=['POST'])
+@api.route('/auth', methods=['POST'])
 def authenticate():
     start = datetime.now()
     data = request.json
@@ -213,7 +494,7 @@ def authenticate():
         'elapsed': (datetime.now() - start).total_seconds()
     })
 
-@app.route('/message', methods=['POST'])
+@api.route('/message', methods=['POST'])
 def send_message():
     start = datetime.now()
     data = request.json
@@ -221,16 +502,26 @@ def send_message():
     source = data.get('source')
     target = data.get('target')
     message = data.get('message')
+    #hash de um anexo já enviado (POST /attachment/<email>); a mensagem pode ser só o anexo
+    attachment = data.get('attachment')
 
-    if not token or not source or not target or not message:
+    if not token or not source or not target or not (message or attachment):
         logging.error('[POST:send_message] Missing data')
         return jsonify({
             'error': 'Missing data',
             'time': datetime.now().isoformat(),
             'elapsed': (datetime.now() - start).total_seconds()
             }), 400
-    
-    ret = message_service.add_message(token, source, target, message)
+
+    if attachment and not attachment_service.can_read(token, source, attachment):
+        logging.error('[POST:send_message] Attachment not found')
+        return jsonify({
+            'error': 'Attachment not found',
+            'time': datetime.now().isoformat(),
+            'elapsed': (datetime.now() - start).total_seconds()
+            }), 404
+
+    ret = message_service.add_message(token, source, target, message or '', attachment=attachment)
 
     if not ret:
         logging.error('[POST:send_message] Error sending message')
@@ -247,62 +538,359 @@ def send_message():
         'elapsed': (datetime.now() - start).total_seconds()
     }), 201
 
-@app.route('/message/<email>', methods=['GET'])
-def get_messages(email):
+MAX_BATCH_SIZE = 1000
+
+@api.route('/message/batch', methods=['POST'])
+def send_messages():
     start = datetime.now()
+    data = request.json
     token = request.headers.get('Authorization')
-    messages = message_service.get_messages(token, email)
-    if not messages:
-        logging.error('[GET:get_messages] Error getting messages')
+    source = data.get('source')
+    items = data.get('messages')
+
+    if not token or not source or not isinstance(items, list) or not items:
+        logging.error('[POST:send_messages] Missing data')
         return jsonify({
-            'error': 'Error getting messages',
+            'error': 'Missing data',
+            'time': datetime.now().isoformat(),
+            'elapsed': (datetime.now() - start).total_seconds()
+            }), 400
+
+    if len(items) > MAX_BATCH_SIZE:
+        logging.error('[POST:send_messages] Batch too large')
+        return jsonify({
+            'error': f'Batch must have at most {MAX_BATCH_SIZE} messages',
+            'time': datetime.now().isoformat(),
+            'elapsed': (datetime.now() - start).total_seconds()
+            }), 400
+
+    results = message_service.add_messages(token, source, items)
+
+    if results is None:
+        logging.error('[POST:send_messages] Error sending messages')
+        return jsonify({
+            'error': 'Error sending messages',
             'time': datetime.now().isoformat(),
             'elapsed': (datetime.now() - start).total_seconds()
             }), 500
+
+    sent = sum(1 for result in results if 'error' not in result)
+    logging.info('[POST:send_messages] %s/%s messages sent', sent, len(results))
     return jsonify({
-        'messages': [{'source': message.source, 'message': message.message} for message in messages],
+        'results': results,
+        'sent': sent,
         'time': datetime.now().isoformat(),
         'elapsed': (datetime.now() - start).total_seconds()
-    })
+    }), 201 if sent == len(results) else 207 if sent else 400
 
-@app.route('/message/all/<email>', methods=['GET'])
-def get_all_messages(email):
+# Entrega em tempo real: SSE (Accept: text/event-stream) ou long-poll (?since=<id>)
+LONG_POLL_TIMEOUT = 25
+SSE_KEEPALIVE = 15
+
+def sse_event(message) -> str:
+    #None vira um comentário de keepalive, que mantém proxies com a conexão aberta
+    if message is None:
+        return ': keepalive\n\n'
+    data = encode(message, RECEIVED_FIELDS)
+    event_id = f'id: {message.id}\n' if message.id is not None else ''
+    return f'{event_id}event: message\ndata: {data}\n\n'
+
+@api.route('/message/stream/<email>', methods=['GET'])
+def stream_messages(email):
+    start = datetime.now()
+    #EventSource não envia cabeçalhos customizados, então o token pode vir na query
+    token = request.headers.get('Authorization') or request.args.get('token')
+    since = request.args.get('since', type=int)
+    if since is None:
+        since = request.headers.get('Last-Event-ID', type=int)
+
+    if request.accept_mimetypes.best == 'text/event-stream':
+        messages = message_service.follow_messages(token, email, since, SSE_KEEPALIVE)
+        if messages is None:
+            logging.error('[GET:stream_messages] Error streaming messages')
+            return jsonify({
+                'error': 'Error streaming messages',
+                'time': datetime.now().isoformat(),
+                'elapsed': (datetime.now() - start).total_seconds()
+                }), 500
+
+        def generate():
+            try:
+                yield 'retry: 3000\n\n'
+                for message in messages:
+                    yield sse_event(message)
+            finally:
+                messages.close()
+
+        return Response(generate(), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+        })
+
+    timeout = min(request.args.get('timeout', LONG_POLL_TIMEOUT, type=float), LONG_POLL_TIMEOUT)
+    messages = message_service.poll_messages(token, email, since, timeout, MAX_PAGE_SIZE)
+    if messages is None:
+        logging.error('[GET:stream_messages] Error polling messages')
+        return jsonify({
+            'error': 'Error polling messages',
+            'time': datetime.now().isoformat(),
+            'elapsed': (datetime.now() - start).total_seconds()
+            }), 500
+    ids = [message.id for message in messages if message.id is not None]
+    return list_response('messages', messages, RECEIVED_FIELDS,
+        next=ids[-1] if ids else since,
+        time=datetime.now().isoformat(),
+        elapsed=(datetime.now() - start).total_seconds())
+
+def list_messages(name, email, box, stream, page, fields) -> Response:
+    #corpo comum das listagens de mensagens: ETag da caixa ('in'/'out'), modo
+    #NDJSON com stream(token, email, after, limit) ou página com page(...) e next
     start = datetime.now()
     token = request.headers.get('Authorization')
-    messages = message_service.get_messages(token, email)
-    if not messages:
-        logging.error('[GET:get_all_messages] Error getting messages')
+    #a versão é lida antes da listagem: se algo chegar no meio, a próxima ETag muda
+    etag = etag_for(message_service.get_version(token, email, box))
+    response = not_modified(etag)
+    if response is not None:
+        return response
+
+    if wants_stream():
+        after = request.args.get('after', type=int)
+        limit = request.args.get('limit', type=int)
+        messages = stream(token, email, after, limit)
+    else:
+        after, limit = page_args()
+        messages = page(token, email, after, limit)
+    if messages is None:
+        logging.error('[%s] Error getting messages', name)
         return jsonify({
             'error': 'Error getting messages',
             'time': datetime.now().isoformat(),
             'elapsed': (datetime.now() - start).total_seconds()
             }), 500
+
+    if wants_stream():
+        return with_etag(ndjson(messages, fields), etag)
+    return with_etag(list_response('messages', messages, fields,
+        next=messages[-1].id if len(messages) == limit else None,
+        time=datetime.now().isoformat(),
+        elapsed=(datetime.now() - start).total_seconds()), etag)
+
+@api.route('/message/<email>', methods=['GET'])
+def get_messages(email):
+    return list_messages('GET:get_messages', email, 'in',
+                         message_service.stream_messages, message_service.get_messages, RECEIVED_FIELDS)
+
+@api.route('/message/all/<email>', methods=['GET'])
+def get_all_messages(email):
+    return list_messages('GET:get_all_messages', email, 'in',
+                         message_service.stream_messages, message_service.get_messages, RECEIVED_FIELDS)
+
+@api.route('/message/sent/<email>', methods=['GET'])
+def get_sent_messages(email):
+    return list_messages('GET:get_sent_messages', email, 'out',
+                         message_service.stream_sent_messages, message_service.get_sent_messages, SENT_FIELDS)
+
+@api.route('/message/search/<email>', methods=['GET'])
+def search_messages(email):
+    start = datetime.now()
+    token = request.headers.get('Authorization')
+    query = request.args.get('q', '').strip()
+    #ordenado por relevância, então a paginação é por deslocamento
+    offset = max(0, request.args.get('offset', 0, type=int))
+    _, limit = page_args()
+
+    if not query:
+        logging.error('[GET:search_messages] Missing query')
+        return jsonify({
+            'error': 'Missing query',
+            'time': datetime.now().isoformat(),
+            'elapsed': (datetime.now() - start).total_seconds()
+            }), 400
+
+    messages = message_service.search_messages(token, email, query, offset, limit)
+    if messages is None:
+        logging.error('[GET:search_messages] Error searching messages')
+        return jsonify({
+            'error': 'Error searching messages',
+            'time': datetime.now().isoformat(),
+            'elapsed': (datetime.now() - start).total_seconds()
+            }), 500
+    return list_response('messages', messages, SEARCH_FIELDS,
+        next=offset + limit if len(messages) == limit else None,
+        time=datetime.now().isoformat(),
+        elapsed=(datetime.now() - start).total_seconds())
+
+@api.route('/conversations/<email>', methods=['GET'])
+def get_conversations(email):
+    start = datetime.now()
+    token = request.headers.get('Authorization')
+    _, limit = page_args()
+    result = message_service.get_conversations(token, email, limit)
+    if result is None:
+        logging.error('[GET:get_conversations] Error getting conversations')
+        return jsonify({
+            'error': 'Error getting conversations',
+            'time': datetime.now().isoformat(),
+            'elapsed': (datetime.now() - start).total_seconds()
+            }), 500
+    conversations, unread = result
     return jsonify({
-        'messages': [{'source': message.source, 'message': message.message} for message in messages],
+        'conversations': conversations,
+        'unread': unread,
         'time': datetime.now().isoformat(),
         'elapsed': (datetime.now() - start).total_seconds()
     })
 
-@app.route('/message/sent/<email>', methods=['GET'])
-def get_sent_messages(email):
+@api.route('/conversations/<email>/read', methods=['POST'])
+def mark_read(email):
     start = datetime.now()
     token = request.headers.get('Authorization')
-    messages = message_service.get_messages(token, email)
-    if not messages:
-        logging.error('[GET:get_sent_messages] Error getting messages')
+    data = request.get_json(silent=True) or {}
+    #sem peer, marca todas as conversas como lidas
+    peer = data.get('peer')
+
+    if not message_service.mark_read(token, email, peer):
+        logging.error('[POST:mark_read] Error marking conversation as read')
         return jsonify({
-            'error': 'Error getting messages',
+            'error': 'Error marking conversation as read',
             'time': datetime.now().isoformat(),
             'elapsed': (datetime.now() - start).total_seconds()
             }), 500
     return jsonify({
-        'messages': [{'target': message.target, 'message': message.message} for message in messages],
+        'message': 'Conversation marked as read',
         'time': datetime.now().isoformat(),
         'elapsed': (datetime.now() - start).total_seconds()
     })
 
+# Anexos: o arquivo é enviado em partes (retomável) e depois referenciado numa
+# mensagem pelo hash. POST cria o envio, PATCH grava uma parte a partir de
+# Upload-Offset, GET diz quanto já chegou (para retomar)
+ATTACHMENT_ID = re.compile(r'[0-9a-f]{64}')
+
+def upload_body(upload, start) -> dict:
+    return {
+        'upload': upload['id'],
+        'offset': upload['received'],
+        'size': upload['size'],
+        'attachment': upload.get('attachment'),
+        'time': datetime.now().isoformat(),
+        'elapsed': (datetime.now() - start).total_seconds()
+    }
+
+@api.route('/attachment/<email>', methods=['POST'])
+def create_upload(email):
+    start = datetime.now()
+    token = request.headers.get('Authorization')
+    data = request.get_json(silent=True) or {}
+    size = data.get('size')
+
+    if not token or not isinstance(size, int) or size <= 0:
+        logging.error('[POST:create_upload] Missing data')
+        return jsonify({
+            'error': 'Missing data',
+            'time': datetime.now().isoformat(),
+            'elapsed': (datetime.now() - start).total_seconds()
+            }), 400
+
+    if size > attachment_service.max_size:
+        logging.error('[POST:create_upload] Attachment too large')
+        return jsonify({
+            'error': 'Attachment too large',
+            'max_size': attachment_service.max_size,
+            'time': datetime.now().isoformat(),
+            'elapsed': (datetime.now() - start).total_seconds()
+            }), 413
+
+    upload = attachment_service.create_upload(token, email, size, data.get('name'), data.get('content_type'))
+    if upload is None:
+        logging.error('[POST:create_upload] Error creating upload')
+        return jsonify({
+            'error': 'Error creating upload',
+            'time': datetime.now().isoformat(),
+            'elapsed': (datetime.now() - start).total_seconds()
+            }), 500
+    return jsonify(upload_body(upload, start)), 201
+
+@api.route('/attachment/<email>/upload/<upload_id>', methods=['GET'])
+def get_upload(email, upload_id):
+    start = datetime.now()
+    token = request.headers.get('Authorization')
+    upload = attachment_service.get_upload(token, email, upload_id)
+    if upload is None:
+        logging.error('[GET:get_upload] Upload not found')
+        return jsonify({
+            'error': 'Upload not found',
+            'time': datetime.now().isoformat(),
+            'elapsed': (datetime.now() - start).total_seconds()
+            }), 404
+    return jsonify(upload_body(upload, start))
+
+@api.route('/attachment/<email>/upload/<upload_id>', methods=['PATCH'])
+def write_upload(email, upload_id):
+    start = datetime.now()
+    token = request.headers.get('Authorization')
+    offset = request.headers.get('Upload-Offset', type=int)
+    upload = attachment_service.get_upload(token, email, upload_id)
+    if upload is None:
+        logging.error('[PATCH:write_upload] Upload not found')
+        return jsonify({
+            'error': 'Upload not found',
+            'time': datetime.now().isoformat(),
+            'elapsed': (datetime.now() - start).total_seconds()
+            }), 404
+
+    #a parte tem que continuar de onde o servidor parou; o offset atual vai na
+    #resposta para o cliente retomar
+    length = request.content_length
+    if offset != upload['received'] or (length is not None and offset + length > upload['size']):
+        logging.error('[PATCH:write_upload] Offset mismatch')
+        return jsonify({
+            'error': 'Offset mismatch',
+            'offset': upload['received'],
+            'size': upload['size'],
+            'time': datetime.now().isoformat(),
+            'elapsed': (datetime.now() - start).total_seconds()
+            }), 409
+
+    #request.stream: o corpo vai do socket para o arquivo em blocos
+    upload = attachment_service.write_chunk(upload, offset, request.stream)
+    if upload is None:
+        logging.error('[PATCH:write_upload] Error writing upload')
+        return jsonify({
+            'error': 'Error writing upload',
+            'time': datetime.now().isoformat(),
+            'elapsed': (datetime.now() - start).total_seconds()
+            }), 409
+    return jsonify(upload_body(upload, start))
+
+@api.route('/attachment/<email>/<attachment>', methods=['GET'])
+def get_attachment(email, attachment):
+    start = datetime.now()
+    token = request.headers.get('Authorization') or request.args.get('token')
+    result = None
+    if ATTACHMENT_ID.fullmatch(attachment):
+        result = attachment_service.get_attachment(token, email, attachment)
+    if result is None:
+        logging.error('[GET:get_attachment] Attachment not found')
+        return jsonify({
+            'error': 'Attachment not found',
+            'time': datetime.now().isoformat(),
+            'elapsed': (datetime.now() - start).total_seconds()
+            }), 404
+
+    #send_file entrega o arquivo pelo wsgi.file_wrapper (sendfile no gunicorn) e
+    #responde Range com 206; o conteúdo nunca muda, então a ETag é o próprio hash
+    path, metadata = result
+    response = send_file(os.path.abspath(path),
+                         mimetype=metadata['content_type'] or 'application/octet-stream',
+                         download_name=metadata['name'] or attachment,
+                         conditional=True, etag=attachment, max_age=31536000)
+    response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
+
 if __name__ == '__main__':
-    app.run(debug=True)
+    config = Config.from_env()
+    create_app(config).run(host=config.host, port=config.port, debug=True)
 
 # Agora que a aplicação está pronta, vamos testar a API
 # Primeiro, vamos criar um usuário
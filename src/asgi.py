@@ -0,0 +1,170 @@
+# Este arquivo define a variante asyncio (ASGI) do servidor.
+# A entrega em tempo real (/message/stream/<email>, SSE e long-poll) é atendida
+# direto no event loop, então milhares de clientes ociosos não ocupam uma thread
+# cada. As demais rotas reaproveitam o app Flask: cada requisição roda numa thread
+# do executor limitado (service.executor), que também recebe todo o acesso
+# bloqueante ao SQLite, então até async_workers requisições andam em paralelo.
+#
+# Execução: python serve.py --asgi (ou uvicorn asgi:application --app-dir src)
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from datetime import datetime
+from urllib.parse import parse_qs
+import asyncio
+import inspect
+import json
+import logging
+import re
+import time
+
+from app import (create_app, sse_event, LONG_POLL_TIMEOUT, MAX_PAGE_SIZE, RECEIVED_FIELDS,
+                 REQUEST_SECONDS, REQUESTS_TOTAL, SSE_KEEPALIVE)
+from config import Config
+from serialize import list_body
+from service.executor import EXECUTOR
+
+STREAM_ROUTE = re.compile(r'^/message/stream/([^/]+)$')
+STREAM_RULE = '/message/stream/<email>'
+
+class ExecutorWsgiInstance(WsgiToAsgiInstance):
+    #o run_wsgi_app do asgiref é thread_sensitive: todas as requisições dividiriam
+    #uma única thread. Aqui cada uma vai para uma thread do executor limitado
+    #(o pool é lido a cada chamada, pois o lifespan o reconfigura)
+    _run_wsgi_app = staticmethod(inspect.unwrap(WsgiToAsgiInstance.run_wsgi_app))
+
+    async def run_wsgi_app(self, body):
+        run = sync_to_async(self._run_wsgi_app, thread_sensitive=False, executor=EXECUTOR.pool)
+        return await run(self, body)
+
+class ExecutorWsgiToAsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await ExecutorWsgiInstance(self.wsgi_application, self.duplicate_header_limit)(scope, receive, send)
+
+# Cada processo do servidor importa este módulo e monta seus próprios serviços
+config = Config.from_env()
+app = create_app(config)
+message_service = app.extensions['chatao']['message_service']
+wsgi = ExecutorWsgiToAsgi(app)
+
+def _query(scope) -> dict:
+    return {key: values[-1] for key, values in parse_qs(scope['query_string'].decode('latin-1')).items()}
+
+def _headers(scope) -> dict:
+    return {key.decode('latin-1').lower(): value.decode('latin-1') for key, value in scope['headers']}
+
+def _number(value, cast=int):
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return None
+
+async def _send_json(send, status: int, body) -> None:
+    #body pode vir já codificado (serialize.list_body)
+    payload = body if isinstance(body, bytes) else json.dumps(body).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(payload)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': payload})
+
+async def _wait_disconnect(receive) -> None:
+    while True:
+        event = await receive()
+        if event['type'] == 'http.disconnect':
+            return
+
+async def _sse(send, receive, messages) -> None:
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': b'retry: 3000\n\n', 'more_body': True})
+
+    #corre cada próxima mensagem contra a desconexão do cliente
+    disconnected = asyncio.ensure_future(_wait_disconnect(receive))
+    try:
+        while True:
+            next_message = asyncio.ensure_future(messages.__anext__())
+            done, _ = await asyncio.wait({next_message, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            if next_message not in done:
+                next_message.cancel()
+                await asyncio.gather(next_message, return_exceptions=True)
+                break
+            event = sse_event(next_message.result())
+            await send({'type': 'http.response.body', 'body': event.encode('utf-8'), 'more_body': True})
+    finally:
+        disconnected.cancel()
+        await messages.aclose()
+
+async def stream_messages(scope, receive, send, email) -> int:
+    start = datetime.now()
+    query = _query(scope)
+    headers = _headers(scope)
+    #EventSource não envia cabeçalhos customizados, então o token pode vir na query
+    token = headers.get('authorization') or query.get('token')
+    since = _number(query.get('since'))
+    if since is None:
+        since = _number(headers.get('last-event-id'))
+
+    if 'text/event-stream' in headers.get('accept', ''):
+        messages = await message_service.afollow_messages(token, email, since, SSE_KEEPALIVE)
+        if messages is None:
+            logging.error('[GET:stream_messages] Error streaming messages')
+            await _send_json(send, 500, {
+                'error': 'Error streaming messages',
+                'time': datetime.now().isoformat(),
+                'elapsed': (datetime.now() - start).total_seconds()
+            })
+            return 500
+        await _sse(send, receive, messages)
+        return 200
+
+    timeout = min(_number(query.get('timeout'), float) or LONG_POLL_TIMEOUT, LONG_POLL_TIMEOUT)
+    messages = await message_service.apoll_messages(token, email, since, timeout, MAX_PAGE_SIZE)
+    if messages is None:
+        logging.error('[GET:stream_messages] Error polling messages')
+        await _send_json(send, 500, {
+            'error': 'Error polling messages',
+            'time': datetime.now().isoformat(),
+            'elapsed': (datetime.now() - start).total_seconds()
+        })
+        return 500
+    ids = [message.id for message in messages if message.id is not None]
+    await _send_json(send, 200, list_body('messages', messages, RECEIVED_FIELDS,
+        next=ids[-1] if ids else since,
+        time=datetime.now().isoformat(),
+        elapsed=(datetime.now() - start).total_seconds()))
+    return 200
+
+async def lifespan(receive, send) -> None:
+    while True:
+        event = await receive()
+        if event['type'] == 'lifespan.startup':
+            #um punhado de threads atende todo o trabalho bloqueante, inclusive o app Flask
+            EXECUTOR.configure(config.async_workers)
+            logging.info('[ASGI] Started with %s blocking workers', EXECUTOR.max_workers)
+            await send({'type': 'lifespan.startup.complete'})
+        elif event['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def application(scope, receive, send) -> None:
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+
+    match = STREAM_ROUTE.match(scope.get('path', ''))
+    if scope['type'] == 'http' and scope['method'] == 'GET' and match:
+        start = time.perf_counter()
+        status = await stream_messages(scope, receive, send, match.group(1))
+        REQUEST_SECONDS.observe(time.perf_counter() - start, 'GET', STREAM_RULE)
+        REQUESTS_TOTAL.inc('GET', STREAM_RULE, str(status))
+        return
+
+    await wsgi(scope, receive, send)
@@ -0,0 +1,337 @@
+#!/bin/env python3
+# Este arquivo reúne os benchmarks da API. Cada execução sobe a aplicação com
+# bancos temporários, popula usuários e mensagens e mede vazão e latência
+# (p50/p95/p99) de cada rota com vários clientes concorrentes, além de
+# micro-benchmarks das camadas de storage e do CypherService. O resultado sai
+# em JSON, para comparar execuções (antes/depois de uma mudança).
+#
+#   python bench.py run -o antes.json                  # rotas + micro-benchmarks
+#   python bench.py run --clients 16 --http -o depois.json
+#   python bench.py compare antes.json depois.json     # variação por medida
+#
+# As demais opções vêm de Config.from_env() (CHATAO_*), ex.: CHATAO_WRITE_BEHIND=1 ou CHATAO_DATABASE=1.
+# A limitação de taxa fica desligada e os caminhos dos bancos são sempre temporários.
+
+from config import Config
+from domain.message import Message
+from domain.user import User
+import argparse
+import http.client
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+PASSWORD = 'benchmark-password'
+
+def progress(text: str, *args) -> None:
+    #andamento no stderr (o stdout fica só com o JSON); a aplicação loga em WARNING
+    print('[bench] ' + text % args, file=sys.stderr, flush=True)
+
+def summarize(latencies: list[float], elapsed: float, errors: int = 0) -> dict:
+    #latências em milissegundos; vazão em operações por segundo
+    latencies = sorted(latencies)
+    count = len(latencies)
+
+    def percentile(p: float) -> float:
+        if not count:
+            return None
+        return round(latencies[min(count - 1, int(p * count))] * 1000, 3)
+
+    return {
+        'count': count,
+        'errors': errors,
+        'throughput': round(count / elapsed, 1) if elapsed else None,
+        'mean': round(sum(latencies) / count * 1000, 3) if count else None,
+        'p50': percentile(0.50),
+        'p95': percentile(0.95),
+        'p99': percentile(0.99),
+        'max': round(latencies[-1] * 1000, 3) if count else None,
+    }
+
+def seed(app, users: int, messages: int, batch_size: int = 1000) -> list[str]:
+    #grava direto nos storages: o hash da senha é calculado uma vez só
+    services = app.extensions['chatao']
+    user_storage = services['user_storage']
+    message_storage = services['message_storage']
+    password = services['cypher_service'].cypher_password(PASSWORD)
+    emails = [f'user{i}@bench.local' for i in range(users)]
+    for email in emails:
+        user_storage.add_user(User(email, password, email.split('@')[0]))
+
+    randomizer = random.Random(0)
+    pending = []
+    for i in range(messages):
+        source, target = randomizer.sample(emails, 2) if users > 1 else (emails[0], emails[0])
+        pending.append(Message(source, target, f'mensagem {i} de {source} para {target}'))
+        if len(pending) >= batch_size:
+            message_storage.add_messages(pending)
+            pending = []
+    if pending:
+        message_storage.add_messages(pending)
+    message_storage.flush()
+    return emails
+
+class TestClient:
+    #cliente em processo (sem rede): mede a pilha Flask + serviços + SQLite
+    def __init__(self, app) -> None:
+        self.client = app.test_client()
+
+    def request(self, method: str, path: str, body: dict = None, headers: dict = None) -> int:
+        response = self.client.open(path, method=method, json=body, headers=headers)
+        response.close()
+        return response.status_code
+
+class HTTPClient:
+    #cliente HTTP com keep-alive contra o servidor de bench (--http)
+    def __init__(self, host: str, port: int) -> None:
+        self.connection = http.client.HTTPConnection(host, port, timeout=30)
+
+    def request(self, method: str, path: str, body: dict = None, headers: dict = None) -> int:
+        headers = dict(headers or {})
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        self.connection.request(method, path, payload, headers)
+        response = self.connection.getresponse()
+        response.read()
+        return response.status
+
+def scenarios(emails: list[str], tokens: dict) -> dict:
+    #rota -> função(cliente, i) que faz uma requisição e devolve o status
+    def user(i):
+        return emails[i % len(emails)]
+
+    def auth(i):
+        return {'Authorization': tokens[user(i)]}
+
+    def peer(i):
+        return emails[(i + 1) % len(emails)]
+
+    return {
+        'list_users': lambda client, i: client.request('GET', '/user?limit=100'),
+        'search_users': lambda client, i: client.request('GET', f'/user?q={user(i)[:5]}'),
+        'get_user': lambda client, i: client.request('GET', f'/user/{user(i)}'),
+        'authenticate': lambda client, i: client.request(
+            'POST', '/auth', {'email': user(i), 'password': PASSWORD}),
+        'send_message': lambda client, i: client.request(
+            'POST', '/message', {'source': user(i), 'target': peer(i), 'message': f'bench {i}'}, auth(i)),
+        'get_messages': lambda client, i: client.request('GET', f'/message/{user(i)}?limit=50', headers=auth(i)),
+        'get_all_messages': lambda client, i: client.request('GET', f'/message/all/{user(i)}', headers=auth(i)),
+        'get_sent_messages': lambda client, i: client.request('GET', f'/message/sent/{user(i)}?limit=50', headers=auth(i)),
+        'get_conversations': lambda client, i: client.request('GET', f'/conversations/{user(i)}', headers=auth(i)),
+    }
+
+def run_route(make_client, scenario, requests: int, clients: int) -> dict:
+    #clients threads dividem requests requisições; cada uma tem seu próprio cliente
+    latencies = [[] for _ in range(clients)]
+    errors = [0] * clients
+    barrier = threading.Barrier(clients + 1)
+
+    def worker(index):
+        client = make_client()
+        barrier.wait()
+        for i in range(index, requests, clients):
+            begin = time.perf_counter()
+            try:
+                status = scenario(client, i)
+            except Exception as e:
+                logging.error('[bench] Request failed: %s', e)
+                status = None
+            latencies[index].append(time.perf_counter() - begin)
+            if status is None or status >= 400:
+                errors[index] += 1
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(clients)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    begin = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - begin
+    return summarize([value for values in latencies for value in values], elapsed, sum(errors))
+
+def serve(app):
+    #servidor werkzeug com threads numa porta livre, para medir também o HTTP
+    from werkzeug.serving import make_server
+    #sem uma linha de log de acesso por requisição medida
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def bench_routes(app, emails: list[str], args) -> dict:
+    cypher_service = app.extensions['chatao']['cypher_service']
+    tokens = {email: cypher_service.create_token(email) for email in emails}
+    server = None
+    if args.http:
+        server = serve(app)
+        make_client = lambda: HTTPClient('127.0.0.1', server.server_port)
+    else:
+        make_client = lambda: TestClient(app)
+
+    results = {}
+    try:
+        for name, scenario in scenarios(emails, tokens).items():
+            if args.routes and name not in args.routes:
+                continue
+            #/auth calcula o hash da senha a cada chamada: bem menos requisições
+            requests = max(1, args.requests // 10) if name == 'authenticate' else args.requests
+            for i in range(min(args.warmup, requests)):
+                scenario(make_client(), i)
+            results[name] = run_route(make_client, scenario, requests, args.clients)
+            progress('%s: %s', name, results[name])
+    finally:
+        if server is not None:
+            server.shutdown()
+    return results
+
+def measure(fn, iterations: int) -> dict:
+    #micro-benchmark: uma chamada por vez, sem concorrência
+    latencies = []
+    begin = time.perf_counter()
+    for i in range(iterations):
+        start = time.perf_counter()
+        fn(i)
+        latencies.append(time.perf_counter() - start)
+    return summarize(latencies, time.perf_counter() - begin)
+
+def bench_micro(app, emails: list[str], args) -> dict:
+    services = app.extensions['chatao']
+    user_storage = services['user_storage']
+    message_storage = services['message_storage']
+    cypher_service = services['cypher_service']
+    stored = cypher_service.cypher_password(PASSWORD)
+    token = cypher_service.create_token(emails[0])
+    iterations = args.iterations
+
+    def user(i):
+        return emails[i % len(emails)]
+
+    def peer(i):
+        return emails[(i + 1) % len(emails)]
+
+    micro = {
+        'MessageStorage.add_message': (lambda i: message_storage.add_message(
+            Message(user(i), peer(i), f'micro {i}')), iterations),
+        'MessageStorage.get_messages': (lambda i: message_storage.get_messages(user(i), None, 50), iterations),
+        'MessageStorage.get_sent_messages': (lambda i: message_storage.get_sent_messages(user(i), None, 50), iterations),
+        'MessageStorage.get_conversations': (lambda i: message_storage.get_conversations(user(i), 50), iterations),
+        'UserStorage.get_user': (lambda i: user_storage.get_user(user(i)), iterations),
+        'UserStorage.list_users': (lambda i: user_storage.list_users(None, None, 100), iterations),
+        'UserStorage.list_users_prefix': (lambda i: user_storage.list_users(user(i)[:5], None, 100), iterations),
+        'CypherService.create_token': (lambda i: cypher_service.create_token(user(i)), iterations),
+        'CypherService.verify_token': (lambda i: cypher_service.verify_token(token), iterations),
+        #funções de derivação de senha são lentas de propósito
+        'CypherService.cypher_password': (lambda i: cypher_service.cypher_password(PASSWORD), max(1, iterations // 100)),
+        'CypherService.verify_password': (lambda i: cypher_service.verify_password(PASSWORD, stored), max(1, iterations // 100)),
+    }
+    results = {}
+    for name, (fn, count) in micro.items():
+        if args.routes and name not in args.routes:
+            continue
+        results[name] = measure(fn, count)
+        progress('%s: %s', name, results[name])
+    return results
+
+def run(args) -> bool:
+    from app import create_app
+
+    with tempfile.TemporaryDirectory(prefix='chatao-bench-') as directory:
+        config = Config.from_env(
+            user_db=os.path.join(directory, 'user.db'),
+            message_db=os.path.join(directory, 'message.db'),
+            attachment_db=os.path.join(directory, 'attachment.db'),
+            attachment_dir=os.path.join(directory, 'attachments'),
+            #CHATAO_DATABASE liga o banco único, também num arquivo temporário
+            database=os.path.join(directory, 'chatao.db') if os.environ.get('CHATAO_DATABASE') else '',
+            rate_limit_db='',
+            rate_limits='',
+            jwt_secret=os.environ.get('CHATAO_JWT_SECRET') or 'benchmark-secret',
+            log_level=os.environ.get('CHATAO_LOG_LEVEL', 'WARNING'),
+        )
+        app = create_app(config)
+        try:
+            begin = time.perf_counter()
+            emails = seed(app, args.users, args.messages)
+            progress('Seeded %s users and %s messages in %.2fs',
+                     len(emails), args.messages, time.perf_counter() - begin)
+            results = {
+                'time': datetime.now().isoformat(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'options': {name: value for name, value in vars(args).items() if name not in ('command', 'output')},
+                'config': {name: getattr(config, name) for name in
+                           ('database', 'pool_size', 'write_behind', 'batch_size', 'message_shards', 'hash_workers',
+                            'hash_algorithm', 'scrypt_n', 'pbkdf2_iterations')},
+                'routes': {} if args.skip_routes else bench_routes(app, emails, args),
+                'micro': {} if args.skip_micro else bench_micro(app, emails, args),
+            }
+        finally:
+            app.extensions['chatao']['message_storage'].close()
+            app.extensions['chatao']['user_storage'].close()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return True
+
+def compare(args) -> bool:
+    #variação percentual de vazão e latência entre duas execuções
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    print(f"{'benchmark':<40} {'metric':<10} {'before':>12} {'after':>12} {'change':>9}")
+    for group in ('routes', 'micro'):
+        for name, old in before.get(group, {}).items():
+            new = after.get(group, {}).get(name)
+            if new is None:
+                continue
+            for metric in ('throughput', 'p50', 'p95', 'p99'):
+                if not old.get(metric) or new.get(metric) is None:
+                    continue
+                change = (new[metric] - old[metric]) / old[metric] * 100
+                print(f'{name:<40} {metric:<10} {old[metric]:>12} {new[metric]:>12} {change:>+8.1f}%')
+    return True
+
+COMMANDS = {
+    'run': run,
+    'compare': compare,
+}
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Chatao benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('run', help='seed temporary databases and benchmark routes and storages')
+    command.add_argument('--users', type=int, default=100)
+    command.add_argument('--messages', type=int, default=10000)
+    command.add_argument('--clients', type=int, default=8, help='concurrent clients per route')
+    command.add_argument('--requests', type=int, default=1000, help='requests per route (/auth runs a tenth)')
+    command.add_argument('--warmup', type=int, default=10)
+    command.add_argument('--iterations', type=int, default=1000, help='calls per micro-benchmark')
+    command.add_argument('--http', action='store_true', help='go through a local HTTP server instead of the test client')
+    command.add_argument('--routes', nargs='*', help='only these routes/micro-benchmarks')
+    command.add_argument('--skip-routes', action='store_true')
+    command.add_argument('--skip-micro', action='store_true')
+    command.add_argument('-o', '--output', help='write the JSON results here (default: stdout)')
+    command = commands.add_parser('compare', help='compare two JSON results')
+    command.add_argument('before')
+    command.add_argument('after')
+    args = parser.parse_args()
+    return 0 if COMMANDS[args.command](args) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,101 @@
+# Este arquivo define a configuração da aplicação. Cada opção tem um valor padrão
+# e pode ser sobrescrita pela variável de ambiente CHATAO_<NOME>.
+
+import os
+
+class Config:
+    # bancos de dados
+    user_db = 'user.db'
+    message_db = 'message.db'
+    message_shards = 1 # com N > 1, message.db vira message.0.db ... message.<N-1>.db
+    pool_size = 8
+    # banco único: com um caminho aqui, usuários e mensagens ficam no mesmo arquivo
+    # (ignora user_db/message_db), com integridade entre eles e remoção em cascata
+    database = ''
+    # escrita em lote das mensagens
+    write_behind = False
+    batch_size = 100
+    flush_interval = 0.05
+    # arquivo morto: mensagens com mais de archive_after dias saem da tabela quente
+    # (python manage.py archive); 0 desliga
+    archive_after = 0.0
+    # anexos: arquivos em attachment_dir (endereçados pelo SHA-256), metadados em
+    # attachment_db; x_sendfile delega o envio ao proxy (nginx/apache)
+    attachment_dir = 'attachments'
+    attachment_db = 'attachment.db'
+    attachment_max_size = 100 * 1024 * 1024
+    x_sendfile = False
+    # autenticação
+    jwt_secret = ''
+    token_ttl = 3600
+    token_cache_size = 10000
+    hash_workers = 2
+    # logins/cadastros esperando um worker de hash; além disso a resposta é 503
+    hash_queue = 2
+    # custo do hash de senha (scrypt ou pbkdf2_sha256); ao mudar, as senhas com
+    # parâmetros antigos são refeitas no próximo login
+    hash_algorithm = 'scrypt'
+    scrypt_n = 2 ** 14
+    scrypt_r = 8
+    scrypt_p = 1
+    pbkdf2_iterations = 600_000
+    # cache de usuários
+    user_cache_size = 10000
+    user_cache_ttl = 60.0
+    invalidation_interval = 1.0
+    # limitação de taxa por rota (nome da função da rota): escopo=fichas/segundos;
+    # vazio desliga. Os baldes ficam no SQLite rate_limit_db, compartilhado entre
+    # os workers; vazio: em memória com um worker só, ou ratelimit.db ao lado de
+    # user_db com vários (cada processo teria seus próprios baldes)
+    rate_limits = ('authenticate: ip=30/60, user=10/60; create_user: ip=20/3600; '
+                   'send_message: user=60/10, ip=300/10; send_messages: user=10/10, ip=50/10')
+    rate_limit_db = ''
+    # quantos proxies reversos (nginx...) ficam na frente: o IP do cliente e o
+    # esquema vêm de X-Forwarded-For/-Proto (werkzeug ProxyFix). Sem isso, atrás de
+    # um proxy todos os clientes dividiriam o balde por IP do próprio proxy
+    trusted_proxies = 0
+    # entrega em tempo real: o hub de cada worker só vê as mensagens do próprio
+    # processo; quem espera (SSE/long-poll) confere a cada wake_interval segundos se
+    # outro worker gravou algo para ele (0 desliga: um worker só)
+    wake_interval = 0.5
+    # logs
+    log_level = 'INFO'
+    log_format = 'console'
+    # diagnóstico: consultas SQLite acima de slow_query_ms vão para o log com o plano
+    # (0 desliga); perfil cProfile das requisições com o cabeçalho X-Chatao-Profile
+    # igual a profile_token ou de uma fração profile_rate delas, gravado em profile_dir
+    # (vazio: no log)
+    slow_query_ms = 0.0
+    profile_token = ''
+    profile_rate = 0.0
+    profile_dir = ''
+    # servidor
+    host = '127.0.0.1'
+    port = 5000
+    workers = 2
+    threads = 8
+    async_workers = 8
+
+    def __init__(self, **options) -> None:
+        for name, value in options.items():
+            if not hasattr(Config, name):
+                raise ValueError(f'unknown config option {name}')
+            setattr(self, name, value)
+
+    @classmethod
+    def from_env(cls, environ=None, **overrides) -> 'Config':
+        #converte cada variável para o tipo do valor padrão
+        environ = os.environ if environ is None else environ
+        options = {}
+        for name, default in vars(Config).items():
+            if name.startswith('_') or callable(default) or isinstance(default, classmethod):
+                continue
+            raw = environ.get(f'CHATAO_{name.upper()}')
+            if raw is None:
+                continue
+            if isinstance(default, bool):
+                options[name] = raw.lower() in ('1', 'true', 'yes', 'on')
+            else:
+                options[name] = type(default)(raw)
+        options.update(overrides)
+        return cls(**options)
@@ -1,13 +1,22 @@
 # Este é o arquivo onde definimos o domínio message, que é responsável por armazenar as mensagens enviadas pelos usuários.
 
-from datetime import datetime
-
 class Message:
-    def __init__(self, source, target, message) -> None:
+    # __slots__: sem __dict__ por instância, as listagens grandes alocam bem menos
+    __slots__ = ('id', 'source', 'target', 'message', 'created_at', 'attachment')
+
+    def __init__(self, source, target, message, id=None, created_at=None, attachment=None) -> None:
+        self.id = id
         self.source = source
         self.target = target
         self.message = message
-        self.when = datetime.now()
+        #vem do banco (created_at); fica None até a mensagem ser gravada
+        self.created_at = created_at
+        #hash do anexo (storage.attachment), ou None
+        self.attachment = attachment
+
+    @property
+    def when(self):
+        return self.created_at
 
     def __str__(self) -> str:
-        return f"[{self.when}] {self.source} -> {self.target}: {self.message}"
\ No newline at end of file
+        return f"[{self.when}] {self.source} -> {self.target}: {self.message}"
@@ -1,10 +1,14 @@
 # Este é o arquivo onde definimos o domínio user, que é responsável por armazenar os usuários da aplicação.
 
 class User:
-    def __init__(self, email: str, password: str, nickname: str):
+    # __slots__: sem __dict__ por instância (ver domain.message)
+    __slots__ = ('email', 'password', 'nickname', 'created_at')
+
+    def __init__(self, email: str, password: str, nickname: str, created_at=None):
         self.email = email
         self.password = password
         self.nickname = nickname
+        self.created_at = created_at
 
     def __str__(self):
         return f"{self.email}: {self.nickname}"
@@ -13,4 +17,4 @@ class User:
         return self.email == other.email
     
     def __hash__(self):
-        return hash(self.email)
\ No newline at end of file
+        return hash(self.email)
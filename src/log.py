@@ -0,0 +1,92 @@
+# Este arquivo configura os logs da aplicação: os registros entram numa fila
+# (QueueHandler) e uma thread de fundo (QueueListener) formata e escreve, de modo
+# que a I/O de log não acontece na thread da requisição.
+
+from datetime import datetime, timezone
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+
+# Cores ANSI por nível de severidade (saída de desenvolvimento)
+COLORS = {
+    logging.DEBUG: '\033[36m',    # ciano
+    logging.INFO: '\033[32m',     # verde
+    logging.WARNING: '\033[33m',  # amarelo
+    logging.ERROR: '\033[31m',    # vermelho
+    logging.CRITICAL: '\033[1;41m', # fundo vermelho
+}
+RESET = '\033[0m'
+
+CONSOLE_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+class ColorFormatter(logging.Formatter):
+    def format(self, record) -> str:
+        line = super().format(record)
+        color = COLORS.get(record.levelno)
+        return f'{color}{line}{RESET}' if color else line
+
+class JsonFormatter(logging.Formatter):
+    #uma linha JSON por registro, para produção
+    def format(self, record) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    #o QueueHandler padrão formata a mensagem antes de enfileirar; como o listener
+    #roda no mesmo processo, o registro pode ir intacto e a formatação (%-args)
+    #acontece só na thread do listener
+    def prepare(self, record):
+        return record
+
+# Listener em uso no processo e a configuração com que foi montado: create_app pode
+# ser chamado várias vezes (testes, bench, asgi) e deve haver uma thread só
+_listener = None
+_settings = None
+
+def setup_logging(level: str = 'INFO', fmt: str = 'console', stream=None) -> logging.handlers.QueueListener:
+    global _listener, _settings
+    stream = stream or sys.stderr
+    root = logging.getLogger()
+    root.setLevel(level.upper())
+    if _listener is not None and _settings == (fmt, stream):
+        return _listener
+    stop_logging()
+
+    handler = logging.StreamHandler(stream)
+    if fmt == 'json':
+        handler.setFormatter(JsonFormatter())
+    elif getattr(stream, 'isatty', lambda: False)():
+        handler.setFormatter(ColorFormatter(CONSOLE_FORMAT))
+    else:
+        handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(LazyQueueHandler(log_queue))
+
+    listener.start()
+    _listener, _settings = listener, (fmt, stream)
+    return listener
+
+def stop_logging() -> None:
+    #escreve o que ainda está na fila e encerra a thread do listener
+    global _listener, _settings
+    if _listener is not None:
+        _listener.stop()
+        _listener = _settings = None
+
+atexit.register(stop_logging)
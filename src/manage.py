@@ -0,0 +1,106 @@
+#!/bin/env python3
+# Este arquivo reúne os comandos de manutenção dos bancos, executados com o
+# servidor no ar ou parado. Os caminhos vêm de Config.from_env() (CHATAO_*).
+#
+#   python manage.py rebuild-search     # reconstrói o índice FTS das mensagens
+#   python manage.py rebalance --to 4   # redistribui as mensagens em 4 shards (servidor parado)
+#   python manage.py archive            # move as mensagens antigas para o arquivo morto
+#   python manage.py prune-uploads      # apaga envios de anexos abandonados
+
+from config import Config
+from log import setup_logging, stop_logging
+from storage.attachment import AttachmentStorage
+from storage.message import MessageStorage, rebalance
+import argparse
+import logging
+import sqlite3
+import sys
+
+def open_storage(config: Config, archive: bool = False) -> MessageStorage:
+    #no banco único (CHATAO_DATABASE) as mensagens estão no mesmo arquivo dos usuários
+    if config.database:
+        return MessageStorage(config.database, pool_size=1, archive=archive or config.archive_after > 0)
+    return MessageStorage(config.message_db, pool_size=1, shards=config.message_shards,
+                          archive=archive or config.archive_after > 0)
+
+def rebuild_search(config: Config, args) -> bool:
+    message_storage = open_storage(config)
+    try:
+        logging.info('[manage] Rebuilding search index of %s', config.message_db)
+        return message_storage.rebuild_search()
+    finally:
+        message_storage.close()
+
+def rebalance_shards(config: Config, args) -> bool:
+    #depois de terminar, suba o servidor com CHATAO_MESSAGE_SHARDS=<to>
+    if config.database:
+        logging.error('[manage] A single database (CHATAO_DATABASE) cannot be sharded')
+        return False
+    shards = args.source if args.source is not None else config.message_shards
+    logging.info('[manage] Rebalancing %s from %s to %s shards', config.message_db, shards, args.to)
+    try:
+        rebalance(config.message_db, shards, args.to)
+        return True
+    except (OSError, sqlite3.Error) as e:
+        logging.error('[manage] Error rebalancing shards: %s', e)
+        return False
+
+def archive_messages(config: Config, args) -> bool:
+    #pode rodar com o servidor no ar (ex.: num cron diário). Só com CHATAO_ARCHIVE_AFTER
+    #ligado: sem ele o servidor não anexa o arquivo morto e as mensagens movidas
+    #sumiriam das listagens; --days apenas muda a idade de corte
+    if config.archive_after <= 0:
+        logging.error('[manage] Archiving is disabled, set CHATAO_ARCHIVE_AFTER (the server must read the archive too)')
+        return False
+    days = args.days if args.days is not None else config.archive_after
+    if days <= 0:
+        logging.error('[manage] --days must be positive')
+        return False
+    message_storage = open_storage(config, archive=True)
+    try:
+        logging.info('[manage] Archiving messages older than %s days', days)
+        return message_storage.archive_messages(days * 86400, args.batch_size) is not None
+    finally:
+        message_storage.close()
+
+def prune_uploads(config: Config, args) -> bool:
+    #envios em partes que não terminaram em --days dias (ex.: num cron diário)
+    attachment_storage = AttachmentStorage(config.attachment_dir, config.attachment_db, pool_size=1)
+    try:
+        logging.info('[manage] Pruning uploads older than %s days', args.days)
+        return attachment_storage.prune_uploads(args.days * 86400) is not None
+    finally:
+        attachment_storage.close()
+
+COMMANDS = {
+    'rebuild-search': rebuild_search,
+    'rebalance': rebalance_shards,
+    'archive': archive_messages,
+    'prune-uploads': prune_uploads,
+}
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Chatao maintenance commands')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('rebuild-search', help='rebuild the full-text index from the messages table')
+    command = commands.add_parser('rebalance', help='move messages to a different number of shards (offline)')
+    command.add_argument('--to', type=int, required=True, help='new number of shards')
+    command.add_argument('--from', dest='source', type=int, help='current number of shards (default: CHATAO_MESSAGE_SHARDS)')
+    command = commands.add_parser('archive', help='move old messages to the compressed archive database')
+    command.add_argument('--days', type=float,
+                         help='archive messages older than this (default: CHATAO_ARCHIVE_AFTER, which must be set)')
+    command.add_argument('--batch-size', type=int, default=1000)
+    command = commands.add_parser('prune-uploads', help='delete attachment uploads that were never completed')
+    command.add_argument('--days', type=float, default=1, help='delete uploads started more than this ago')
+    args = parser.parse_args()
+
+    config = Config.from_env()
+    setup_logging(config.log_level, config.log_format)
+    try:
+        ok = COMMANDS[args.command](config, args)
+    finally:
+        stop_logging()
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,82 @@
+# Este arquivo define o perfilamento opcional de requisições com cProfile. Uma
+# requisição é perfilada quando traz o cabeçalho X-Chatao-Profile com o token
+# configurado (CHATAO_PROFILE_TOKEN) ou quando cai na amostragem
+# (CHATAO_PROFILE_RATE, fração das requisições). As estatísticas vão para um
+# arquivo .prof em CHATAO_PROFILE_DIR (abrir com python -m pstats ou snakeviz)
+# ou, sem diretório, para o log com as funções mais caras.
+
+import cProfile
+import hmac
+import io
+import itertools
+import logging
+import os
+import pstats
+import random
+import re
+import threading
+import time
+
+PROFILE_HEADER = 'X-Chatao-Profile'
+
+class RequestProfiler:
+    def __init__(self, rate: float = 0.0, token: str = '', directory: str = '', top: int = 25) -> None:
+        self.rate = rate
+        self.token = token
+        self.directory = directory
+        self.top = top
+        #um perfil por vez: o cProfile mede só a thread que o ligou e, a partir do
+        #Python 3.12, só um profiler pode estar ativo no processo
+        self._lock = threading.Lock()
+        self._sequence = itertools.count(1)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0 or bool(self.token)
+
+    def wanted(self, header: str = None) -> bool:
+        #compara bytes: com str, um cabeçalho não ASCII faria o compare_digest lançar TypeError
+        if header and self.token and hmac.compare_digest(header.encode('utf-8', 'surrogateescape'),
+                                                         self.token.encode('utf-8')):
+            return True
+        return self.rate > 0 and random.random() < self.rate
+
+    def start(self) -> cProfile.Profile:
+        #None se outra requisição já estiver sendo perfilada
+        if not self._lock.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:
+            self._lock.release()
+            logging.warning('[RequestProfiler] Could not start profiling: %s', e)
+            return None
+        return profile
+
+    def stop(self, profile: cProfile.Profile, method: str, route: str) -> str:
+        #desliga o perfil e grava; devolve o caminho do arquivo (ou None se foi para o log)
+        try:
+            profile.disable()
+        finally:
+            self._lock.release()
+
+        try:
+            if self.directory:
+                #ex.: 20250101-120000-4242-7-GET-message_email.prof
+                route_name = re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_') or 'root'
+                name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(self._sequence)}-{method}-{route_name}"
+                path = os.path.join(self.directory, f'{name}.prof')
+                profile.dump_stats(path)
+                logging.info('[RequestProfiler] %s %s profiled: %s', method, route, path)
+                return path
+
+            output = io.StringIO()
+            stats = pstats.Stats(profile, stream=output)
+            stats.sort_stats('cumulative').print_stats(self.top)
+            logging.info('[RequestProfiler] %s %s profile:\n%s', method, route, output.getvalue())
+        except OSError as e:
+            logging.error('[RequestProfiler] Error writing profile: %s', e)
+        return None
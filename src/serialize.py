@@ -0,0 +1,44 @@
+# Este arquivo define a serialização JSON das listagens. Os objetos do domínio
+# (com __slots__) vão direto para o codificador numa única chamada, sem passar
+# pelo jsonify (que ordena as chaves); usa orjson quando estiver instalado.
+
+from flask import Response
+from functools import lru_cache
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None # opcional: pip install orjson
+
+_encode = json.JSONEncoder(separators=(',', ':')).encode
+
+def dumps(obj) -> bytes:
+    #devolve bytes (UTF-8), prontos para o corpo da resposta
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return _encode(obj).encode('utf-8')
+
+@lru_cache(maxsize=None)
+def _getter(fields: tuple):
+    #gera uma função com o dicionário literal dos campos (a mesma técnica de
+    #namedtuple/dataclasses), bem mais rápida que getattr campo a campo
+    for field in fields:
+        if not field.isidentifier():
+            raise ValueError(f'invalid field {field!r}')
+    body = ', '.join(f'{field!r}: obj.{field}' for field in fields)
+    namespace = {}
+    exec(f'def row(obj): return {{{body}}}', namespace)
+    return namespace['row']
+
+def encode(obj, fields: tuple) -> str:
+    #um objeto (Message, User) vira {"campo": valor, ...} só com os campos pedidos
+    return dumps(_getter(fields)(obj)).decode('utf-8')
+
+def list_body(key: str, objects, fields: tuple, **extra) -> bytes:
+    #{"<key>": [...], <extra>}: a página inteira é codificada de uma vez
+    row = _getter(fields)
+    return dumps({key: [row(obj) for obj in objects], **extra})
+
+def list_response(key: str, objects, fields: tuple, status: int = 200, **extra) -> Response:
+    return Response(list_body(key, objects, fields, **extra), status, mimetype='application/json')
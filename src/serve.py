@@ -0,0 +1,70 @@
+#!/bin/env python3
+# Este arquivo é o ponto de entrada de produção. Sobe vários processos worker
+# (pre-fork); cada worker monta a aplicação com create_app depois do fork, então
+# as conexões SQLite nunca são herdadas do processo mestre.
+#
+#   python serve.py                 # WSGI (gunicorn, workers com threads)
+#   python serve.py --asgi          # ASGI (uvicorn, ver asgi.py)
+#
+# As opções padrão vêm de Config.from_env() (variáveis CHATAO_*).
+
+from config import Config
+import argparse
+import logging
+import os
+import secrets
+
+def serve_wsgi(config: Config) -> None:
+    from gunicorn.app.base import BaseApplication
+    from app import create_app
+
+    class ChataoApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f'{config.host}:{config.port}')
+            self.cfg.set('workers', config.workers)
+            self.cfg.set('threads', config.threads)
+            self.cfg.set('worker_class', 'gthread')
+            #sem preload: a aplicação (e o pool SQLite) nasce dentro de cada worker
+            self.cfg.set('preload_app', False)
+            #conexões SSE/long-poll ficam abertas mais que o timeout padrão
+            self.cfg.set('timeout', 60)
+
+        def load(self):
+            return create_app(config)
+
+    ChataoApplication().run()
+
+def serve_asgi(config: Config) -> None:
+    import uvicorn
+
+    #cada worker do uvicorn é um processo novo que importa asgi e chama create_app
+    uvicorn.run('asgi:application', host=config.host, port=config.port,
+                workers=config.workers, log_level=config.log_level.lower())
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Chatao API server')
+    parser.add_argument('--asgi', action='store_true', help='serve the asyncio (ASGI) variant')
+    parser.add_argument('--host')
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--threads', type=int)
+    args = parser.parse_args()
+
+    overrides = {name: value for name, value in vars(args).items() if name != 'asgi' and value is not None}
+    config = Config.from_env(**overrides)
+    #os workers do uvicorn leem a configuração do ambiente (ver asgi.py)
+    for name, value in overrides.items():
+        os.environ[f'CHATAO_{name.upper()}'] = str(value)
+
+    #todos os workers precisam assinar/verificar tokens com o mesmo segredo
+    if not config.jwt_secret:
+        logging.warning('[serve] CHATAO_JWT_SECRET not set, tokens will not survive a restart')
+        config.jwt_secret = os.environ['CHATAO_JWT_SECRET'] = secrets.token_urlsafe(32)
+
+    if args.asgi:
+        serve_asgi(config)
+    else:
+        serve_wsgi(config)
+
+if __name__ == '__main__':
+    main()
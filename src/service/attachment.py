@@ -0,0 +1,87 @@
+# Este é o arquivo que define o serviço de anexos da aplicação: envio em partes
+# (retomável) e controle de quem pode baixar ou anexar um arquivo.
+
+import logging
+from service.auth import AuthService
+from storage.attachment import AttachmentStorage
+from storage.message import MessageStorage
+
+class AttachmentService:
+    def __init__(self, attachment_storage: AttachmentStorage, message_storage: MessageStorage,
+                 authService: AuthService, max_size: int = 100 * 1024 * 1024) -> None:
+        self.attachment_storage = attachment_storage
+        self.message_storage = message_storage
+        self.authService = authService
+        self.max_size = max_size
+
+    def create_upload(self, token, email, size, name=None, content_type=None) -> dict:
+        try:
+            if not self.authService.validate_token(email, token):
+                logging.error('[AttachmentService] Invalid token to email %s', email)
+                return None
+
+            return self.attachment_storage.create_upload(email, size, name, content_type)
+        except Exception as e:
+            logging.error('[AttachmentService] Error creating upload: %s', e)
+            return None
+
+    def get_upload(self, token, email, upload_id) -> dict:
+        #só o dono enxerga (e continua) o próprio envio
+        try:
+            if not self.authService.validate_token(email, token):
+                logging.error('[AttachmentService] Invalid token to email %s', email)
+                return None
+
+            upload = self.attachment_storage.get_upload(upload_id)
+            if upload is None or upload['owner'] != email:
+                logging.warning('[AttachmentService] Upload %s not found for %s', upload_id, email)
+                return None
+            return upload
+        except Exception as e:
+            logging.error('[AttachmentService] Error getting upload: %s', e)
+            return None
+
+    def write_chunk(self, upload, offset, stream) -> dict:
+        #grava uma parte; quando chega o último byte, o anexo é finalizado e o
+        #resultado traz o id dele (hash do conteúdo)
+        try:
+            received = self.attachment_storage.write_chunk(upload, offset, stream)
+            if received is None:
+                return None
+
+            upload = {**upload, 'received': received}
+            if received == upload['size']:
+                upload['attachment'] = self.attachment_storage.complete_upload(upload)
+                if upload['attachment'] is None:
+                    return None
+            return upload
+        except Exception as e:
+            logging.error('[AttachmentService] Error writing upload: %s', e)
+            return None
+
+    def can_read(self, token, email, attachment) -> bool:
+        #quem enviou o arquivo ou enviou/recebeu uma mensagem com ele
+        try:
+            if not self.authService.validate_token(email, token):
+                logging.error('[AttachmentService] Invalid token to email %s', email)
+                return False
+
+            return self.attachment_storage.is_owner(attachment, email) or \
+                self.message_storage.has_attachment(email, attachment)
+        except Exception as e:
+            logging.error('[AttachmentService] Error checking attachment access: %s', e)
+            return False
+
+    def get_attachment(self, token, email, attachment) -> tuple[str, dict]:
+        #(caminho do arquivo, metadados) para o send_file; None sem acesso
+        try:
+            if not self.can_read(token, email, attachment):
+                return None
+
+            metadata = self.attachment_storage.get_attachment(attachment)
+            if metadata is None:
+                return None
+            return self.attachment_storage.path(attachment), metadata
+        except Exception as e:
+            logging.error('[AttachmentService] Error getting attachment: %s', e)
+            return None
@@ -1,42 +1,113 @@
 # Este arquivo define o serviço de autenticação da aplicação.
 import logging
-from service.cypher import CypherService
+import threading
+import time
+from service.cache import LRUCache
+from service.cypher import CypherService, HashQueueFull
+from service.executor import run_blocking
+from service.invalidation import InvalidationLog
 from service.user import UserService
 
 class AuthService:
-    def __init__(self, userService: UserService, cypherService: CypherService) -> None:
+    def __init__(self, userService: UserService, cypherService: CypherService, cache_size: int = 10000,
+                 invalidations: InvalidationLog = None) -> None:
         self.userService = userService
         self.cypherService = cypherService
+        #tokens já verificados: token -> claims (expira junto com o token)
+        self.token_cache = LRUCache(cache_size)
+        #email -> instante da revogação; tokens emitidos antes disso são recusados
+        self.revoked = {}
+        self._lock = threading.Lock()
+        #revogações feitas por outros processos
+        self.invalidations = invalidations
+        if invalidations is not None:
+            invalidations.on('revoke', self._apply_revocation)
+        #troca de senha e remoção do usuário revogam os tokens emitidos até ali
+        userService.on_revoke(self.revoke)
 
     def authenticate(self, email, password) -> str:
         try:
             user = self.userService.get_user(email)
- 
+
             if user is None:
                 return None
-            
-            cypthered_password = self.cypherService.cypher_password(password)
 
-            if user.password == cypthered_password:
-                return self.cypherService.create_token(email, cypthered_password)
+            if not self.cypherService.verify_password(password, user.password):
+                return None
+
+            if self.cypherService.needs_rehash(user.password):
+                self.userService.rehash_password(user, password)
 
+            return self.cypherService.create_token(email)
+
+        except HashQueueFull:
+            raise
         except Exception as e:
-            logging.error(f"[AuthService] Error authenticating user: {e}")
+            logging.error("[AuthService] Error authenticating user: %s", e)
             return None
 
     def validate_token(self, email: str, token: str) -> bool:
         try:
-            user = self.userService.get_user(email)
+            if self.invalidations is not None:
+                self.invalidations.sync()
+        except Exception as e:
+            logging.error("[AuthService] Error validating token: %s", e)
+            return False
+        return self._check_token(email, token)
 
-            if user is None:
-                logging.warning(f"[AuthService] User {email} not found")
+    def _check_token(self, email: str, token: str) -> bool:
+        try:
+            if not token:
+                return False
+            if token.startswith('Bearer '):
+                token = token[len('Bearer '):]
+
+            #verificação local: cache de tokens e depois assinatura, sem ir ao banco
+            claims = self.token_cache.get(token)
+            if claims is None:
+                claims = self.cypherService.verify_token(token)
+                if claims is None:
+                    logging.warning("[AuthService] Invalid token for %s", email)
+                    return False
+                self.token_cache.set(token, claims, ttl=claims['exp'] - time.time())
+
+            if claims['sub'] != email:
+                logging.warning("[AuthService] Token subject does not match %s", email)
                 return False
-            
-            userToken = self.cypherService.create_token(user.email, user.password)
 
-            if userToken == token:
-                return True
-            
+            revoked_at = self.revoked.get(email)
+            if revoked_at is not None and claims['iat'] <= revoked_at:
+                logging.warning("[AuthService] Token for %s was revoked", email)
+                return False
+
+            return True
+        except Exception as e:
+            logging.error("[AuthService] Error validating token: %s", e)
+            return False
+
+    def revoke(self, email: str) -> None:
+        #invalida todos os tokens já emitidos para o usuário (troca de senha/remoção)
+        now = time.time()
+        self._apply_revocation(email, now)
+        if self.invalidations is not None:
+            self.invalidations.publish('revoke', email, now)
+        logging.info("[AuthService] Tokens for %s revoked", email)
+
+    def _apply_revocation(self, email: str, at: float) -> None:
+        with self._lock:
+            self.revoked[email] = max(at, self.revoked.get(email, at))
+            #revogações mais antigas que a validade dos tokens não têm mais efeito
+            for key in [key for key, when in self.revoked.items() if when < at - self.cypherService.token_ttl]:
+                del self.revoked[key]
+
+    async def avalidate_token(self, email: str, token: str) -> bool:
+        #a sincronização das invalidações consulta o SQLite: quando está na hora,
+        #vai para o executor limitado; a verificação em si (assinatura + cache) é
+        #só CPU e roda direto no event loop
+        try:
+            if self.invalidations is not None and self.invalidations.due:
+                await run_blocking(self.invalidations.sync)
         except Exception as e:
-            logging.error(f"[AuthService] Error validating token: {e}")
-            return
\ No newline at end of file
+            logging.error("[AuthService] Error validating token: %s", e)
+            return False
+        return self._check_token(email, token)
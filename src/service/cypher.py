@@ -1,23 +1,152 @@
 import logging
 import base64
+import hashlib
+import hmac
+import json
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from cryptography.exceptions import InvalidKey
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+# Cabeçalho fixo dos tokens: JWT assinado com HMAC-SHA256
+_JWT_HEADER = _b64encode(json.dumps({'alg': 'HS256', 'typ': 'JWT'}, separators=(',', ':')).encode())
+
+# Funções de derivação de senha suportadas
+HASH_ALGORITHMS = ('scrypt', 'pbkdf2_sha256')
+
+# Parâmetros padrão das funções de derivação de senha (Config: hash_algorithm,
+# scrypt_n/r/p, pbkdf2_iterations)
+HASH_PARAMS = {
+    'algorithm': 'scrypt',
+    'scrypt_n': 2 ** 14,
+    'scrypt_r': 8,
+    'scrypt_p': 1,
+    'pbkdf2_iterations': 600_000,
+    'salt_size': 16,
+}
+
+class HashQueueFull(Exception):
+    #todos os workers de hash ocupados e a fila cheia: a rota responde 503 na hora
+    pass
 
 class CypherService:
-    def __init__(self):
-        pass
-    
+    def __init__(self, secret: str = None, token_ttl: int = 3600, hash_params: dict = None,
+                 hash_workers: int = 2, hash_queue: int = 2):
+        if not secret:
+            #sem segredo configurado os tokens só valem enquanto o processo viver
+            logging.warning('[CypherService] No JWT secret configured, using a random one')
+            secret = secrets.token_urlsafe(32)
+        self.secret = secret.encode('utf-8')
+        self.token_ttl = token_ttl
+        self.hash_params = {**HASH_PARAMS, **(hash_params or {})}
+        if self.hash_params['algorithm'] not in HASH_ALGORITHMS:
+            raise ValueError(f"unknown password hash algorithm {self.hash_params['algorithm']}")
+        #o hash roda num pool limitado: uma rajada de logins ocupa no máximo
+        #hash_workers núcleos e só hash_queue requisições esperam na fila; as demais
+        #recebem HashQueueFull sem esperar, para não prender as threads que atendem
+        #as outras rotas
+        self.hash_pool = ThreadPoolExecutor(max_workers=hash_workers, thread_name_prefix='CypherService')
+        self.hash_slots = threading.BoundedSemaphore(hash_workers + hash_queue)
+
+    def _kdf(self, algorithm, params, salt):
+        if algorithm == 'scrypt':
+            n, r, p = params
+            return Scrypt(salt=salt, length=32, n=n, r=r, p=p)
+        if algorithm == 'pbkdf2_sha256':
+            iterations, = params
+            return PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=salt, iterations=iterations)
+        raise ValueError(f'unknown password hash algorithm {algorithm}')
+
+    def _current_params(self) -> tuple:
+        if self.hash_params['algorithm'] == 'scrypt':
+            return (self.hash_params['scrypt_n'], self.hash_params['scrypt_r'], self.hash_params['scrypt_p'])
+        return (self.hash_params['pbkdf2_iterations'],)
+
+    def _run(self, fn, *args):
+        #executa o trabalho de hash no pool e espera o resultado
+        if not self.hash_slots.acquire(blocking=False):
+            raise HashQueueFull('password hashing queue is full')
+        try:
+            return self.hash_pool.submit(fn, *args).result()
+        finally:
+            self.hash_slots.release()
+
     def cypher_password(self, password) -> str:
+        #formato: algoritmo$parametros...$salt$hash
         try:
-            b = base64.b64encode(bytes(password, 'utf-8')) # bytes
-            return b.decode('utf-8') # convert bytes to string
+            algorithm = self.hash_params['algorithm']
+            params = self._current_params()
+            salt = secrets.token_bytes(self.hash_params['salt_size'])
+            derived = self._run(self._kdf(algorithm, params, salt).derive, password.encode('utf-8'))
+            return '$'.join([algorithm, *map(str, params), _b64encode(salt), _b64encode(derived)])
+        except HashQueueFull:
+            raise
         except Exception as e:
-            logging.error(f"[CypherService] Error cyphering password: {e}")
+            logging.error("[CypherService] Error cyphering password: %s", e)
             return None
 
-    def create_token(self, email, password) -> str:
+    def verify_password(self, password, stored) -> bool:
         try:
-            input = f"{email}:{password}"
-            b = base64.b64encode(bytes(input, 'utf-8')) # bytes
-            return b.decode('utf-8') # convert bytes to string
+            if '$' not in stored:
+                #senha legada, gravada apenas em base64
+                legacy = base64.b64encode(password.encode('utf-8')).decode('utf-8')
+                return hmac.compare_digest(legacy, stored)
+
+            algorithm, *params, salt, derived = stored.split('$')
+            kdf = self._kdf(algorithm, tuple(map(int, params)), _b64decode(salt))
+            self._run(kdf.verify, password.encode('utf-8'), _b64decode(derived))
+            return True
+        except InvalidKey:
+            return False
+        except HashQueueFull:
+            raise
         except Exception as e:
-            logging.error(f"[CypherService] Error creating token: {e}")
-            return None    
\ No newline at end of file
+            logging.error("[CypherService] Error verifying password: %s", e)
+            return False
+
+    def needs_rehash(self, stored) -> bool:
+        #senhas legadas ou com parâmetros diferentes dos atuais são refeitas no login
+        algorithm, *params = stored.split('$')[:-2] or [None]
+        return algorithm != self.hash_params['algorithm'] or \
+            tuple(map(int, params)) != self._current_params()
+
+    def _sign(self, signing_input: str) -> str:
+        return _b64encode(hmac.new(self.secret, signing_input.encode('ascii'), hashlib.sha256).digest())
+
+    def create_token(self, email) -> str:
+        try:
+            now = time.time()
+            claims = {'sub': email, 'iat': now, 'exp': int(now) + self.token_ttl}
+            payload = _b64encode(json.dumps(claims, separators=(',', ':')).encode('utf-8'))
+            signing_input = f"{_JWT_HEADER}.{payload}"
+            return f"{signing_input}.{self._sign(signing_input)}"
+        except Exception as e:
+            logging.error("[CypherService] Error creating token: %s", e)
+            return None
+
+    def verify_token(self, token) -> dict:
+        #confere assinatura e validade sem acessar o banco; devolve as claims ou None
+        try:
+            header, payload, signature = token.split('.')
+            if header != _JWT_HEADER:
+                return None
+            if not hmac.compare_digest(signature, self._sign(f"{header}.{payload}")):
+                return None
+
+            claims = json.loads(_b64decode(payload))
+            if claims.get('exp', 0) <= time.time():
+                return None
+            return claims
+        except Exception as e:
+            logging.debug("[CypherService] Invalid token: %s", e)
+            return None
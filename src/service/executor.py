@@ -0,0 +1,30 @@
+# Este arquivo define o executor limitado onde o código asyncio roda o trabalho
+# bloqueante (SQLite, hash de senha), para que o event loop nunca trave.
+
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+
+class BlockingExecutor:
+    def __init__(self, max_workers: int = 8) -> None:
+        self.max_workers = max_workers
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='BlockingExecutor')
+
+    def configure(self, max_workers: int) -> None:
+        #troca o pool (usado na inicialização do servidor asyncio)
+        old = self.pool
+        self.max_workers = max_workers
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='BlockingExecutor')
+        old.shutdown(wait=False)
+
+    async def run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.pool, functools.partial(fn, *args, **kwargs))
+
+    def shutdown(self) -> None:
+        self.pool.shutdown(wait=True)
+
+EXECUTOR = BlockingExecutor()
+
+async def run_blocking(fn, *args, **kwargs):
+    return await EXECUTOR.run(fn, *args, **kwargs)
@@ -0,0 +1,93 @@
+# Este arquivo define o hub de publicação/assinatura de mensagens em memória,
+# usado para entregar mensagens novas (SSE/long-poll) sem consultar o banco.
+
+from collections import defaultdict, deque
+from domain.message import Message
+import asyncio
+import threading
+
+def _wake(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+class Subscription:
+    def __init__(self, email: str, maxsize: int = 1000) -> None:
+        self.email = email
+        #se o cliente não consumir, as mais antigas são descartadas
+        self._messages = deque(maxlen=maxsize)
+        self._cond = threading.Condition()
+        #esperas asyncio: (loop, future) acordados a partir da thread que publica
+        self._waiters = []
+
+    def put(self, message: Message) -> None:
+        with self._cond:
+            self._messages.append(message)
+            self._cond.notify()
+            waiters, self._waiters = self._waiters, []
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, future)
+            except RuntimeError:
+                pass # loop já encerrado
+
+    def get(self, timeout: float = None) -> list[Message]:
+        #espera até chegar alguma mensagem ou estourar o tempo; devolve o que houver
+        with self._cond:
+            if not self._messages:
+                self._cond.wait(timeout)
+            messages = list(self._messages)
+            self._messages.clear()
+            return messages
+
+    async def aget(self, timeout: float = None) -> list[Message]:
+        #versão asyncio de get: espera sem ocupar uma thread
+        loop = asyncio.get_running_loop()
+        waiter = None
+        with self._cond:
+            if not self._messages:
+                waiter = (loop, loop.create_future())
+                self._waiters.append(waiter)
+
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(waiter[1], timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                with self._cond:
+                    if waiter in self._waiters:
+                        self._waiters.remove(waiter)
+
+        with self._cond:
+            messages = list(self._messages)
+            self._messages.clear()
+            return messages
+
+class MessageHub:
+    def __init__(self) -> None:
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, email: str) -> Subscription:
+        subscription = Subscription(email)
+        with self._lock:
+            self._subscribers[email].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.email)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.email]
+
+    def publish(self, message: Message) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers.get(message.target, ()))
+        for subscription in subscribers:
+            subscription.put(message)
+
+    def subscribers(self) -> int:
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
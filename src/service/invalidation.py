@@ -0,0 +1,47 @@
+# Este arquivo define o registro de invalidações compartilhado entre processos.
+# Cada worker tem seu próprio cache de usuários e sua lista de tokens revogados;
+# as escritas gravam uma invalidação no banco e os demais workers a aplicam na
+# próxima sincronização (no máximo uma consulta a cada interval segundos).
+
+from storage.user import UserStorage
+import threading
+import time
+
+class InvalidationLog:
+    def __init__(self, user_storage: UserStorage, interval: float = 1.0, retention: float = 86400) -> None:
+        self.user_storage = user_storage
+        self.interval = interval
+        self.retention = retention
+        self.handlers = {} # tipo -> [handler(key, at)]
+        #a primeira sincronização relê o registro inteiro (só guarda o período de
+        #retenção), para um worker novo conhecer as revogações ainda válidas
+        self.last_id = 0
+        self.next_sync = 0
+        self._lock = threading.Lock()
+
+    def on(self, kind: str, handler) -> None:
+        self.handlers.setdefault(kind, []).append(handler)
+
+    def publish(self, kind: str, key: str, at: float = None) -> None:
+        #o processo que publica já aplicou a mudança; os outros leem do banco
+        self.user_storage.add_invalidation(kind, key, at or time.time(), self.retention)
+
+    @property
+    def due(self) -> bool:
+        #hora de consultar o banco? (o código asyncio só desvia para o executor nesse caso)
+        return time.monotonic() >= self.next_sync
+
+    def sync(self) -> None:
+        if not self.due:
+            return
+        #só uma thread por processo consulta; as demais seguem sem esperar
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self.next_sync = time.monotonic() + self.interval
+            for id, kind, key, at in self.user_storage.get_invalidations(self.last_id):
+                for handler in self.handlers.get(kind, ()):
+                    handler(key, at)
+                self.last_id = id
+        finally:
+            self._lock.release()
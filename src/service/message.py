@@ -1,36 +1,327 @@
 # Este é o arquivo que define o serviço de mensagens da aplicação.
 
 import logging
+import time
 from domain.message import Message
 from storage.message import MessageStorage
 from service.auth import AuthService
+from service.executor import run_blocking
+from service.hub import MessageHub
+from storage.database import UnitOfWork
 
 class MessageService:
-    def __init__(self, message_storage: MessageStorage, authService: AuthService) -> None:
+    def __init__(self, message_storage: MessageStorage, authService: AuthService, hub: MessageHub = None,
+                 unit_of_work: UnitOfWork = None, wake_interval: float = 0.5) -> None:
         self.message_storage = message_storage
         self.authService = authService
+        self.hub = hub or MessageHub()
+        #o hub só acorda quem está no mesmo processo; enquanto espera, cada assinante
+        #confere a cada wake_interval segundos o contador de versão in:<target>, que
+        #muda quando outro worker grava uma mensagem para ele (0 desliga)
+        self.wake_interval = wake_interval
+        #no banco único, a consulta dos destinatários e os inserts num commit só
+        self.unit_of_work = unit_of_work or UnitOfWork()
 
-    def add_message(self, token, source, target, message) -> bool:
+    def add_message(self, token, source, target, message, durable=False, attachment=None) -> bool:
         try:
             if not self.authService.validate_token(source, token):
                 logging.error('[MessageService] Invalid token')
                 return False
 
-            data = Message(source, target, message)
-            self.message_storage.add_message(data)
-            logging.info(f'[MessageService] Message added-> {source} to {target}:{message}')
+            data = Message(source, target, message, attachment=attachment)
+            #publicada só depois do commit, com o id já gerado: em write-behind
+            #isso acontece na thread do lote, não aqui
+            if not self.message_storage.add_message(data, durable, self.hub.publish):
+                logging.error('[MessageService] Message not stored')
+                return False
+            logging.debug('[MessageService] Message added-> %s to %s', source, target)
             return True
         except Exception as e:
-            logging.error(f'[MessageService] Error adding message: {e}')
+            logging.error('[MessageService] Error adding message: %s', e)
             return False
 
-    def get_messages(self, token, target) -> list[Message]:
+    def add_messages(self, token, source, items) -> list[dict]:
+        #envio em lote: um token, uma consulta de destinatários e uma transação
+        try:
+            if not self.authService.validate_token(source, token):
+                logging.error('[MessageService] Invalid token')
+                return None
+
+            targets = {item.get('target') for item in items if isinstance(item, dict) and item.get('target')}
+            with self.unit_of_work():
+                existing = self.authService.userService.get_existing_emails(targets)
+                if existing is None:
+                    return None
+
+                results = []
+                messages = []
+                for index, item in enumerate(items):
+                    target = item.get('target') if isinstance(item, dict) else None
+                    message = item.get('message') if isinstance(item, dict) else None
+                    if not target or not message:
+                        results.append({'index': index, 'target': target, 'error': 'Missing data'})
+                    elif target not in existing:
+                        results.append({'index': index, 'target': target, 'error': 'Target not found'})
+                    else:
+                        results.append({'index': index, 'target': target, 'status': 'sent'})
+                        messages.append(Message(source, target, message))
+
+                if messages and not self.message_storage.add_messages(messages):
+                    #sai com exceção para desfazer a unidade de trabalho
+                    raise RuntimeError('messages not stored')
+            for data in messages:
+                self.hub.publish(data)
+
+            logging.info('[MessageService] %s/%s messages added from %s', len(messages), len(items), source)
+            return results
+        except Exception as e:
+            logging.error('[MessageService] Error adding messages: %s', e)
+            return None
+
+    def get_messages(self, token, target, after=None, limit=None) -> list[Message]:
         try:
             if not self.authService.validate_token(target, token):
-                logging.error(f'[MessageService] Invalid token {token} to target {target}')
+                logging.error('[MessageService] Invalid token to target %s', target)
+                return None
+
+            return self.message_storage.get_messages(target, after, limit)
+        except Exception as e:
+            logging.error('[MessageService] Error getting messages: %s', e)
+            return None
+
+    def get_sent_messages(self, token, source, after=None, limit=None) -> list[Message]:
+        try:
+            if not self.authService.validate_token(source, token):
+                logging.error('[MessageService] Invalid token to source %s', source)
+                return None
+
+            return self.message_storage.get_sent_messages(source, after, limit)
+        except Exception as e:
+            logging.error('[MessageService] Error getting sent messages: %s', e)
+            return None
+
+    def get_version(self, token, email, box='in') -> int:
+        #versão da caixa de entrada ('in') ou das enviadas ('out') de email (ETag)
+        try:
+            if not self.authService.validate_token(email, token):
+                logging.error('[MessageService] Invalid token to email %s', email)
+                return None
+
+            return self.message_storage.get_version(box, email)
+        except Exception as e:
+            logging.error('[MessageService] Error getting version: %s', e)
+            return None
+
+    def stream_messages(self, token, target, after=None, limit=None):
+        #valida o token antes de devolver o gerador, que só executa a consulta ao ser consumido
+        if not self.authService.validate_token(target, token):
+            logging.error('[MessageService] Invalid token to target %s', target)
+            return None
+
+        return self.message_storage.iter_messages(target, after, limit)
+
+    def stream_sent_messages(self, token, source, after=None, limit=None):
+        if not self.authService.validate_token(source, token):
+            logging.error('[MessageService] Invalid token to source %s', source)
+            return None
+
+        return self.message_storage.iter_sent_messages(source, after, limit)
+
+    def search_messages(self, token, email, query, offset=0, limit=None) -> list[Message]:
+        try:
+            if not self.authService.validate_token(email, token):
+                logging.error('[MessageService] Invalid token to email %s', email)
                 return None
 
-            return self.message_storage.get_messages(target)
+            return self.message_storage.search_messages(email, query, offset, limit)
         except Exception as e:
-            logging.error(f'[MessageService] Error getting messages: {e}')
-            return None
\ No newline at end of file
+            logging.error('[MessageService] Error searching messages: %s', e)
+            return None
+
+    def get_conversations(self, token, owner, limit=None) -> tuple[list[dict], int]:
+        try:
+            if not self.authService.validate_token(owner, token):
+                logging.error('[MessageService] Invalid token to owner %s', owner)
+                return None
+
+            return self.message_storage.get_conversations(owner, limit)
+        except Exception as e:
+            logging.error('[MessageService] Error getting conversations: %s', e)
+            return None
+
+    def mark_read(self, token, owner, peer=None) -> bool:
+        try:
+            if not self.authService.validate_token(owner, token):
+                logging.error('[MessageService] Invalid token to owner %s', owner)
+                return False
+
+            return self.message_storage.mark_read(owner, peer)
+        except Exception as e:
+            logging.error('[MessageService] Error marking conversation as read: %s', e)
+            return False
+
+    def _wait(self, subscription, target, timeout, version) -> tuple[list[Message], int]:
+        #espera o hub até timeout; devolve antes, sem mensagens, se o contador da
+        #caixa de entrada mudar (mensagem gravada por outro processo)
+        if not self.wake_interval:
+            return subscription.get(timeout), version
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return [], version
+            messages = subscription.get(min(self.wake_interval, remaining))
+            if messages:
+                return messages, version
+            current = self.message_storage.get_version('in', target)
+            if current != version:
+                return [], current
+
+    def poll_messages(self, token, target, since=None, timeout=25, limit=None) -> list[Message]:
+        #long-poll: devolve na hora o que houver depois de since; senão espera o hub
+        try:
+            if not self.authService.validate_token(target, token):
+                logging.error('[MessageService] Invalid token to target %s', target)
+                return None
+
+            subscription = self.hub.subscribe(target)
+            try:
+                version = self.message_storage.get_version('in', target) if self.wake_interval else None
+                if since is not None:
+                    messages = self.message_storage.get_messages(target, since, limit)
+                    if messages:
+                        return messages
+                else:
+                    since = self.message_storage.get_last_message_id(target)
+                deadline = time.monotonic() + timeout
+                while True:
+                    messages, version = self._wait(subscription, target, max(deadline - time.monotonic(), 0), version)
+                    if messages:
+                        return messages
+                    #espera vazia ou mensagem gravada por outro worker: confere no banco
+                    messages = self.message_storage.get_messages(target, since, limit)
+                    if messages or time.monotonic() >= deadline:
+                        return messages
+            finally:
+                self.hub.unsubscribe(subscription)
+        except Exception as e:
+            logging.error('[MessageService] Error polling messages: %s', e)
+            return None
+
+    def follow_messages(self, token, target, since=None, keepalive=15):
+        #SSE: gera as mensagens novas conforme são publicadas; None = keepalive
+        if not self.authService.validate_token(target, token):
+            logging.error('[MessageService] Invalid token to target %s', target)
+            return None
+
+        def follow():
+            #assina antes de buscar o atraso para não perder nada entre as duas etapas
+            subscription = self.hub.subscribe(target)
+            try:
+                version = self.message_storage.get_version('in', target) if self.wake_interval else None
+                if since is not None:
+                    last = since
+                    for message in self.message_storage.iter_messages(target, since):
+                        last = message.id
+                        yield message
+                else:
+                    last = self.message_storage.get_last_message_id(target)
+                while True:
+                    messages, version = self._wait(subscription, target, keepalive, version)
+                    if not messages:
+                        #espera vazia ou mensagem de outro worker: confere no banco
+                        messages = self.message_storage.get_messages(target, last) or []
+                        if not messages:
+                            yield None
+                    for message in messages:
+                        if last is not None and message.id is not None and message.id <= last:
+                            continue
+                        if message.id is not None:
+                            last = message.id
+                        yield message
+            finally:
+                self.hub.unsubscribe(subscription)
+
+        return follow()
+
+    # Versões asyncio: SQLite no executor limitado, espera por mensagens novas no
+    # próprio event loop (milhares de conexões ociosas sem uma thread cada)
+    async def _await(self, subscription, target, timeout, version) -> tuple[list[Message], int]:
+        if not self.wake_interval:
+            return await subscription.aget(timeout), version
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return [], version
+            messages = await subscription.aget(min(self.wake_interval, remaining))
+            if messages:
+                return messages, version
+            current = await run_blocking(self.message_storage.get_version, 'in', target)
+            if current != version:
+                return [], current
+
+    async def apoll_messages(self, token, target, since=None, timeout=25, limit=None) -> list[Message]:
+        try:
+            if not await self.authService.avalidate_token(target, token):
+                logging.error('[MessageService] Invalid token to target %s', target)
+                return None
+
+            subscription = self.hub.subscribe(target)
+            try:
+                version = await run_blocking(self.message_storage.get_version, 'in', target) \
+                    if self.wake_interval else None
+                if since is not None:
+                    messages = await run_blocking(self.message_storage.get_messages, target, since, limit)
+                    if messages:
+                        return messages
+                else:
+                    since = await run_blocking(self.message_storage.get_last_message_id, target)
+                deadline = time.monotonic() + timeout
+                while True:
+                    messages, version = await self._await(subscription, target,
+                                                          max(deadline - time.monotonic(), 0), version)
+                    if messages:
+                        return messages
+                    messages = await run_blocking(self.message_storage.get_messages, target, since, limit)
+                    if messages or time.monotonic() >= deadline:
+                        return messages
+            finally:
+                self.hub.unsubscribe(subscription)
+        except Exception as e:
+            logging.error('[MessageService] Error polling messages: %s', e)
+            return None
+
+    async def afollow_messages(self, token, target, since=None, keepalive=15):
+        if not await self.authService.avalidate_token(target, token):
+            logging.error('[MessageService] Invalid token to target %s', target)
+            return None
+
+        async def follow():
+            subscription = self.hub.subscribe(target)
+            try:
+                version = await run_blocking(self.message_storage.get_version, 'in', target) \
+                    if self.wake_interval else None
+                if since is not None:
+                    last = since
+                    for message in await run_blocking(self.message_storage.get_messages, target, since):
+                        last = message.id
+                        yield message
+                else:
+                    last = await run_blocking(self.message_storage.get_last_message_id, target)
+                while True:
+                    messages, version = await self._await(subscription, target, keepalive, version)
+                    if not messages:
+                        messages = await run_blocking(self.message_storage.get_messages, target, last) or []
+                        if not messages:
+                            yield None
+                    for message in messages:
+                        if last is not None and message.id is not None and message.id <= last:
+                            continue
+                        if message.id is not None:
+                            last = message.id
+                        yield message
+            finally:
+                self.hub.unsubscribe(subscription)
+
+        return follow()
@@ -0,0 +1,72 @@
+# Este arquivo define a limitação de taxa (token bucket) por usuário e por IP.
+# Cada regra dá count fichas a cada per segundos (rajada de até count fichas);
+# cada requisição gasta uma e, sem fichas, a API responde 429 com Retry-After.
+# Os baldes ficam em memória (um conjunto por processo) ou, com vários workers,
+# num banco SQLite compartilhado (storage.ratelimit).
+
+from service.cache import LRUCache
+import threading
+import time
+
+SCOPES = ('user', 'ip')
+
+class Rule:
+    __slots__ = ('scope', 'count', 'per')
+
+    def __init__(self, scope: str, count: int, per: float) -> None:
+        self.scope = scope
+        self.count = count
+        self.per = per
+
+    @property
+    def rate(self) -> float:
+        return self.count / self.per
+
+def parse_rules(spec: str) -> dict[str, list[Rule]]:
+    #"authenticate: ip=30/60, user=10/60; send_message: user=60/10" -> {rota: [regras]}
+    rules = {}
+    for part in spec.split(';'):
+        if not part.strip():
+            continue
+        endpoint, _, limits = part.partition(':')
+        for limit in limits.split(','):
+            scope, _, value = limit.strip().partition('=')
+            count, _, per = value.partition('/')
+            if scope not in SCOPES:
+                raise ValueError(f'invalid rate limit scope {scope!r}')
+            rules.setdefault(endpoint.strip(), []).append(Rule(scope, int(count), float(per or 1)))
+    return rules
+
+class MemoryBuckets:
+    def __init__(self, maxsize: int = 100000) -> None:
+        #baldes por chave: (fichas, atualizado_em); um balde some do cache quando
+        #já teria se enchido sozinho, então ausente = cheio
+        self.buckets = LRUCache(maxsize)
+        self._lock = threading.Lock()
+
+    def take(self, key: str, rate: float, burst: float, cost: float = 1) -> float:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self.buckets.get(key) or (burst, now)
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens < cost:
+                return (cost - tokens) / rate
+            tokens -= cost
+            self.buckets.set(key, (tokens, now), ttl=(burst - tokens) / rate)
+            return 0
+
+class RateLimiter:
+    def __init__(self, rules: dict[str, list[Rule]], buckets=None) -> None:
+        self.rules = rules
+        #buckets: MemoryBuckets (padrão) ou storage.ratelimit.RateLimitStorage
+        self.buckets = buckets or MemoryBuckets()
+
+    def check(self, endpoint: str, user: str = None, ip: str = None) -> float:
+        #devolve 0 se a requisição pode seguir ou quantos segundos o cliente deve esperar
+        wait = 0
+        for rule in self.rules.get(endpoint, ()):
+            key = user if rule.scope == 'user' else ip
+            if key is None:
+                continue
+            wait = max(wait, self.buckets.take(f'{endpoint}:{rule.scope}:{key}', rule.rate, rule.count))
+        return wait
@@ -2,55 +2,154 @@
 
 from domain.user import User
 from storage.user import UserStorage
-from service.cypher import CypherService
+from service.cache import LRUCache
+from service.cypher import CypherService, HashQueueFull
+from service.invalidation import InvalidationLog
+from storage.database import UnitOfWork
 import logging
 
 class UserService:
-    def __init__(self, user_storage: UserStorage, cypherService: CypherService) -> None:
+    def __init__(self, user_storage: UserStorage, cypherService: CypherService,
+                 cache_size: int = 10000, cache_ttl: float = 60, invalidations: InvalidationLog = None,
+                 unit_of_work: UnitOfWork = None) -> None:
         self.user_storage = user_storage
         self.cypherService = cypherService
+        #transação que agrupa a remoção do usuário e a limpeza dos dados dele
+        self.unit_of_work = unit_of_work or UnitOfWork(user_storage.pool)
+        #limpezas executadas na mesma unidade de trabalho ao remover um usuário
+        self.deletions = []
+        #avisados (email) depois de trocar a senha ou remover um usuário: o
+        #AuthService se registra aqui para revogar os tokens já emitidos
+        self.revocations = []
+        #cache read-through de usuários por email, invalidado nas escritas
+        self.cache = LRUCache(cache_size, cache_ttl)
+        #invalidações vindas de outros processos
+        self.invalidations = invalidations
+        if invalidations is not None:
+            invalidations.on('user', lambda email, at: self.cache.pop(email))
+
+    def on_revoke(self, callback) -> None:
+        self.revocations.append(callback)
+
+    def _revoke(self, email) -> None:
+        for callback in self.revocations:
+            callback(email)
+
+    def _invalidate(self, email) -> None:
+        self.cache.pop(email)
+        if self.invalidations is not None:
+            self.invalidations.publish('user', email)
 
     def add_user(self, email, password, nickname) -> None:
         try:
             cyphered_password = self.cypherService.cypher_password(password)
+            if cyphered_password is None:
+                return None
             user = User(email, cyphered_password, nickname)
             self.user_storage.add_user(user)
-            logging.info(f"[UserService] User {email} added")
+            self._invalidate(email)
+            logging.info("[UserService] User %s added", email)
+        except HashQueueFull:
+            raise
         except Exception as e:  
-            logging.error(f"[UserService] Error adding user: {e}")
+            logging.error("[UserService] Error adding user: %s", e)
             return None
 
     def get_user(self, email) -> User:
         try:
+            if self.invalidations is not None:
+                self.invalidations.sync()
+
+            user = self.cache.get(email)
+            if user:
+                return user
+
             user = self.user_storage.get_user(email)
             if user:
+                self.cache.set(email, user)
                 return user
             
-            logging.warn(f"[UserService] User {email} not found")
+            logging.warning("[UserService] User %s not found", email)
             return None
         except Exception as e:
-            logging.error(f"[UserService] Error getting user: {e}")
+            logging.error("[UserService] Error getting user: %s", e)
             return None        
 
-    def get_all_users(self) -> list[User]:
+    def list_users(self, prefix=None, after=None, limit=100) -> list[User]:
+        try:
+            return self.user_storage.list_users(prefix, after, limit)
+        except Exception as e:
+            logging.error("[UserService] Error listing users: %s", e)
+            return None
+
+    def count_users(self) -> int:
+        try:
+            return self.user_storage.count_users()
+        except Exception as e:
+            logging.error("[UserService] Error counting users: %s", e)
+            return None
+
+    def get_existing_emails(self, emails) -> set[str]:
         try:
-            return self.user_storage.get_all_users()
+            return self.user_storage.get_existing_emails(emails)
         except Exception as e:
-            logging.error(f"[UserService] Error getting all users: {e}")
+            logging.error("[UserService] Error checking users: %s", e)
             return None
 
     def update_user(self, email, password, nickname) -> bool:
         try:
             cyphered_password = self.cypherService.cypher_password(password)
+            if cyphered_password is None:
+                return False
             user = User(email, cyphered_password, nickname)
-            return self.user_storage.update_user(user)
+            updated = self.user_storage.update_user(user)
+            self._invalidate(email)
+            #só revoga os tokens se a nova senha foi gravada
+            if updated:
+                self._revoke(email)
+            return updated
+        except HashQueueFull:
+            raise
+        except Exception as e:
+            logging.error("[UserService] Error updating user: %s", e)
+            return False
+
+    def rehash_password(self, user: User, password) -> bool:
+        #regrava a senha com os parâmetros de hash atuais (chamado no login)
+        try:
+            cyphered_password = self.cypherService.cypher_password(password)
+            if cyphered_password is None:
+                return False
+            updated = self.user_storage.update_user(User(user.email, cyphered_password, user.nickname))
+            self._invalidate(user.email)
+            logging.info("[UserService] Password for %s rehashed", user.email)
+            return updated
         except Exception as e:
-            logging.error(f"[UserService] Error updating user: {e}")
+            logging.error("[UserService] Error rehashing password: %s", e)
             return False
 
+    def on_delete(self, callback) -> None:
+        #callback(email) -> bool; False desfaz a remoção inteira
+        self.deletions.append(callback)
+
     def delete_user(self, email) -> bool:
         try:
-            return self.user_storage.delete_user(email)
+            with self.unit_of_work():
+                if not self.user_storage.delete_user(email):
+                    return False
+                for callback in self.deletions:
+                    if not callback(email):
+                        raise RuntimeError(f'cleanup of {email} failed')
+            self._invalidate(email)
+            self._revoke(email)
+            return True
         except Exception as e:
-            logging.error(f"[UserService] Error deleting user: {e}")
-            return False
\ No newline at end of file
+            logging.error("[UserService] Error deleting user: %s", e)
+            return False
+
+    def get_version(self, email=None) -> int:
+        #versão da listagem de usuários ou de um usuário (ETag)
+        return self.user_storage.get_version('users' if email is None else f'user:{email}')
+
+    def cache_stats(self) -> dict:
+        return self.cache.stats()
@@ -0,0 +1,226 @@
+# Neste arquivo, codificamos o armazenamento de anexos. O conteúdo fica em arquivos
+# no disco, endereçados pelo SHA-256 (attachments/ab/abcdef...), de modo que o mesmo
+# arquivo enviado duas vezes ocupa espaço uma vez só; o SQLite guarda apenas os
+# metadados e o andamento dos envios em partes (uploads retomáveis).
+
+from metrics import timed
+from storage.migration import migrate
+from storage.pool import ConnectionPool
+import fcntl
+import hashlib
+import logging
+import os
+import secrets
+import sqlite3
+
+# Tamanho dos blocos lidos da requisição e do disco: nada de arquivo inteiro na memória
+BLOCK_SIZE = 64 * 1024
+
+# Migrações do esquema de anexos, aplicadas por storage.migration.migrate
+MIGRATIONS = [
+    # v1: envios em andamento (bytes recebidos até agora), anexos prontos por hash e
+    # quem enviou cada anexo (um mesmo conteúdo pode vir de vários usuários)
+    [
+        '''
+        CREATE TABLE uploads (
+            id TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            name TEXT,
+            content_type TEXT,
+            size INTEGER NOT NULL,
+            received INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL DEFAULT current_timestamp
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX idx_uploads_created ON uploads (created_at)',
+        '''
+        CREATE TABLE attachments (
+            id TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            name TEXT,
+            content_type TEXT,
+            created_at TEXT NOT NULL DEFAULT current_timestamp
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TABLE owners (
+            attachment TEXT NOT NULL,
+            owner TEXT NOT NULL,
+            PRIMARY KEY (attachment, owner)
+        ) WITHOUT ROWID
+        ''',
+    ],
+]
+
+UPLOAD_FIELDS = ('id', 'owner', 'name', 'content_type', 'size', 'received')
+ATTACHMENT_FIELDS = ('id', 'size', 'name', 'content_type')
+
+class AttachmentStorage:
+    def __init__(self, directory: str = 'attachments', path: str = 'attachment.db', pool_size: int = 8) -> None:
+        self.directory = directory
+        try:
+            #partes recebidas ficam em uploads/ até o envio terminar
+            os.makedirs(os.path.join(directory, 'uploads'), exist_ok=True)
+            #cria o pool de conexões com o banco de dados SQLite3
+            self.pool = ConnectionPool(path, pool_size)
+            #cria ou atualiza as tabelas de anexos
+            with self.pool.connection() as connection:
+                version = migrate(connection, 'attachments', MIGRATIONS)
+            logging.info('[AttachmentStorage] Attachment tables ready (schema v%s)', version)
+        except (OSError, sqlite3.Error) as e:
+            logging.error('[AttachmentStorage] Error creating attachment tables: %s', e)
+
+    def path(self, attachment) -> str:
+        #attachments/ab/abcdef...: dois níveis para não ter um diretório gigante
+        return os.path.join(self.directory, attachment[:2], attachment)
+
+    def _part(self, upload_id) -> str:
+        return os.path.join(self.directory, 'uploads', f'{upload_id}.part')
+
+    @timed('attachment')
+    def create_upload(self, owner, size, name=None, content_type=None) -> dict:
+        try:
+            upload_id = secrets.token_urlsafe(16)
+            open(self._part(upload_id), 'xb').close()
+            with self.pool.connection() as connection:
+                connection.execute('''
+                    INSERT INTO uploads (id, owner, name, content_type, size)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (upload_id, owner, name, content_type, size))
+            logging.info('[AttachmentStorage] Upload %s of %s bytes started by %s', upload_id, size, owner)
+            return dict(zip(UPLOAD_FIELDS, (upload_id, owner, name, content_type, size, 0)))
+        except (OSError, sqlite3.Error) as e:
+            logging.error('[AttachmentStorage] Error creating upload: %s', e)
+            return None
+
+    @timed('attachment')
+    def get_upload(self, upload_id) -> dict:
+        try:
+            with self.pool.connection() as connection:
+                row = connection.execute(f'''
+                    SELECT {', '.join(UPLOAD_FIELDS)} FROM uploads WHERE id = ?
+                ''', (upload_id,)).fetchone()
+            return dict(zip(UPLOAD_FIELDS, row)) if row else None
+        except sqlite3.Error as e:
+            logging.error('[AttachmentStorage] Error getting upload: %s', e)
+            return None
+
+    @timed('attachment')
+    def write_chunk(self, upload, offset, stream) -> int:
+        #grava no arquivo parcial os bytes que chegam a partir de offset, bloco a
+        #bloco, e devolve o novo total recebido. O flock impede dois processos de
+        #escreverem na mesma parte; None se o offset não for o esperado ou se os
+        #bytes passarem do tamanho declarado
+        try:
+            with open(self._part(upload['id']), 'r+b') as part:
+                fcntl.flock(part, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                with self.pool.connection() as connection:
+                    row = connection.execute('SELECT received FROM uploads WHERE id = ?', (upload['id'],)).fetchone()
+                if row is None or row[0] != offset:
+                    logging.warning('[AttachmentStorage] Upload %s expected offset %s, got %s',
+                                    upload['id'], row and row[0], offset)
+                    return None
+
+                part.seek(offset)
+                received = offset
+                while True:
+                    block = stream.read(BLOCK_SIZE)
+                    if not block:
+                        break
+                    received += len(block)
+                    if received > upload['size']:
+                        logging.warning('[AttachmentStorage] Upload %s is larger than declared', upload['id'])
+                        part.truncate(offset)
+                        return None
+                    part.write(block)
+                part.flush()
+                os.fsync(part.fileno())
+
+                #mesmo que a requisição caia no meio, o que foi gravado conta: o
+                #cliente retoma do offset salvo
+                with self.pool.connection() as connection:
+                    connection.execute('UPDATE uploads SET received = ? WHERE id = ?', (received, upload['id']))
+            return received
+        except BlockingIOError:
+            logging.warning('[AttachmentStorage] Upload %s is busy', upload['id'])
+            return None
+        except (OSError, sqlite3.Error) as e:
+            logging.error('[AttachmentStorage] Error writing upload %s: %s', upload['id'], e)
+            return None
+
+    @timed('attachment')
+    def complete_upload(self, upload) -> str:
+        #calcula o hash, move a parte para o endereço do conteúdo (ou descarta, se o
+        #conteúdo já existe) e devolve o id do anexo
+        try:
+            part_path = self._part(upload['id'])
+            digest = hashlib.sha256()
+            with open(part_path, 'rb') as part:
+                for block in iter(lambda: part.read(BLOCK_SIZE), b''):
+                    digest.update(block)
+            attachment = digest.hexdigest()
+
+            path = self.path(attachment)
+            if os.path.exists(path):
+                os.remove(part_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(part_path, path)
+
+            with self.pool.connection() as connection:
+                connection.execute('''
+                    INSERT OR IGNORE INTO attachments (id, size, name, content_type)
+                    VALUES (?, ?, ?, ?)
+                ''', (attachment, upload['size'], upload['name'], upload['content_type']))
+                connection.execute('INSERT OR IGNORE INTO owners (attachment, owner) VALUES (?, ?)',
+                                   (attachment, upload['owner']))
+                connection.execute('DELETE FROM uploads WHERE id = ?', (upload['id'],))
+            logging.info('[AttachmentStorage] Upload %s stored as %s', upload['id'], attachment)
+            return attachment
+        except (OSError, sqlite3.Error) as e:
+            logging.error('[AttachmentStorage] Error completing upload %s: %s', upload['id'], e)
+            return None
+
+    @timed('attachment')
+    def get_attachment(self, attachment) -> dict:
+        try:
+            with self.pool.connection() as connection:
+                row = connection.execute(f'''
+                    SELECT {', '.join(ATTACHMENT_FIELDS)} FROM attachments WHERE id = ?
+                ''', (attachment,)).fetchone()
+            return dict(zip(ATTACHMENT_FIELDS, row)) if row else None
+        except sqlite3.Error as e:
+            logging.error('[AttachmentStorage] Error getting attachment: %s', e)
+            return None
+
+    @timed('attachment')
+    def is_owner(self, attachment, owner) -> bool:
+        try:
+            with self.pool.connection() as connection:
+                row = connection.execute('SELECT 1 FROM owners WHERE attachment = ? AND owner = ?',
+                                         (attachment, owner)).fetchone()
+            return row is not None
+        except sqlite3.Error as e:
+            logging.error('[AttachmentStorage] Error checking attachment owner: %s', e)
+            return False
+
+    def prune_uploads(self, older_than: float) -> int:
+        #apaga envios abandonados há mais de older_than segundos (e as partes)
+        try:
+            with self.pool.connection() as connection:
+                rows = connection.execute('''
+                    DELETE FROM uploads WHERE created_at < datetime('now', ?) RETURNING id
+                ''', (f'-{older_than} seconds',)).fetchall()
+            for upload_id, in rows:
+                try:
+                    os.remove(self._part(upload_id))
+                except FileNotFoundError:
+                    pass
+            logging.info('[AttachmentStorage] %s abandoned uploads pruned', len(rows))
+            return len(rows)
+        except (OSError, sqlite3.Error) as e:
+            logging.error('[AttachmentStorage] Error pruning uploads: %s', e)
+            return None
+
+    def close(self) -> None:
+        self.pool.close()
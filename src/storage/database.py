@@ -0,0 +1,59 @@
+# Neste arquivo, codificamos o modo de banco único (usuários e mensagens no mesmo
+# arquivo SQLite, CHATAO_DATABASE) e a unidade de trabalho usada pelos serviços
+# para agrupar várias instruções, de um ou mais storages, num único commit.
+
+from contextlib import ExitStack, contextmanager
+from storage.migration import migrate
+from storage.pool import ConnectionPool
+import logging
+import sqlite3
+
+# Migrações das ligações entre usuários e mensagens, aplicadas só no banco único
+# (depois das migrações de users e messages). O SQLite não acrescenta FOREIGN KEY
+# a uma tabela existente, então a integridade e a remoção em cascata ficam em triggers
+LINK_MIGRATIONS = [
+    # v1: mensagem só entre usuários existentes (o MessageStorage já filtra no próprio
+    # insert; o trigger é a garantia para os demais); remover um usuário remove as mensagens
+    # e conversas dele (o FTS e os contadores de versão seguem pelos triggers de messages)
+    [
+        '''
+        CREATE TRIGGER messages_users_exist BEFORE INSERT ON messages
+        WHEN NOT EXISTS (SELECT 1 FROM users WHERE email = NEW.target)
+          OR NOT EXISTS (SELECT 1 FROM users WHERE email = NEW.source)
+        BEGIN
+            SELECT RAISE(ABORT, 'FOREIGN KEY constraint failed');
+        END
+        ''',
+        'CREATE INDEX idx_conversations_peer ON conversations (peer)',
+        '''
+        CREATE TRIGGER users_messages_delete AFTER DELETE ON users
+        BEGIN
+            DELETE FROM messages WHERE source = OLD.email OR target = OLD.email;
+            DELETE FROM conversations WHERE owner = OLD.email OR peer = OLD.email;
+        END
+        ''',
+    ],
+]
+
+def link(pool: ConnectionPool) -> int:
+    try:
+        with pool.connection() as connection:
+            version = migrate(connection, 'links', LINK_MIGRATIONS)
+        logging.info('[Database] Users and messages linked (schema v%s)', version)
+        return version
+    except sqlite3.Error as e:
+        logging.error('[Database] Error linking users and messages: %s', e)
+        return None
+
+class UnitOfWork:
+    def __init__(self, *pools: ConnectionPool) -> None:
+        #no banco único os storages dividem um pool e a unidade de trabalho é uma
+        #transação só; com bancos separados, uma transação por arquivo
+        self.pools = list({id(pool): pool for pool in pools}.values())
+
+    @contextmanager
+    def __call__(self):
+        with ExitStack() as stack:
+            for pool in self.pools:
+                stack.enter_context(pool.transaction())
+            yield
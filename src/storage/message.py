@@ -1,52 +1,800 @@
 # Neste arquivo, codificamos a lógica de armazenamento de dados de mensagens.
 
 from domain.message import Message
+from itertools import islice
+from metrics import timed
+from storage.migration import migrate
+from storage.pool import ConnectionPool
+from storage.shard import ID_STRIDE, reserve_ids, shard_index, shard_paths
+from storage.writer import BatchWriter
+import heapq
 import logging
+import os
 import sqlite3
+import zlib
+
+# Migrações do esquema de mensagens, aplicadas em ordem por storage.migration.migrate
+MIGRATIONS = [
+    # v1: tabela original, sem chave nem índices
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS messages (
+            source TEXT,
+            target TEXT,
+            message TEXT,
+            created_at TEXT NOT NULL DEFAULT current_timestamp
+        )
+        ''',
+    ],
+    # v2: chave inteira (rowid) e índices por destinatário e por remetente
+    [
+        'ALTER TABLE messages RENAME TO messages_v1',
+        '''
+        CREATE TABLE messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source TEXT,
+            target TEXT,
+            message TEXT,
+            created_at TEXT NOT NULL DEFAULT current_timestamp
+        )
+        ''',
+        '''
+        INSERT INTO messages (source, target, message, created_at)
+        SELECT source, target, message, created_at
+        FROM messages_v1
+        ORDER BY rowid
+        ''',
+        'DROP TABLE messages_v1',
+        'CREATE INDEX IF NOT EXISTS idx_messages_target_created ON messages (target, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_messages_source_created ON messages (source, created_at)',
+    ],
+    # v3: resumo de conversas por participante, mantido por trigger a cada insert;
+    # o histórico existente entra como lido
+    [
+        '''
+        CREATE TABLE conversations (
+            owner TEXT NOT NULL,
+            peer TEXT NOT NULL,
+            last_message_id INTEGER NOT NULL,
+            last_at TEXT NOT NULL,
+            unread INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (owner, peer)
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX idx_conversations_owner_last ON conversations (owner, last_at)',
+        '''
+        INSERT INTO conversations (owner, peer, last_message_id, last_at, unread)
+        SELECT owner, peer, MAX(id), MAX(created_at), 0
+        FROM (
+            SELECT source AS owner, target AS peer, id, created_at FROM messages
+            UNION ALL
+            SELECT target, source, id, created_at FROM messages WHERE source != target
+        )
+        GROUP BY owner, peer
+        ''',
+        '''
+        CREATE TRIGGER messages_conversations AFTER INSERT ON messages
+        BEGIN
+            INSERT INTO conversations (owner, peer, last_message_id, last_at, unread)
+            VALUES (NEW.source, NEW.target, NEW.id, NEW.created_at, 0)
+            ON CONFLICT (owner, peer) DO UPDATE SET
+                last_message_id = excluded.last_message_id,
+                last_at = excluded.last_at;
+            INSERT INTO conversations (owner, peer, last_message_id, last_at, unread)
+            SELECT NEW.target, NEW.source, NEW.id, NEW.created_at, 1
+            WHERE NEW.source != NEW.target
+            ON CONFLICT (owner, peer) DO UPDATE SET
+                last_message_id = excluded.last_message_id,
+                last_at = excluded.last_at,
+                unread = unread + 1;
+        END
+        ''',
+    ],
+    # v4: índice de texto completo (FTS5) sobre o conteúdo das mensagens; a tabela
+    # não guarda o texto (content='messages') e é mantida por triggers
+    [
+        '''
+        CREATE VIRTUAL TABLE messages_fts USING fts5(
+            message, content='messages', content_rowid='id'
+        )
+        ''',
+        '''
+        CREATE TRIGGER messages_fts_insert AFTER INSERT ON messages
+        BEGIN
+            INSERT INTO messages_fts (rowid, message) VALUES (NEW.id, NEW.message);
+        END
+        ''',
+        '''
+        CREATE TRIGGER messages_fts_delete AFTER DELETE ON messages
+        BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, message) VALUES ('delete', OLD.id, OLD.message);
+        END
+        ''',
+        '''
+        CREATE TRIGGER messages_fts_update AFTER UPDATE OF message ON messages
+        BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, message) VALUES ('delete', OLD.id, OLD.message);
+            INSERT INTO messages_fts (rowid, message) VALUES (NEW.id, NEW.message);
+        END
+        ''',
+        "INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')",
+    ],
+    # v5: contadores de versão (ETag) da caixa de entrada ('in:<email>') e das
+    # enviadas ('out:<email>'), incrementados por triggers a cada escrita
+    [
+        #IF NOT EXISTS: no banco único (storage.database) users e messages dividem a tabela
+        'CREATE TABLE IF NOT EXISTS versions (key TEXT PRIMARY KEY, version INTEGER NOT NULL) WITHOUT ROWID',
+        '''
+        CREATE TRIGGER messages_versions_insert AFTER INSERT ON messages
+        BEGIN
+            INSERT INTO versions (key, version) VALUES ('in:' || NEW.target, 1), ('out:' || NEW.source, 1)
+            ON CONFLICT (key) DO UPDATE SET version = version + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER messages_versions_delete AFTER DELETE ON messages
+        BEGIN
+            INSERT INTO versions (key, version) VALUES ('in:' || OLD.target, 1), ('out:' || OLD.source, 1)
+            ON CONFLICT (key) DO UPDATE SET version = version + 1;
+        END
+        ''',
+    ],
+    # v6: referência a um anexo (hash SHA-256 do conteúdo, ver storage.attachment);
+    # o arquivo fica no disco, nunca na tabela. O índice parcial responde quem pode
+    # baixar um anexo sem crescer com as mensagens sem anexo
+    [
+        'ALTER TABLE messages ADD COLUMN attachment TEXT',
+        'CREATE INDEX idx_messages_attachment ON messages (attachment) WHERE attachment IS NOT NULL',
+    ],
+]
+
+# Migrações do arquivo morto (mensagens antigas), um banco anexado a cada shard
+ARCHIVE_MIGRATIONS = [
+    # v1: mesma chave e índices da tabela quente; o texto fica comprimido (BLOB zlib)
+    # quando isso reduz o tamanho, senão fica como TEXT
+    [
+        '''
+        CREATE TABLE messages (
+            id INTEGER PRIMARY KEY,
+            source TEXT,
+            target TEXT,
+            message,
+            created_at TEXT NOT NULL
+        )
+        ''',
+        'CREATE INDEX idx_archive_target_created ON messages (target, created_at)',
+        'CREATE INDEX idx_archive_source_created ON messages (source, created_at)',
+    ],
+    # v2: referência ao anexo, como na v6 da tabela quente
+    [
+        'ALTER TABLE messages ADD COLUMN attachment TEXT',
+        'CREATE INDEX idx_archive_attachment ON messages (attachment) WHERE attachment IS NOT NULL',
+    ],
+]
+
+def archive_path(path: str) -> str:
+    #message.db -> message.archive.db (e message.0.db -> message.0.archive.db)
+    root, ext = os.path.splitext(path)
+    return f'{root}.archive{ext}'
+
+def _compress(text):
+    if not text:
+        return text
+    data = text.encode('utf-8')
+    packed = zlib.compress(data, 9)
+    return packed if len(packed) < len(data) else text
+
+def _messages(rows):
+    #converte as linhas de _select, descomprimindo o texto vindo do arquivo morto
+    for source, target, message, id, created_at, attachment, *_ in rows:
+        if isinstance(message, bytes):
+            message = zlib.decompress(message).decode('utf-8')
+        yield Message(source, target, message, id, created_at, attachment)
+
+def _fts_query(query: str) -> str:
+    #cada termo vira uma frase entre aspas (a sintaxe do FTS5 não chega ao usuário);
+    #um * no fim do termo mantém a busca por prefixo
+    terms = []
+    for term in query.split():
+        prefix = term.endswith('*')
+        term = term.rstrip('*').replace('"', '""')
+        if term:
+            terms.append(f'"{term}"' + ('*' if prefix else ''))
+    return ' '.join(terms)
+
+INSERT_MESSAGE = '''
+    INSERT INTO messages (source, target, message, attachment)
+    VALUES (?, ?, ?, ?)
+'''
+
+# Mesmo insert devolvendo a chave e o horário gerados pelo banco (não serve para
+# executemany, então o write-behind usa INSERT_MESSAGE)
+INSERT_MESSAGE_RETURNING = INSERT_MESSAGE + 'RETURNING id, created_at'
+
+# No banco único remetente e destinatário são conferidos na própria instrução: se um
+# deles não existe, nada é inserido (e um lote do write-behind não falha por causa de
+# uma linha). O trigger messages_users_exist fica só como garantia para outros inserts
+INSERT_LINKED_MESSAGE = '''
+    INSERT INTO messages (source, target, message, attachment)
+    SELECT ?1, ?2, ?3, ?4
+    WHERE EXISTS (SELECT 1 FROM users WHERE email = ?2)
+      AND EXISTS (SELECT 1 FROM users WHERE email = ?1)
+'''
+INSERT_LINKED_MESSAGE_RETURNING = INSERT_LINKED_MESSAGE + 'RETURNING id, created_at'
+
+# Linhas lidas por vez nas listagens em stream (NDJSON/SSE)
+STREAM_CHUNK = 500
+
+def _created(row) -> tuple:
+    #chave de ordenação (created_at, id) das linhas de _select
+    return row[4], row[3]
+
+def open_pool(path: str, pool_size: int = 8, archive: bool = False) -> ConnectionPool:
+    #o arquivo morto é um banco à parte, anexado como "archive" a cada conexão
+    attach = None
+    if archive:
+        cold = sqlite3.connect(archive_path(path))
+        try:
+            migrate(cold, 'archive', ARCHIVE_MIGRATIONS)
+        finally:
+            cold.close()
+        attach = {'archive': archive_path(path)}
+    return ConnectionPool(path, pool_size, attach=attach)
 
 class MessageStorage:
-    def __init__(self) -> None:
-        try:
-            #cria conexão com um banco de dados SQLite3
-            self.connection = sqlite3.connect('message.db', check_same_thread=False)
-            self.cursor = self.connection.cursor()
-            #cria a tabela de mensagens
-            self.cursor.execute('''
-                CREATE TABLE IF NOT EXISTS messages (
-                    source TEXT,
-                    target TEXT,
-                    message TEXT,
-                    created_at TEXT NOT NULL DEFAULT current_timestamp
-                )
-            ''')
-            self.connection.commit()
-            logging.info('[MessageStorage] Message table created')
+    def __init__(self, path: str = 'message.db', pool_size: int = 8,
+                 write_behind: bool = False, batch_size: int = 100, flush_interval: float = 0.05,
+                 shards: int = 1, archive: bool = False, pool: ConnectionPool = None) -> None:
+        self.pools = []
+        self.writers = []
+        self.archive = archive
+        #pool recebido: banco único, dividido com o UserStorage (ver storage.database)
+        self.linked = pool is not None
+        self.insert = INSERT_LINKED_MESSAGE if self.linked else INSERT_MESSAGE
+        self.insert_returning = INSERT_LINKED_MESSAGE_RETURNING if self.linked else INSERT_MESSAGE_RETURNING
+        if self.linked and shards > 1:
+            raise ValueError('a single database does not support message shards')
+        try:
+            for index, shard_path in enumerate(shard_paths(path, shards)):
+                #cria o pool de conexões com o banco de dados SQLite3 (um por shard)
+                if not self.linked:
+                    pool = open_pool(shard_path, pool_size, archive)
+                self.pools.append(pool)
+                #cria ou atualiza a tabela de mensagens
+                with pool.connection() as connection:
+                    version = migrate(connection, 'messages', MIGRATIONS)
+                    #cada shard gera ids na sua própria faixa
+                    if shards > 1:
+                        reserve_ids(connection, 'messages', index * ID_STRIDE)
+                #modo write-behind: inserts agrupados por uma thread de fundo
+                if write_behind:
+                    self.writers.append(BatchWriter(pool, self.insert, batch_size, flush_interval,
+                                                    returning=self.insert_returning))
+            logging.info('[MessageStorage] Message table ready (schema v%s, %s shards)', version, len(self.pools))
         except sqlite3.Error as e:
-            logging.error(f'[MessageStorage] Error creating message table: {e}')
+            logging.error('[MessageStorage] Error creating message table: %s', e)
 
-    def add_message(self, message) -> None:
+    def _shard(self, target) -> int:
+        #roteador: a mensagem mora no shard do destinatário
+        return shard_index(target, len(self.pools))
+
+    @timed('message')
+    def add_message(self, message, durable: bool = False, on_stored=None) -> bool:
+        #on_stored(message) é chamado depois do commit, já com id e created_at
         try:
+            shard = self._shard(message.target)
+            params = (message.source, message.target, message.message, message.attachment)
+            #em write-behind a mensagem só fica visível após o próximo lote,
+            #a menos que o chamador peça durabilidade (espera o commit)
+            if self.writers:
+                def stored(row):
+                    message.id, message.created_at = row
+                    on_stored(message)
+                return self.writers[shard].submit(params, wait=durable,
+                                                  callback=stored if on_stored is not None else None)
+
             #insere uma mensagem no banco de dados
-            self.cursor.execute('''
-                INSERT INTO messages (source, target, message)
-                VALUES (?, ?, ?)
-            ''', (message.source, message.target, message.message))
-            self.connection.commit()
+            with self.pools[shard].connection() as connection:
+                row = connection.execute(self.insert_returning, params).fetchone()
+            if row is None:
+                logging.warning('[MessageStorage] Source %s or target %s not found', message.source, message.target)
+                return False
+            message.id, message.created_at = row
             logging.info('[MessageStorage] Message added')
+            if on_stored is not None:
+                on_stored(message)
+            return True
+        except sqlite3.Error as e:
+            logging.error('[MessageStorage] Error adding message: %s', e)
+            return False
+
+    @timed('message')
+    def add_messages(self, messages) -> bool:
+        try:
+            #insere várias mensagens numa única transação por shard (um commit só
+            #por arquivo), guardando o id e o horário gerados de cada uma
+            groups = {}
+            for message in messages:
+                groups.setdefault(self._shard(message.target), []).append(message)
+            for shard, group in groups.items():
+                with self.pools[shard].connection() as connection:
+                    for message in group:
+                        row = connection.execute(
+                            self.insert_returning, (message.source, message.target, message.message, message.attachment)
+                        ).fetchone()
+                        if row is not None:
+                            message.id, message.created_at = row
+            logging.info('[MessageStorage] %s messages added', len(messages))
+            return True
+        except sqlite3.Error as e:
+            logging.error('[MessageStorage] Error adding messages: %s', e)
+            return False
+
+    def flush(self) -> bool:
+        #força a gravação das mensagens pendentes do modo write-behind
+        return all([writer.flush() for writer in self.writers])
+
+    def _cursor(self, pools, after) -> tuple:
+        #resolve o cursor de paginação (created_at, id); como os ids são únicos entre
+        #shards, o created_at vem do shard que tiver a mensagem
+        if after is None:
+            return None
+        sql = 'SELECT created_at FROM messages WHERE id = ?'
+        if self.archive:
+            sql += ' UNION ALL SELECT created_at FROM archive.messages WHERE id = ?'
+        for pool in pools:
+            with pool.connection() as connection:
+                row = connection.execute(sql, (after,) * (2 if self.archive else 1)).fetchone()
+            if row is not None:
+                return row[0], after
+        #cursor inexistente (ex.: since=0): tudo que veio depois desse id
+        return None, after
+
+    def _select(self, connection, column, value, cursor=None, limit=None) -> sqlite3.Cursor:
+        #consulta paginada por chave (keyset): (created_at, id) segue a ordem dos
+        #índices idx_messages_*_created, então não há ordenação em memória
+        where = f'{column} = ?'
+        params = (value,)
+        if cursor is not None:
+            created_at, after = cursor
+            if created_at is not None:
+                where += ' AND (created_at, id) > (?, ?)'
+                params += (created_at, after)
+            else:
+                where += ' AND id > ?'
+                params += (after,)
+        sql = f'SELECT source, target, message, id, created_at, attachment FROM messages WHERE {where}'
+        if self.archive:
+            #o arquivo morto tem os mesmos índices: o SQLite intercala os dois lados já
+            #ordenados, e a página só chega nele quando o cursor está antes da janela quente.
+            #Uma mensagem no meio do arquivamento pode estar nas duas tabelas: a cópia do
+            #arquivo é descartada antes do LIMIT, para a página não vir mais curta
+            sql += (' UNION ALL SELECT source, target, message, id, created_at, attachment FROM archive.messages'
+                    f' WHERE {where} AND NOT EXISTS (SELECT 1 FROM main.messages AS hot WHERE hot.id = archive.messages.id)')
+            params += params
+        sql += ' ORDER BY created_at, id'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params += (limit,)
+        return connection.execute(sql, params)
+
+    @timed('message')
+    def get_messages(self, target, after=None, limit=None) -> list[Message]:
+        try:
+            #busca as mensagens recebidas (usa idx_messages_target_created) no shard do destinatário
+            pool = self.pools[self._shard(target)]
+            cursor = self._cursor([pool], after)
+            with pool.connection() as connection:
+                rows = self._select(connection, 'target', target, cursor, limit).fetchall()
+            return list(_messages(rows))
         except sqlite3.Error as e:
-            logging.error(f'[MessageStorage] Error adding message: {e}')
+            logging.error('[MessageStorage] SQLite - Error getting messages: %s', e)
+        except Exception as e:
+            logging.error('[MessageStorage] Error getting messages: %s', e)
+            return None
 
-    def get_messages(self, target) -> list[Message]:
+    @timed('message')
+    def get_sent_messages(self, source, after=None, limit=None) -> list[Message]:
         try:
-            #busca todas as mensagens no banco de dados
-            self.cursor.execute('''
-                SELECT source, target, message
-                FROM messages
-                WHERE target = ?
-            ''', (target,))
-            return [Message(*message) for message in self.cursor.fetchall()]
+            #as mensagens enviadas ficam espalhadas pelos shards dos destinatários:
+            #cada shard devolve sua página já ordenada e as páginas são intercaladas
+            cursor = self._cursor(self.pools, after)
+            pages = []
+            for pool in self.pools:
+                with pool.connection() as connection:
+                    pages.append(self._select(connection, 'source', source, cursor, limit).fetchall())
+            rows = islice(heapq.merge(*pages, key=_created), limit)
+            return list(_messages(rows))
         except sqlite3.Error as e:
-            logging.error(f'[MessageStorage] SQLite - Error getting messages: {e}')
+            logging.error('[MessageStorage] SQLite - Error getting sent messages: %s', e)
         except Exception as e:
-            logging.error(f'[MessageStorage] Error getting messages: {e}')
+            logging.error('[MessageStorage] Error getting sent messages: %s', e)
             return None
+
+    @timed('message')
+    def get_last_message_id(self, target) -> int:
+        try:
+            #ponto de partida das assinaturas em tempo real (usa idx_messages_target_created)
+            with self.pools[self._shard(target)].connection() as connection:
+                row = connection.execute('''
+                    SELECT id
+                    FROM messages
+                    WHERE target = ?
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT 1
+                ''', (target,)).fetchone()
+                if row is None and self.archive:
+                    row = connection.execute('''
+                        SELECT id
+                        FROM archive.messages
+                        WHERE target = ?
+                        ORDER BY created_at DESC, id DESC
+                        LIMIT 1
+                    ''', (target,)).fetchone()
+            return row[0] if row else 0
+        except sqlite3.Error as e:
+            logging.error('[MessageStorage] Error getting last message id: %s', e)
+            return 0
+
+    @timed('message')
+    def has_attachment(self, email, attachment) -> bool:
+        #o usuário enviou ou recebeu alguma mensagem com este anexo? (idx_messages_attachment)
+        try:
+            sql = 'SELECT 1 FROM messages WHERE attachment = ? AND (source = ? OR target = ?)'
+            params = (attachment, email, email)
+            if self.archive:
+                sql += ' UNION ALL SELECT 1 FROM archive.messages WHERE attachment = ? AND (source = ? OR target = ?)'
+                params += params
+            for pool in self.pools:
+                with pool.connection() as connection:
+                    if connection.execute(sql + ' LIMIT 1', params).fetchone():
+                        return True
+            return False
+        except sqlite3.Error as e:
+            logging.error('[MessageStorage] Error checking attachment: %s', e)
+            return False
+
+    def get_version(self, box, email) -> int:
+        try:
+            #contador de mudanças usado nas ETags: 'in' mora no shard do destinatário;
+            #'out' se espalha pelos shards e a soma também só cresce
+            pools = [self.pools[self._shard(email)]] if box == 'in' else self.pools
+            version = 0
+            for pool in pools:
+                with pool.connection() as connection:
+                    row = connection.execute('SELECT version FROM versions WHERE key = ?', (f'{box}:{email}',)).fetchone()
+                version += row[0] if row else 0
+            return version
+        except sqlite3.Error as e:
+            logging.error('[MessageStorage] Error getting version: %s', e)
+            return None
+
+    @timed('message')
+    def get_conversations(self, owner, limit=None) -> tuple[list[dict], int]:
+        try:
+            #resumo da caixa de entrada: só lê conversations, nunca messages.
+            #A linha (owner, peer) aparece no shard de cada lado da conversa; os não
+            #lidos só crescem no shard do próprio owner (onde ele é o destinatário)
+            home = self._shard(owner)
+            conversations = {}
+            unread = 0
+            for index, pool in enumerate(self.pools):
+                with pool.connection() as connection:
+                    rows = connection.execute('''
+                        SELECT peer, last_message_id, last_at, unread
+                        FROM conversations
+                        WHERE owner = ?
+                        ORDER BY last_at DESC, last_message_id DESC
+                        LIMIT ?
+                    ''', (owner, -1 if limit is None else limit)).fetchall()
+                    if index == home:
+                        unread = connection.execute('''
+                            SELECT COALESCE(SUM(unread), 0)
+                            FROM conversations
+                            WHERE owner = ?
+                        ''', (owner,)).fetchone()[0]
+                for peer, last_id, last_at, count in rows:
+                    current = conversations.get(peer)
+                    if current is None or (last_at, last_id) > (current['last_at'], current['last_message_id']):
+                        conversations[peer] = {'peer': peer, 'last_message_id': last_id, 'last_at': last_at,
+                                               'unread': current['unread'] if current else 0}
+                    if index == home:
+                        conversations[peer]['unread'] = count
+            conversations = sorted(conversations.values(),
+                                   key=lambda c: (c['last_at'], c['last_message_id']), reverse=True)[:limit]
+
+            #o peer pode ter entrado no topo por outro shard: busca seus não lidos em casa
+            if len(self.pools) > 1 and conversations:
+                peers = [c['peer'] for c in conversations]
+                with self.pools[home].connection() as connection:
+                    counts = dict(connection.execute(f'''
+                        SELECT peer, unread
+                        FROM conversations
+                        WHERE owner = ? AND peer IN ({', '.join('?' * len(peers))})
+                    ''', (owner, *peers)).fetchall())
+                for conversation in conversations:
+                    conversation['unread'] = counts.get(conversation['peer'], 0)
+            return conversations, unread
+        except sqlite3.Error as e:
+            logging.error('[MessageStorage] Error getting conversations: %s', e)
+            return None
+
+    @timed('message')
+    def mark_read(self, owner, peer=None) -> bool:
+        try:
+            #zera os não lidos de uma conversa ou de todas (todos no shard do owner)
+            with self.pools[self._shard(owner)].connection() as connection:
+                if peer is None:
+                    connection.execute('UPDATE conversations SET unread = 0 WHERE owner = ? AND unread > 0', (owner,))
+                else:
+                    connection.execute('UPDATE conversations SET unread = 0 WHERE owner = ? AND peer = ?', (owner, peer))
+            return True
+        except sqlite3.Error as e:
+            logging.error('[MessageStorage] Error marking conversation as read: %s', e)
+            return False
+
+    @timed('message')
+    def search_messages(self, email, query, offset=0, limit=None) -> list[Message]:
+        try:
+            match = _fts_query(query)
+            if not match:
+                return []
+            #só mensagens enviadas ou recebidas pelo usuário, das mais relevantes (bm25);
+            #com vários shards, cada um devolve até offset + limit e o resultado é intercalado
+            window = -1 if limit is None else offset + limit
+            pages = []
+            for pool in self.pools:
+                with pool.connection() as connection:
+                    pages.append(connection.execute('''
+                        SELECT m.source, m.target, m.message, m.id, m.created_at, m.attachment, bm25(messages_fts) AS rank
+                        FROM messages_fts
+                        JOIN messages m ON m.id = messages_fts.rowid
+                        WHERE messages_fts MATCH ? AND (m.source = ? OR m.target = ?)
+                        ORDER BY rank, m.id
+                        LIMIT ?
+                    ''', (match, email, email, window)).fetchall())
+            rows = heapq.merge(*pages, key=lambda row: (row[6], row[3]))
+            rows = islice(rows, offset, None if limit is None else offset + limit)
+            return list(_messages(rows))
+        except sqlite3.Error as e:
+            logging.error('[MessageStorage] SQLite - Error searching messages: %s', e)
+            return None
+
+    def archive_messages(self, older_than: float, batch_size: int = 1000) -> int:
+        #move para o arquivo morto as mensagens com mais de older_than segundos.
+        #Em WAL uma transação não é atômica entre bancos anexados, então cada lote
+        #é copiado e só depois apagado da tabela quente: se cair no meio, a mensagem
+        #fica repetida (as leituras entregam uma vez só) e a próxima execução termina.
+        #O índice de busca (FTS) cobre só a janela quente
+        if not self.archive:
+            return 0
+        moved = 0
+        try:
+            for pool in self.pools:
+                while True:
+                    with pool.connection() as connection:
+                        rows = connection.execute('''
+                            SELECT id, source, target, message, created_at, attachment
+                            FROM messages
+                            WHERE created_at < datetime('now', ?)
+                            ORDER BY id
+                            LIMIT ?
+                        ''', (f'-{older_than} seconds', batch_size)).fetchall()
+                        connection.executemany('''
+                            INSERT OR IGNORE INTO archive.messages (id, source, target, message, created_at, attachment)
+                            VALUES (?, ?, ?, ?, ?, ?)
+                        ''', [(id, source, target, _compress(message), created_at, attachment)
+                              for id, source, target, message, created_at, attachment in rows])
+                    if not rows:
+                        break
+                    with pool.connection() as connection:
+                        connection.executemany('DELETE FROM messages WHERE id = ?', [(row[0],) for row in rows])
+                    moved += len(rows)
+            logging.info('[MessageStorage] %s messages archived', moved)
+            return moved
+        except sqlite3.Error as e:
+            logging.error('[MessageStorage] SQLite - Error archiving messages: %s', e)
+            return None
+
+    def rebuild_search(self) -> bool:
+        try:
+            #reconstrói o índice FTS a partir da tabela messages (bancos antigos,
+            #importações feitas com os triggers desligados, índice corrompido)
+            for pool in self.pools:
+                with pool.connection() as connection:
+                    connection.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+                    connection.execute("INSERT INTO messages_fts (messages_fts) VALUES ('optimize')")
+            return True
+        except sqlite3.Error as e:
+            logging.error('[MessageStorage] SQLite - Error rebuilding search index: %s', e)
+            return False
+
+    def _iter_rows(self, pool, column, value, cursor=None, limit=None):
+        #lê em blocos de STREAM_CHUNK linhas, continuando pela chave (created_at, id)
+        #da última; a conexão volta ao pool entre um bloco e outro, então um cliente
+        #lento (NDJSON/SSE) não segura uma conexão enquanto lê
+        remaining = limit
+        while remaining is None or remaining > 0:
+            size = STREAM_CHUNK if remaining is None else min(STREAM_CHUNK, remaining)
+            with pool.connection() as connection:
+                rows = self._select(connection, column, value, cursor, size).fetchall()
+            yield from rows
+            if len(rows) < size:
+                return
+            if remaining is not None:
+                remaining -= len(rows)
+            cursor = _created(rows[-1])
+
+    def iter_messages(self, target, after=None, limit=None):
+        #percorre as mensagens recebidas em blocos, sem carregar tudo na memória
+        pool = self.pools[self._shard(target)]
+        cursor = self._cursor([pool], after)
+        yield from _messages(self._iter_rows(pool, 'target', target, cursor, limit))
+
+    def iter_sent_messages(self, source, after=None, limit=None):
+        #percorre as mensagens enviadas de todos os shards, intercaladas por
+        #(created_at, id); cada shard é lido em blocos
+        cursor = self._cursor(self.pools, after)
+        shards = [self._iter_rows(pool, 'source', source, cursor, limit) for pool in self.pools]
+        yield from _messages(islice(heapq.merge(*shards, key=_created), limit))
+
+    @timed('message')
+    def delete_user_messages(self, email) -> bool:
+        #remove as mensagens enviadas e recebidas por um usuário e as conversas dele;
+        #no banco único o trigger users_messages_delete já limpou as tabelas quentes
+        try:
+            for pool in self.pools:
+                with pool.connection() as connection:
+                    if not self.linked:
+                        connection.execute('DELETE FROM messages WHERE source = ? OR target = ?', (email, email))
+                        connection.execute('DELETE FROM conversations WHERE owner = ? OR peer = ?', (email, email))
+                    if self.archive:
+                        connection.execute('DELETE FROM archive.messages WHERE source = ? OR target = ?', (email, email))
+            logging.info('[MessageStorage] Messages of %s deleted', email)
+            return True
+        except sqlite3.Error as e:
+            logging.error('[MessageStorage] Error deleting messages of %s: %s', email, e)
+            return False
+
+    def close(self) -> None:
+        for writer in self.writers:
+            writer.close()
+        #no banco único o pool é do UserStorage, que o fecha
+        if not self.linked:
+            for pool in self.pools:
+                pool.close()
+
+def rebalance(path: str, shards: int, new_shards: int, batch_size: int = 1000) -> int:
+    #redistribui as mensagens de N para M shards (offline: com o servidor parado).
+    #Os ids são preservados, então cursores e last_message_id continuam válidos;
+    #os novos shards geram ids numa faixa acima de todos os existentes
+    sources = [sqlite3.connect(source) for source in shard_paths(path, shards) if os.path.exists(source)]
+    targets = shard_paths(path, new_shards)
+    temporary = [f'{target}.rebalance' for target in targets]
+    moved = 0
+    try:
+        for target in temporary:
+            if os.path.exists(target):
+                os.remove(target)
+        connections = [sqlite3.connect(target) for target in temporary]
+        try:
+            last_id = 0
+            for source in sources:
+                #traz as origens para o esquema atual antes de copiar as colunas
+                migrate(source, 'messages', MIGRATIONS)
+                row = source.execute('SELECT MAX(id) FROM messages').fetchone()
+                last_id = max(last_id, row[0] or 0)
+            base = (last_id // ID_STRIDE + 1) * ID_STRIDE
+            for index, connection in enumerate(connections):
+                migrate(connection, 'messages', MIGRATIONS)
+                reserve_ids(connection, 'messages', base + index * ID_STRIDE)
+                connection.commit()
+
+            #copia em ordem (created_at, id) para o trigger deixar em conversations a
+            #última mensagem de cada par; o índice FTS é preenchido pelo outro trigger
+            cursors = [source.execute('''
+                SELECT source, target, message, id, created_at, attachment FROM messages ORDER BY created_at, id
+            ''') for source in sources]
+            pending = {}
+            for row in heapq.merge(*cursors, key=_created):
+                pending.setdefault(shard_index(row[1], new_shards), []).append(row)
+                moved += 1
+                if moved % batch_size == 0:
+                    _copy(connections, pending)
+            _copy(connections, pending)
+
+            #o trigger contou tudo como não lido: restaura os contadores antigos,
+            #que ficam no shard do owner
+            for connection in connections:
+                connection.execute('UPDATE conversations SET unread = 0')
+            for source in sources:
+                for owner, peer, unread in source.execute(
+                    'SELECT owner, peer, unread FROM conversations WHERE unread > 0'
+                ).fetchall():
+                    connections[shard_index(owner, new_shards)].execute(
+                        'UPDATE conversations SET unread = ? WHERE owner = ? AND peer = ?', (unread, owner, peer)
+                    )
+
+            #os contadores de versão (ETags) não podem voltar atrás, senão um cliente com
+            #uma ETag antiga receberia um 304 indevido: cada chave já conhecida fica só no
+            #shard do seu email, com a soma antiga + 1 (as contagens dos triggers saem)
+            old_versions = {}
+            for source in sources:
+                for key, version in source.execute('SELECT key, version FROM versions').fetchall():
+                    old_versions[key] = old_versions.get(key, 0) + version
+            for key, version in old_versions.items():
+                for connection in connections:
+                    connection.execute('DELETE FROM versions WHERE key = ?', (key,))
+                connections[shard_index(key.partition(':')[2], new_shards)].execute(
+                    'INSERT INTO versions (key, version) VALUES (?, ?)', (key, version + 1)
+                )
+            for connection in connections:
+                connection.commit()
+                connection.execute("INSERT INTO messages_fts (messages_fts) VALUES ('optimize')")
+                connection.commit()
+        finally:
+            for connection in connections:
+                connection.close()
+    finally:
+        for source in sources:
+            source.close()
+
+    #o arquivo morto de cada shard segue a mesma divisão
+    archives = [archive_path(source) for source in shard_paths(path, shards) if os.path.exists(archive_path(source))]
+    if archives:
+        _rebalance_archives(archives, [f'{archive_path(target)}.rebalance' for target in targets], new_shards, batch_size)
+        temporary += [f'{archive_path(target)}.rebalance' for target in targets]
+        targets = targets + [archive_path(target) for target in targets]
+
+    #troca os arquivos só depois que a cópia inteira deu certo
+    old_paths = shard_paths(path, shards)
+    for old in set(old_paths) | set(archive_path(old) for old in old_paths) | set(targets):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(old + suffix):
+                os.remove(old + suffix)
+    for source, target in zip(temporary, targets):
+        os.replace(source, target)
+    logging.info('[MessageStorage] %s messages rebalanced from %s to %s shards', moved, shards, new_shards)
+    return moved
+
+def _copy(connections, pending) -> None:
+    #grava as linhas acumuladas de cada shard de destino, um commit por lote
+    for shard, rows in pending.items():
+        connections[shard].executemany('''
+            INSERT INTO messages (source, target, message, id, created_at, attachment) VALUES (?, ?, ?, ?, ?, ?)
+        ''', rows)
+        connections[shard].commit()
+    pending.clear()
+
+def _rebalance_archives(sources, targets, new_shards, batch_size) -> None:
+    #copia o arquivo morto para os novos shards; o texto vai como está (comprimido)
+    for target in targets:
+        if os.path.exists(target):
+            os.remove(target)
+    connections = [sqlite3.connect(target) for target in targets]
+    try:
+        for connection in connections:
+            migrate(connection, 'archive', ARCHIVE_MIGRATIONS)
+        for source in sources:
+            archive = sqlite3.connect(source)
+            try:
+                migrate(archive, 'archive', ARCHIVE_MIGRATIONS)
+                cursor = archive.execute('SELECT id, source, target, message, created_at, attachment FROM messages')
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    pending = {}
+                    for row in rows:
+                        pending.setdefault(shard_index(row[2], new_shards), []).append(row)
+                    for shard, group in pending.items():
+                        connections[shard].executemany('''
+                            INSERT OR IGNORE INTO messages (id, source, target, message, created_at, attachment)
+                            VALUES (?, ?, ?, ?, ?, ?)
+                        ''', group)
+                        connections[shard].commit()
+            finally:
+                archive.close()
+    finally:
+        for connection in connections:
+            connection.close()
@@ -0,0 +1,46 @@
+# Neste arquivo, codificamos o controle de versão dos esquemas dos bancos de dados.
+# Cada storage declara uma lista ordenada de migrações; a versão aplicada fica
+# registrada na tabela schema_migrations, uma linha por storage.
+
+import logging
+import sqlite3
+
+def migrate(connection: sqlite3.Connection, name: str, migrations: list[list[str]]) -> int:
+    #cria a tabela de controle de versões
+    connection.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+    ''')
+    connection.commit()
+
+    row = connection.execute(
+        'SELECT version FROM schema_migrations WHERE name = ?', (name,)
+    ).fetchone()
+    current = row[0] if row else 0
+
+    #aplica as migrações pendentes, cada uma em sua própria transação; BEGIN IMMEDIATE
+    #trava a escrita, então vários workers subindo juntos não aplicam a mesma versão
+    for version, statements in enumerate(migrations[current:], start=current + 1):
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            row = connection.execute(
+                'SELECT version FROM schema_migrations WHERE name = ?', (name,)
+            ).fetchone()
+            if row and row[0] >= version:
+                connection.rollback()
+                continue
+            for statement in statements:
+                connection.execute(statement)
+            connection.execute('''
+                INSERT INTO schema_migrations (name, version) VALUES (?, ?)
+                ON CONFLICT(name) DO UPDATE SET version = excluded.version
+            ''', (name, version))
+            connection.commit()
+            logging.info('[Migration] %s migrated to version %s', name, version)
+        except sqlite3.Error:
+            connection.rollback()
+            raise
+
+    return len(migrations)
@@ -0,0 +1,126 @@
+# Neste arquivo, codificamos o pool de conexões SQLite compartilhado pelos storages.
+# Cada requisição pega uma conexão do pool (checkout), usa e devolve (checkin), de
+# modo que threads diferentes nunca dividem o mesmo cursor. Dentro de uma unidade
+# de trabalho (transaction), a thread reusa a mesma conexão e o commit é um só.
+
+from contextlib import contextmanager
+from storage.slowquery import connection_factory
+import logging
+import queue
+import sqlite3
+import threading
+
+# PRAGMAs aplicados a cada conexão nova. Em WAL os leitores não bloqueiam o
+# escritor (nem o contrário) e synchronous=NORMAL só faz fsync no checkpoint.
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -16000, # negativo = KiB, ~16MB por conexão
+}
+
+class ConnectionPool:
+    def __init__(self, path: str, size: int = 8, timeout: float = 5.0, pragmas: dict = None,
+                 attach: dict = None) -> None:
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = {**PRAGMAS, **(pragmas or {})}
+        self.attach = attach or {} # esquema -> caminho de outro banco, anexado a cada conexão
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._created = 0
+        self._lock = threading.Lock()
+        self._local = threading.local() # conexão da unidade de trabalho aberta nesta thread
+
+    def _connect(self) -> sqlite3.Connection:
+        #cria uma conexão nova já configurada
+        connection = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False,
+                                     factory=connection_factory())
+        for pragma, value in self.pragmas.items():
+            connection.execute(f'PRAGMA {pragma} = {value}')
+        for schema, path in self.attach.items():
+            connection.execute('ATTACH DATABASE ? AS ' + schema, (path,))
+            connection.execute(f"PRAGMA {schema}.journal_mode = {self.pragmas['journal_mode']}")
+        logging.debug('[ConnectionPool] Connection opened to %s', self.path)
+        return connection
+
+    def _checkout(self) -> sqlite3.Connection:
+        #reaproveita uma conexão ociosa, cria uma nova se houver vaga ou espera uma liberar
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+
+        if create:
+            try:
+                return self._connect()
+            except sqlite3.Error:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError(f'connection pool for {self.path} exhausted')
+
+    def _checkin(self, connection: sqlite3.Connection) -> None:
+        if connection.in_transaction:
+            connection.rollback()
+        self._idle.put_nowait(connection)
+
+    @contextmanager
+    def connection(self):
+        #empresta uma conexão: commit ao sair do bloco, rollback em caso de erro
+        current = getattr(self._local, 'connection', None)
+        if current is not None:
+            #dentro de transaction(): mesma conexão, o commit fica para o fim dela
+            yield current
+            return
+
+        connection = self._checkout()
+        try:
+            with connection:
+                yield connection
+        finally:
+            self._checkin(connection)
+
+    @contextmanager
+    def transaction(self):
+        #unidade de trabalho: todo acesso desta thread ao pool dentro do bloco (por
+        #qualquer storage que use este pool) entra numa única transação, com um
+        #commit só ao sair e rollback se o bloco levantar uma exceção
+        current = getattr(self._local, 'connection', None)
+        if current is not None:
+            #transação aninhada: junta-se à de fora
+            yield current
+            return
+
+        connection = self._checkout()
+        self._local.connection = connection
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            yield connection
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+        finally:
+            self._local.connection = None
+            self._checkin(connection)
+
+    def close(self) -> None:
+        #fecha as conexões ociosas (usado no desligamento)
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            connection.close()
+            with self._lock:
+                self._created -= 1
@@ -0,0 +1,76 @@
+# Neste arquivo, codificamos o armazenamento compartilhado dos baldes de limitação
+# de taxa (token bucket), usado quando vários processos atendem a API.
+
+from metrics import timed
+from storage.migration import migrate
+from storage.pool import ConnectionPool
+import logging
+import sqlite3
+import time
+
+# Migrações do esquema de limitação de taxa, aplicadas por storage.migration.migrate
+MIGRATIONS = [
+    # v1: um balde por chave (rota:escopo:usuário ou IP) com as fichas e a última atualização
+    [
+        '''
+        CREATE TABLE buckets (
+            key TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated REAL NOT NULL
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX idx_buckets_updated ON buckets (updated)',
+    ],
+]
+
+class RateLimitStorage:
+    def __init__(self, path: str = 'ratelimit.db', pool_size: int = 8,
+                 retention: float = 3600, prune_interval: float = 60) -> None:
+        #um balde parado por mais de retention segundos já estaria cheio: pode sair
+        self.retention = retention
+        self.prune_interval = prune_interval
+        self.next_prune = 0
+        try:
+            #cria o pool de conexões com o banco de dados SQLite3
+            self.pool = ConnectionPool(path, pool_size)
+            #cria ou atualiza a tabela de baldes
+            with self.pool.connection() as connection:
+                version = migrate(connection, 'ratelimit', MIGRATIONS)
+            logging.info('[RateLimitStorage] Bucket table ready (schema v%s)', version)
+        except sqlite3.Error as e:
+            logging.error('[RateLimitStorage] Error creating bucket table: %s', e)
+
+    @timed('ratelimit')
+    def take(self, key: str, rate: float, burst: float, cost: float = 1) -> float:
+        #gasta cost fichas numa única instrução (atômica entre processos); devolve 0
+        #se conseguiu ou quantos segundos faltam para ter fichas suficientes
+        now = time.time()
+        params = {'key': key, 'now': now, 'rate': rate, 'burst': burst, 'cost': cost}
+        try:
+            with self.pool.connection() as connection:
+                row = connection.execute('''
+                    INSERT INTO buckets (key, tokens, updated) VALUES (:key, :burst - :cost, :now)
+                    ON CONFLICT (key) DO UPDATE SET
+                        tokens = MIN(:burst, tokens + (:now - updated) * :rate) - :cost,
+                        updated = :now
+                    WHERE MIN(:burst, tokens + (:now - updated) * :rate) >= :cost
+                    RETURNING tokens
+                ''', params).fetchone()
+                if row is not None:
+                    if now >= self.next_prune:
+                        self.next_prune = now + self.prune_interval
+                        connection.execute('DELETE FROM buckets WHERE updated < ?', (now - self.retention,))
+                    return 0
+
+                tokens, updated = connection.execute(
+                    'SELECT tokens, updated FROM buckets WHERE key = ?', (key,)
+                ).fetchone()
+            tokens = min(burst, tokens + (now - updated) * rate)
+            return (cost - tokens) / rate
+        except sqlite3.Error as e:
+            #sem o banco, a requisição segue (falha aberta) para não derrubar a API
+            logging.error('[RateLimitStorage] Error taking tokens: %s', e)
+            return 0
+
+    def close(self) -> None:
+        self.pool.close()
@@ -0,0 +1,34 @@
+# Neste arquivo, codificamos as regras de particionamento (sharding) dos bancos.
+# Cada mensagem mora no arquivo do destinatário, escolhido por um hash estável do
+# email; assim a caixa de entrada de um usuário é sempre lida de um único arquivo.
+#
+# Os ids continuam únicos entre arquivos: cada shard recebe sua própria faixa de
+# ids (ID_STRIDE por shard) ajustando o sqlite_sequence do AUTOINCREMENT.
+
+import os
+import sqlite3
+import zlib
+
+# Tamanho da faixa de ids de cada shard (~10^12 mensagens por arquivo)
+ID_STRIDE = 1 << 40
+
+def shard_index(key: str, shards: int) -> int:
+    #crc32 é estável entre processos e versões do Python (ao contrário de hash())
+    if shards <= 1:
+        return 0
+    return zlib.crc32(key.encode('utf-8')) % shards
+
+def shard_paths(path: str, shards: int) -> list[str]:
+    #um shard só usa o caminho original; com N shards, message.db vira message.0.db ...
+    if shards <= 1:
+        return [path]
+    root, ext = os.path.splitext(path)
+    return [f'{root}.{index}{ext}' for index in range(shards)]
+
+def reserve_ids(connection: sqlite3.Connection, table: str, start: int) -> None:
+    #garante que o próximo id gerado pelo AUTOINCREMENT seja maior que start
+    row = connection.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,)).fetchone()
+    if row is None:
+        connection.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (table, start))
+    elif row[0] < start:
+        connection.execute('UPDATE sqlite_sequence SET seq = ? WHERE name = ?', (start, table))
@@ -0,0 +1,120 @@
+# Neste arquivo, codificamos o log de consultas lentas dos storages. Com um limite
+# configurado (CHATAO_SLOW_QUERY_MS), as conexões do ConnectionPool medem cada
+# execute/executemany (e a leitura das linhas com fetchone/fetchall) e registram as
+# que passam do limite, com o SQL, o formato dos parâmetros (nunca os valores) e
+# o EXPLAIN QUERY PLAN.
+
+from metrics import REGISTRY
+import logging
+import sqlite3
+import time
+
+SLOW_QUERIES = REGISTRY.counter(
+    'chatao_slow_queries_total', 'SQLite statements slower than the slow query threshold')
+
+# Instruções que aceitam EXPLAIN QUERY PLAN
+_EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'WITH')
+
+# Limite em segundos; None desliga a medição (conexões comuns, sem custo extra).
+# Cada TimedConnection guarda o limite do momento em que foi aberta
+threshold = None
+
+def configure(milliseconds: float) -> None:
+    #vale para as conexões abertas depois desta chamada (chamada em create_app)
+    global threshold
+    threshold = milliseconds / 1000 if milliseconds and milliseconds > 0 else None
+
+def connection_factory():
+    return TimedConnection if threshold is not None else sqlite3.Connection
+
+def _shape(parameters) -> str:
+    #tipos dos parâmetros, sem os valores (senhas, textos das mensagens)
+    if isinstance(parameters, dict):
+        return '{' + ', '.join(f'{name}: {type(value).__name__}' for name, value in parameters.items()) + '}'
+    return '(' + ', '.join(type(value).__name__ for value in parameters) + ')'
+
+def _plan(connection, sql, parameters) -> str:
+    if not sql.lstrip().upper().startswith(_EXPLAINABLE):
+        return None
+    try:
+        rows = sqlite3.Connection.execute(connection, 'EXPLAIN QUERY PLAN ' + sql, parameters).fetchall()
+        return '; '.join(row[-1] for row in rows) or None
+    except sqlite3.Error as e:
+        return f'unavailable ({e})'
+
+def _report(connection, sql, parameters, elapsed, rows=None) -> None:
+    SLOW_QUERIES.inc()
+    shape = _shape(parameters)
+    if rows is not None:
+        shape = f'{rows} x {shape}'
+    logging.warning('[SlowQuery] %.1f ms: %s params=%s plan=%s', elapsed * 1000,
+                    ' '.join(sql.split()), shape, _plan(connection, sql, parameters))
+
+class TimedCursor(sqlite3.Cursor):
+    #o tempo de um SELECT inclui a leitura das linhas (fetchone/fetchall); a
+    #iteração direta do cursor (streams NDJSON) não é medida
+    def execute(self, sql, parameters=()):
+        self.sql = sql
+        self.parameters = parameters
+        self.reported = False
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.elapsed = time.perf_counter() - start
+            #sem linhas para ler (INSERT, UPDATE...), a medida termina aqui
+            if self.description is None or self.elapsed >= self.connection.threshold:
+                self._check()
+
+    def executemany(self, sql, seq_of_parameters):
+        rows = list(seq_of_parameters)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, rows)
+        finally:
+            elapsed = time.perf_counter() - start
+            if rows and elapsed >= self.connection.threshold:
+                _report(self.connection, sql, rows[0], elapsed, len(rows))
+
+    def _check(self) -> None:
+        if not self.reported and self.elapsed >= self.connection.threshold:
+            self.reported = True
+            _report(self.connection, self.sql, self.parameters, self.elapsed)
+
+    def _fetch(self, fetch, *args):
+        start = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            if hasattr(self, 'sql'):
+                self.elapsed += time.perf_counter() - start
+                self._check()
+
+    def fetchone(self):
+        return self._fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._fetch(super().fetchmany, self.arraysize if size is None else size)
+
+    def fetchall(self):
+        return self._fetch(super().fetchall)
+
+class TimedConnection(sqlite3.Connection):
+    #connection.execute do sqlite3 cria o cursor em C, sem passar por cursor():
+    #os atalhos são refeitos aqui para usar o TimedCursor
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        #um configure() posterior não muda as conexões já abertas
+        self.threshold = threshold if threshold is not None else float('inf')
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, script):
+        return self.cursor().executescript(script)
@@ -1,109 +1,270 @@
 # Neste arquivo, codificamos a lógica de armazenamento de dados de usuários.
 
 from domain.user import User
+from metrics import timed
+from storage.migration import migrate
+from storage.pool import ConnectionPool
 import sqlite3
 import logging
 
+# Migrações do esquema de usuários, aplicadas em ordem por storage.migration.migrate
+MIGRATIONS = [
+    # v1: tabela de usuários
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            email TEXT PRIMARY KEY,
+            password TEXT,
+            nickname TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ],
+    # v2: registro de invalidações (cache de usuários e revogação de tokens),
+    # lido por todos os processos worker
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS invalidations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            at REAL NOT NULL
+        )
+        ''',
+    ],
+    # v3: contadores de versão (ETag) da tabela inteira ('users') e de cada usuário
+    # ('user:<email>'), incrementados por triggers a cada escrita
+    [
+        #IF NOT EXISTS: no banco único (storage.database) users e messages dividem a tabela
+        'CREATE TABLE IF NOT EXISTS versions (key TEXT PRIMARY KEY, version INTEGER NOT NULL) WITHOUT ROWID',
+        '''
+        CREATE TRIGGER users_versions_insert AFTER INSERT ON users
+        BEGIN
+            INSERT INTO versions (key, version) VALUES ('users', 1), ('user:' || NEW.email, 1)
+            ON CONFLICT (key) DO UPDATE SET version = version + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER users_versions_update AFTER UPDATE ON users
+        BEGIN
+            INSERT INTO versions (key, version) VALUES ('users', 1), ('user:' || NEW.email, 1)
+            ON CONFLICT (key) DO UPDATE SET version = version + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER users_versions_delete AFTER DELETE ON users
+        BEGIN
+            INSERT INTO versions (key, version) VALUES ('users', 1), ('user:' || OLD.email, 1)
+            ON CONFLICT (key) DO UPDATE SET version = version + 1;
+        END
+        ''',
+    ],
+    # v4: listagem paginada. Índice para a busca por prefixo do apelido (sem
+    # diferenciar maiúsculas) e total de usuários mantido por triggers, para não
+    # contar a tabela inteira a cada página
+    [
+        'CREATE INDEX idx_users_nickname ON users (lower(nickname), email)',
+        'CREATE TABLE counts (name TEXT PRIMARY KEY, total INTEGER NOT NULL) WITHOUT ROWID',
+        "INSERT INTO counts (name, total) SELECT 'users', COUNT(*) FROM users",
+        '''
+        CREATE TRIGGER users_counts_insert AFTER INSERT ON users
+        BEGIN
+            UPDATE counts SET total = total + 1 WHERE name = 'users';
+        END
+        ''',
+        '''
+        CREATE TRIGGER users_counts_delete AFTER DELETE ON users
+        BEGIN
+            UPDATE counts SET total = total - 1 WHERE name = 'users';
+        END
+        ''',
+    ],
+    # v5: busca por prefixo do email sem diferenciar maiúsculas (há emails legados
+    # como User01@gmail.com, e o termo da busca chega em minúsculas)
+    [
+        'CREATE INDEX idx_users_email_lower ON users (lower(email), email)',
+    ],
+]
+
+# Maior caractere Unicode: prefixo <= valor < prefixo + PREFIX_END é uma faixa do índice
+PREFIX_END = '\U0010ffff'
+
 class UserStorage:
-    def __init__(self) -> None:
-        #cria conexão com um banco de dados SQLite3
+    def __init__(self, path: str = 'user.db', pool_size: int = 8, pool: ConnectionPool = None) -> None:
+        #cria o pool de conexões com o banco de dados SQLite3 (ou usa o do banco
+        #único, dividido com o MessageStorage)
         try:
-            self.connection = sqlite3.connect('user.db', check_same_thread=False)
-            self.cursor = self.connection.cursor()
-            #cria a tabela de usuários
-            self.cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    email TEXT PRIMARY KEY,
-                    password TEXT,
-                    nickname TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP                            
-                )
-            ''')        
-            self.connection.commit()        
-            logging.info('[UserStorage] User table created')
+            self.pool = pool or ConnectionPool(path, pool_size)
+            #cria ou atualiza as tabelas de usuários
+            with self.pool.connection() as connection:
+                version = migrate(connection, 'users', MIGRATIONS)
+            logging.info('[UserStorage] User table ready (schema v%s)', version)
         except sqlite3.Error as e:
-            logging.error(f'[UserStorage] Error creating user table: {e}')
+            logging.error('[UserStorage] Error creating user table: %s', e)
 
+    @timed('user')
     def add_user(self, user) -> None:
         try:
-            if self.cursor is None:
-                self.cursor = self.connection.cursor()
-
             #insere um usuário no banco de dados
-            self.cursor.execute('''
-                INSERT INTO users (email, password, nickname)
-                VALUES (?, ?, ?)
-            ''', (user.email, user.password, user.nickname))
-            self.connection.commit()
-            logging.info(f'[UserStorage] User {user.email} added')
+            with self.pool.connection() as connection:
+                connection.execute('''
+                    INSERT INTO users (email, password, nickname)
+                    VALUES (?, ?, ?)
+                ''', (user.email, user.password, user.nickname))
+            logging.info('[UserStorage] User %s added', user.email)
         except sqlite3.Error as e:
-            logging.error(f'[UserStorage] Error adding user: {e}')
+            logging.error('[UserStorage] Error adding user: %s', e)
 
+    @timed('user')
     def get_user(self, email) -> User:
         try:
             #busca um usuário no banco de dados
-            self.cursor.execute('''
-                SELECT email, password, nickname
-                FROM users
-                WHERE email = ?
-            ''', (email,))
-            user = self.cursor.fetchone()
-           
+            with self.pool.connection() as connection:
+                user = connection.execute('''
+                    SELECT email, password, nickname, created_at
+                    FROM users
+                    WHERE email = ?
+                ''', (email,)).fetchone()
+
             if user:
                 ret = User(*user)
-                logging.debug(f'[UserStorage] User {email} found: {ret}')
+                logging.debug('[UserStorage] User %s found: %s', email, ret)
                 return ret
-            
-            logging.warn(f'[UserStorage] User {email} not found')
+
+            logging.warning('[UserStorage] User %s not found', email)
             return None
         except sqlite3.Error as e:
-            logging.error(f'[UserStorage] Error getting user: {e}')
+            logging.error('[UserStorage] Error getting user: %s', e)
 
-    def get_all_users(self) -> list[User]:
+    @timed('user')
+    def list_users(self, prefix=None, after=None, limit=100) -> list[User]:
+        #uma página de usuários em ordem de email, só com email, apelido e criação
+        #(sem o hash da senha); prefix filtra pelo início do email ou do apelido
         try:
-            if self.cursor is None:
-                self.cursor = self.connection.cursor()
-                
-            #busca todos os usuários no banco de dados
-            self.cursor.execute('''
-                SELECT email, password, nickname
-                FROM users
-            ''')
-            return [User(*user) for user in self.cursor.fetchall()]
+            params = {'after': after or '', 'limit': limit}
+            if prefix:
+                #as duas faixas usam índices (idx_users_email_lower e idx_users_nickname)
+                params['low'] = prefix.lower()
+                params['high'] = prefix.lower() + PREFIX_END
+                query = '''
+                    SELECT email, nickname, created_at FROM users
+                    WHERE lower(email) >= :low AND lower(email) < :high AND email > :after
+                    UNION
+                    SELECT email, nickname, created_at FROM users
+                    WHERE lower(nickname) >= :low AND lower(nickname) < :high AND email > :after
+                    ORDER BY email
+                    LIMIT :limit
+                '''
+            else:
+                query = '''
+                    SELECT email, nickname, created_at FROM users
+                    WHERE email > :after
+                    ORDER BY email
+                    LIMIT :limit
+                '''
+            with self.pool.connection() as connection:
+                users = connection.execute(query, params).fetchall()
+            return [User(email, None, nickname, created_at) for email, nickname, created_at in users]
         except sqlite3.Error as e:
-            logging.error(f'[UserStorage] Error getting all users: {e}')
+            logging.error('[UserStorage] Error listing users: %s', e)
 
+    def count_users(self) -> int:
+        try:
+            #total mantido pelos triggers de users (uma linha, sem varrer a tabela)
+            with self.pool.connection() as connection:
+                row = connection.execute("SELECT total FROM counts WHERE name = 'users'").fetchone()
+            return row[0] if row else 0
+        except sqlite3.Error as e:
+            logging.error('[UserStorage] Error counting users: %s', e)
+            return None
+
+    @timed('user')
+    def get_existing_emails(self, emails) -> set[str]:
+        try:
+            #verifica vários usuários de uma vez, em blocos que respeitam o
+            #limite de parâmetros do SQLite
+            emails = list(set(emails))
+            found = set()
+            with self.pool.connection() as connection:
+                for i in range(0, len(emails), 500):
+                    chunk = emails[i:i + 500]
+                    rows = connection.execute(f'''
+                        SELECT email
+                        FROM users
+                        WHERE email IN ({', '.join('?' * len(chunk))})
+                    ''', chunk).fetchall()
+                    found.update(email for email, in rows)
+            return found
+        except sqlite3.Error as e:
+            logging.error('[UserStorage] Error checking users: %s', e)
+
+    @timed('user')
     def update_user(self, user) -> bool:
         try:
-            if self.cursor is None:
-                self.cursor = self.connection.cursor()
-                
             #atualiza um usuário no banco de dados
-            self.cursor.execute('''
-                UPDATE users
-                SET password = ?, nickname = ?
-                WHERE email = ?
-            ''', (user.password, user.nickname, user.email))
-            self.connection.commit()
-            logging.info(f'[UserStorage] User {user.email} updated')
+            with self.pool.connection() as connection:
+                connection.execute('''
+                    UPDATE users
+                    SET password = ?, nickname = ?
+                    WHERE email = ?
+                ''', (user.password, user.nickname, user.email))
+            logging.info('[UserStorage] User %s updated', user.email)
             return True
         except sqlite3.Error as e:
-            logging.error(f'[UserStorage] Error updating user: {e}')
+            logging.error('[UserStorage] Error updating user: %s', e)
             return False
 
+    @timed('user')
     def delete_user(self, email) -> bool:
         try:
-            if self.cursor is None:
-                self.cursor = self.connection.cursor()
-                
             #deleta um usuário no banco de dados
-            self.cursor.execute('''
-                DELETE FROM users
-                WHERE email = ?
-            ''', (email,))
-            self.connection.commit()
-            logging.info(f'[UserStorage] User {email} deleted')
+            with self.pool.connection() as connection:
+                connection.execute('''
+                    DELETE FROM users
+                    WHERE email = ?
+                ''', (email,))
+            logging.info('[UserStorage] User %s deleted', email)
+            return True
+        except sqlite3.Error as e:
+            logging.error('[UserStorage] Error deleting user: %s', e)
+            return False
+
+    def add_invalidation(self, kind, key, at, retention) -> bool:
+        try:
+            #registra a invalidação e descarta as que nenhum processo precisa mais
+            with self.pool.connection() as connection:
+                connection.execute('''
+                    INSERT INTO invalidations (kind, key, at)
+                    VALUES (?, ?, ?)
+                ''', (kind, key, at))
+                connection.execute('DELETE FROM invalidations WHERE at < ?', (at - retention,))
             return True
         except sqlite3.Error as e:
-            logging.error(f'[UserStorage] Error deleting user: {e}')
-            return False
\ No newline at end of file
+            logging.error('[UserStorage] Error adding invalidation: %s', e)
+            return False
+
+    def get_invalidations(self, after_id) -> list[tuple]:
+        try:
+            with self.pool.connection() as connection:
+                return connection.execute('''
+                    SELECT id, kind, key, at
+                    FROM invalidations
+                    WHERE id > ?
+                    ORDER BY id
+                ''', (after_id,)).fetchall()
+        except sqlite3.Error as e:
+            logging.error('[UserStorage] Error getting invalidations: %s', e)
+            return []
+
+    def get_version(self, key) -> int:
+        try:
+            #contador de mudanças usado nas ETags (uma busca pela chave primária)
+            with self.pool.connection() as connection:
+                row = connection.execute('SELECT version FROM versions WHERE key = ?', (key,)).fetchone()
+            return row[0] if row else 0
+        except sqlite3.Error as e:
+            logging.error('[UserStorage] Error getting version: %s', e)
+            return None
+
+    def close(self) -> None:
+        self.pool.close()
@@ -0,0 +1,129 @@
+# Neste arquivo, codificamos a escrita em lote (write-behind) usada pelos storages.
+# As escritas entram numa fila em memória e uma thread de fundo as agrupa com
+# executemany numa única transação a cada batch_size itens ou interval segundos.
+# Quem precisa do resultado da escrita (id gerado) passa um callback, chamado
+# depois do commit com a linha devolvida pelo RETURNING.
+
+from storage.pool import ConnectionPool
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+class _Write:
+    __slots__ = ('params', 'done', 'ok', 'callback', 'row')
+
+    def __init__(self, params, done: threading.Event = None, callback=None) -> None:
+        self.params = params # None = barreira de flush
+        self.done = done
+        self.ok = False
+        self.callback = callback
+        self.row = None
+
+_STOP = object()
+
+class BatchWriter:
+    def __init__(self, pool: ConnectionPool, sql: str, batch_size: int = 100, interval: float = 0.05,
+                 returning: str = None) -> None:
+        self.pool = pool
+        self.sql = sql
+        #mesma escrita com RETURNING, usada para as escritas que têm callback
+        self.returning = returning
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='BatchWriter', daemon=True)
+        self._thread.start()
+
+    def submit(self, params, wait: bool = False, timeout: float = None, callback=None) -> bool:
+        #enfileira uma escrita; com wait=True só retorna depois do commit (durável).
+        #callback(row) roda na thread de fundo após o commit, se a escrita gerou linha
+        if self._closed:
+            raise sqlite3.OperationalError('batch writer is closed')
+        if callback is not None and self.returning is None:
+            raise ValueError('callback requires a returning statement')
+
+        write = _Write(params, threading.Event() if wait else None, callback)
+        self._queue.put(write)
+        if not wait:
+            return True
+        return write.done.wait(timeout) and write.ok
+
+    def flush(self, timeout: float = None) -> bool:
+        #espera tudo que já estava na fila ser gravado
+        if self._closed:
+            return True
+        return self.submit(None, wait=True, timeout=timeout)
+
+    def close(self) -> None:
+        #grava o que restou na fila e encerra a thread de fundo
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+
+        #escritas que chegaram junto com o pedido de parada
+        leftover = []
+        while True:
+            try:
+                leftover.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if leftover:
+            self._write(leftover)
+
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.interval
+            #junta itens até encher o lote, estourar o intervalo ou alguém pedir durabilidade
+            while len(batch) < self.batch_size and batch[-1].done is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+
+            self._write(batch)
+
+    def _write(self, batch: list[_Write]) -> None:
+        writes = [write for write in batch if write.params is not None]
+        ok = True
+        try:
+            if writes:
+                with self.pool.connection() as connection:
+                    #com callbacks, uma instrução por linha para ler o RETURNING;
+                    #continua sendo uma única transação
+                    if any(write.callback is not None for write in writes):
+                        for write in writes:
+                            write.row = connection.execute(self.returning, write.params).fetchone()
+                    else:
+                        connection.executemany(self.sql, [write.params for write in writes])
+                logging.debug('[BatchWriter] %s rows written', len(writes))
+        except sqlite3.Error as e:
+            logging.error('[BatchWriter] Error writing batch of %s rows: %s', len(writes), e)
+            ok = False
+
+        for write in batch:
+            write.ok = ok
+            if ok and write.callback is not None and write.row is not None:
+                try:
+                    write.callback(write.row)
+                except Exception as e:
+                    logging.error('[BatchWriter] Error in write callback: %s', e)
+            if write.done is not None:
+                write.done.set()
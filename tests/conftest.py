@@ -0,0 +1,28 @@
+# Configuração comum dos testes: o código fica em src/ e cada teste usa bancos
+# e diretórios temporários próprios.
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from config import Config
+
+@pytest.fixture
+def environ(tmp_path):
+    #variáveis CHATAO_* apontando para um diretório temporário
+    return {
+        'CHATAO_USER_DB': str(tmp_path / 'user.db'),
+        'CHATAO_MESSAGE_DB': str(tmp_path / 'message.db'),
+        'CHATAO_ATTACHMENT_DB': str(tmp_path / 'attachment.db'),
+        'CHATAO_ATTACHMENT_DIR': str(tmp_path / 'attachments'),
+        'CHATAO_JWT_SECRET': 'test-secret',
+        'CHATAO_RATE_LIMITS': '',
+        'CHATAO_LOG_LEVEL': 'WARNING',
+    }
+
+@pytest.fixture
+def config(environ):
+    return Config.from_env(environ)
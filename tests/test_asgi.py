@@ -0,0 +1,74 @@
+# Testes da variante ASGI (src/asgi.py).
+
+import asyncio
+import importlib
+import sys
+import threading
+import time
+
+import pytest
+
+@pytest.fixture
+def asgi(environ, monkeypatch):
+    for name, value in environ.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.setenv('CHATAO_ASYNC_WORKERS', '8')
+    sys.modules.pop('asgi', None)
+    module = importlib.import_module('asgi')
+    yield module
+    sys.modules.pop('asgi', None)
+
+async def _lifespan(application, event):
+    messages = asyncio.Queue()
+    await messages.put({'type': event})
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    async def receive():
+        if messages.empty():
+            await messages.put({'type': 'lifespan.shutdown'})
+        return await messages.get()
+
+    await application({'type': 'lifespan'}, receive, send)
+    return sent
+
+async def _get(application, path):
+    scope = {
+        'type': 'http', 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'root_path': '', 'query_string': b'',
+        'headers': [], 'server': ('test', 80), 'client': ('127.0.0.1', 1234),
+    }
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        sent.append(message)
+
+    await application(scope, receive, send)
+    return sent[0]['status']
+
+def test_flask_routes_run_concurrently(asgi):
+    threads = set()
+
+    @asgi.app.route('/slow')
+    def slow():
+        threads.add(threading.current_thread().name)
+        time.sleep(0.2)
+        return 'ok'
+
+    async def main():
+        await _lifespan(asgi.application, 'lifespan.startup')
+        start = time.perf_counter()
+        statuses = await asyncio.gather(*(_get(asgi.application, '/slow') for _ in range(8)))
+        return statuses, time.perf_counter() - start
+
+    statuses, elapsed = asyncio.run(main())
+    assert statuses == [200] * 8
+    #em série seriam 1,6 s; em paralelo, perto de 0,2 s
+    assert elapsed < 0.8
+    assert len(threads) > 1
+    assert all(name.startswith('BlockingExecutor') for name in threads)
@@ -0,0 +1,64 @@
+# Testes do hash de senhas (src/service/cypher.py) e da sua configuração.
+
+import pytest
+
+from app import create_app
+from config import Config
+from service.cypher import CypherService, HashQueueFull
+
+LOW = {'algorithm': 'scrypt', 'scrypt_n': 2 ** 10, 'scrypt_r': 8, 'scrypt_p': 1}
+
+def test_needs_rehash_when_cost_is_raised():
+    stored = CypherService('secret', hash_params=LOW).cypher_password('12345678')
+
+    assert not CypherService('secret', hash_params=LOW).needs_rehash(stored)
+    assert CypherService('secret', hash_params={**LOW, 'scrypt_n': 2 ** 11}).needs_rehash(stored)
+    assert CypherService('secret', hash_params={**LOW, 'scrypt_r': 16}).needs_rehash(stored)
+    assert CypherService('secret', hash_params={'algorithm': 'pbkdf2_sha256'}).needs_rehash(stored)
+
+def test_needs_rehash_when_iterations_are_raised():
+    params = {'algorithm': 'pbkdf2_sha256', 'pbkdf2_iterations': 1000}
+    stored = CypherService('secret', hash_params=params).cypher_password('12345678')
+
+    assert not CypherService('secret', hash_params=params).needs_rehash(stored)
+    assert CypherService('secret', hash_params={**params, 'pbkdf2_iterations': 2000}).needs_rehash(stored)
+
+def test_unknown_algorithm_is_rejected():
+    with pytest.raises(ValueError):
+        CypherService('secret', hash_params={'algorithm': 'md5'})
+
+def test_login_rehashes_with_configured_cost(environ):
+    environ = {**environ, 'CHATAO_SCRYPT_N': str(2 ** 10)}
+    app = create_app(Config.from_env(environ))
+    client = app.test_client()
+    client.post('/user', json={'email': 'a@x', 'password': '12345678', 'nickname': 'a'})
+    user_storage = app.extensions['chatao']['user_service'].user_storage
+    assert user_storage.get_user('a@x').password.startswith('scrypt$1024$')
+
+    #mesmo banco, custo maior: o login aceita a senha antiga e a regrava
+    app = create_app(Config.from_env({**environ, 'CHATAO_SCRYPT_N': str(2 ** 11)}))
+    response = app.test_client().post('/auth', json={'email': 'a@x', 'password': '12345678'})
+    assert response.status_code == 200
+    user_storage = app.extensions['chatao']['user_service'].user_storage
+    assert user_storage.get_user('a@x').password.startswith('scrypt$2048$')
+
+def test_full_hash_queue_fails_fast():
+    cypher = CypherService('secret', hash_params=LOW, hash_workers=1, hash_queue=1)
+    for _ in range(2):
+        cypher.hash_slots.acquire()
+
+    with pytest.raises(HashQueueFull):
+        cypher.cypher_password('12345678')
+
+def test_auth_answers_503_when_hash_queue_is_full(environ):
+    app = create_app(Config.from_env({**environ, 'CHATAO_SCRYPT_N': str(2 ** 10)}))
+    client = app.test_client()
+    client.post('/user', json={'email': 'a@x', 'password': '12345678', 'nickname': 'a'})
+    cypher = app.extensions['chatao']['auth_service'].cypherService
+    while cypher.hash_slots.acquire(blocking=False):
+        pass
+
+    response = client.post('/auth', json={'email': 'a@x', 'password': '12345678'})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert client.post('/user', json={'email': 'b@x', 'password': '12345678', 'nickname': 'b'}).status_code == 503
@@ -0,0 +1,39 @@
+# Testes do modo de banco único (CHATAO_DATABASE).
+
+from app import create_app
+from config import Config
+from domain.message import Message
+
+def test_write_behind_batch_skips_rows_with_unknown_users(environ, tmp_path):
+    config = Config.from_env({**environ, 'CHATAO_DATABASE': str(tmp_path / 'chatao.db')},
+                             write_behind=True, flush_interval=0.2)
+    app = create_app(config)
+    client = app.test_client()
+    for email in ('a@x', 'b@x'):
+        client.post('/user', json={'email': email, 'password': '12345678', 'nickname': email})
+    message_storage = app.extensions['chatao']['message_service'].message_storage
+
+    #mesmo lote: remetente e destinatário inexistentes no meio de mensagens válidas
+    assert message_storage.add_message(Message('a@x', 'b@x', 'first'))
+    assert message_storage.add_message(Message('ghost@x', 'b@x', 'bad source'))
+    assert message_storage.add_message(Message('a@x', 'ghost@x', 'bad target'))
+    assert message_storage.add_message(Message('b@x', 'a@x', 'last'))
+    assert message_storage.flush()
+
+    assert [message.message for message in message_storage.get_messages('b@x')] == ['first']
+    assert [message.message for message in message_storage.get_messages('a@x')] == ['last']
+    message_storage.close()
+
+def test_separate_databases_keep_messages_of_deleted_users(environ):
+    app = create_app(Config.from_env(environ))
+    client = app.test_client()
+    tokens = {}
+    for email in ('a@x', 'b@x'):
+        client.post('/user', json={'email': email, 'password': '12345678', 'nickname': email})
+        tokens[email] = client.post('/auth', json={'email': email, 'password': '12345678'}).json['token']
+    client.post('/message', json={'source': 'a@x', 'target': 'b@x', 'message': 'hi'},
+                headers={'Authorization': tokens['a@x']})
+
+    assert client.delete('/user/a@x', headers={'Authorization': tokens['a@x']}).status_code == 200
+    message_storage = app.extensions['chatao']['message_service'].message_storage
+    assert [message.message for message in message_storage.get_messages('b@x')] == ['hi']
@@ -0,0 +1,24 @@
+# Testes do diagnóstico opcional: perfil de requisições e log de consultas lentas.
+
+import sqlite3
+
+from profiling import RequestProfiler
+from storage import slowquery
+
+def test_profile_header_with_non_ascii_value_is_rejected():
+    profiler = RequestProfiler(token='segredo')
+
+    assert not profiler.wanted('ação')
+    assert profiler.wanted('segredo')
+
+def test_open_connections_keep_their_threshold(tmp_path):
+    slowquery.configure(1000)
+    try:
+        connection = sqlite3.connect(str(tmp_path / 'test.db'), factory=slowquery.connection_factory())
+        slowquery.configure(None)
+        connection.execute('CREATE TABLE t (x INTEGER)')
+        connection.executemany('INSERT INTO t (x) VALUES (?)', [(1,), (2,)])
+        assert connection.execute('SELECT COUNT(*) FROM t').fetchone() == (2,)
+        connection.close()
+    finally:
+        slowquery.configure(None)
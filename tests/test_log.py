@@ -0,0 +1,35 @@
+# Testes da configuração de logs (src/log.py).
+
+import logging
+import threading
+
+import log
+from app import create_app
+from config import Config
+
+def _queue_handlers() -> int:
+    #o pytest acrescenta os próprios handlers (caplog) ao logger raiz
+    return sum(isinstance(handler, log.LazyQueueHandler) for handler in logging.getLogger().handlers)
+
+def _listeners() -> int:
+    return sum(thread.name.endswith('(_monitor)') for thread in threading.enumerate())
+
+def test_create_app_reuses_the_log_listener(environ):
+    create_app(Config.from_env(environ))
+    listener = log._listener
+    create_app(Config.from_env(environ))
+    create_app(Config.from_env(environ))
+
+    assert log._listener is listener
+    assert _listeners() == 1
+    assert _queue_handlers() == 1
+
+def test_new_format_replaces_the_listener():
+    first = log.setup_logging('INFO', 'console')
+    second = log.setup_logging('INFO', 'json')
+
+    assert second is not first
+    assert _listeners() == 1
+    assert _queue_handlers() == 1
+    log.stop_logging()
+    assert _listeners() == 0
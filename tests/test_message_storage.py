@@ -0,0 +1,30 @@
+# Testes das listagens em stream do MessageStorage.
+
+import storage.message
+from domain.message import Message
+from storage.message import MessageStorage
+
+def test_streams_release_the_connection_between_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage.message, 'STREAM_CHUNK', 2)
+    storage_ = MessageStorage(str(tmp_path / 'message.db'), pool_size=1)
+    for index in range(5):
+        storage_.add_message(Message('a@x', 'b@x', f'm{index}'))
+    storage_.pools[0].timeout = 0.5
+
+    received = storage_.iter_messages('b@x')
+    assert next(received).message == 'm0'
+    #com o pool de uma conexão só, outra consulta passa enquanto o stream está parado
+    assert len(storage_.get_messages('b@x')) == 5
+    assert [message.message for message in received] == ['m1', 'm2', 'm3', 'm4']
+    storage_.close()
+
+def test_sent_stream_merges_shards_across_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage.message, 'STREAM_CHUNK', 2)
+    storage_ = MessageStorage(str(tmp_path / 'message.db'), shards=3)
+    for index in range(9):
+        storage_.add_message(Message('a@x', f'u{index}@x', f'm{index}'))
+
+    ids = [message.id for message in storage_.get_sent_messages('a@x')]
+    assert [message.id for message in storage_.iter_sent_messages('a@x')] == ids
+    assert [message.id for message in storage_.iter_sent_messages('a@x', ids[2], 5)] == ids[3:8]
+    storage_.close()
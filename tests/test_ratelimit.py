@@ -0,0 +1,32 @@
+# Testes da limitação de taxa por IP e do compartilhamento entre workers.
+
+import os
+
+from app import create_app
+from config import Config
+
+def _signup(client, index, forwarded_for):
+    return client.post('/user', json={'email': f'u{index}@x', 'password': '12345678', 'nickname': 'u'},
+                       headers={'X-Forwarded-For': forwarded_for}).status_code
+
+def test_trusted_proxy_limits_each_client(environ):
+    config = Config.from_env({**environ, 'CHATAO_RATE_LIMITS': 'create_user: ip=2/3600',
+                              'CHATAO_TRUSTED_PROXIES': '1', 'CHATAO_WORKERS': '1'})
+    client = create_app(config).test_client()
+
+    assert [_signup(client, i, '10.0.0.1') for i in range(3)] == [201, 201, 429]
+    #outro cliente atrás do mesmo proxy tem o próprio balde
+    assert _signup(client, 3, '10.0.0.2') == 201
+
+def test_without_trusted_proxy_forwarded_for_is_ignored(environ):
+    config = Config.from_env({**environ, 'CHATAO_RATE_LIMITS': 'create_user: ip=2/3600', 'CHATAO_WORKERS': '1'})
+    client = create_app(config).test_client()
+
+    assert [_signup(client, i, f'10.0.0.{i}') for i in range(3)] == [201, 201, 429]
+
+def test_several_workers_share_buckets(environ, tmp_path):
+    config = Config.from_env({**environ, 'CHATAO_RATE_LIMITS': 'create_user: ip=2/3600', 'CHATAO_WORKERS': '2'})
+    first, second = create_app(config).test_client(), create_app(config).test_client()
+
+    assert [_signup(client, i, '') for i, client in enumerate((first, second, first))] == [201, 201, 429]
+    assert os.path.exists(tmp_path / 'ratelimit.db')
@@ -0,0 +1,22 @@
+# Testes da redistribuição de shards (storage.message.rebalance).
+
+from domain.message import Message
+from storage.message import MessageStorage, rebalance
+
+def test_rebalance_keeps_version_counters_growing(tmp_path):
+    path = str(tmp_path / 'message.db')
+    storage = MessageStorage(path)
+    for index in range(6):
+        storage.add_message(Message('a@x', f'u{index}@x', 'hi'))
+        storage.add_message(Message(f'u{index}@x', 'a@x', 'hello'))
+    storage.delete_user_messages('u0@x')
+    before = {(box, email): storage.get_version(box, email) for box in ('in', 'out') for email in ('a@x', 'u1@x')}
+    storage.close()
+
+    rebalance(path, 1, 3)
+
+    storage = MessageStorage(path, shards=3)
+    for (box, email), version in before.items():
+        assert storage.get_version(box, email) > version
+    assert len(storage.get_messages('a@x')) == 5
+    storage.close()
@@ -0,0 +1,70 @@
+# Testes da entrega em tempo real (/message/stream/<email>).
+
+import threading
+import time
+
+import pytest
+
+from app import create_app
+from config import Config
+
+def _client(config, register=True):
+    app = create_app(config)
+    client = app.test_client()
+    tokens = {}
+    for email in ('a@x', 'b@x'):
+        if register:
+            client.post('/user', json={'email': email, 'password': '12345678', 'nickname': email})
+        tokens[email] = client.post('/auth', json={'email': email, 'password': '12345678'}).json['token']
+    client.tokens = tokens
+    return client
+
+@pytest.fixture
+def client(environ):
+    client = _client(Config.from_env(environ, write_behind=True, flush_interval=0.05))
+    yield client
+    client.application.extensions['chatao']['message_service'].message_storage.close()
+
+def test_long_poll_with_write_behind_delivers_once(client):
+    def send():
+        time.sleep(0.2)
+        client.post('/message', json={'source': 'a@x', 'target': 'b@x', 'message': 'live'},
+                    headers={'Authorization': client.tokens['a@x']})
+
+    sender = threading.Thread(target=send)
+    sender.start()
+    response = client.get('/message/stream/b@x?since=0&timeout=5',
+                          headers={'Authorization': client.tokens['b@x']})
+    sender.join()
+
+    messages = response.json['messages']
+    assert [message['message'] for message in messages] == ['live']
+    #publicada depois do lote: já com id, e o cursor avança
+    assert messages[0]['id'] is not None
+    assert response.json['next'] == messages[0]['id']
+
+    response = client.get(f"/message/stream/b@x?since={response.json['next']}&timeout=0.3",
+                          headers={'Authorization': client.tokens['b@x']})
+    assert response.json['messages'] == []
+
+def test_long_poll_wakes_up_for_messages_from_another_worker(environ):
+    #dois apps nos mesmos bancos fazem o papel de dois workers: o hub de um não vê
+    #as mensagens enviadas pelo outro
+    config = Config.from_env(environ, wake_interval=0.1)
+    receiver = _client(config)
+    sender = _client(config, register=False)
+
+    def send():
+        time.sleep(0.2)
+        sender.post('/message', json={'source': 'a@x', 'target': 'b@x', 'message': 'other'},
+                    headers={'Authorization': sender.tokens['a@x']})
+
+    thread = threading.Thread(target=send)
+    thread.start()
+    start = time.monotonic()
+    response = receiver.get('/message/stream/b@x?timeout=5', headers={'Authorization': receiver.tokens['b@x']})
+    elapsed = time.monotonic() - start
+    thread.join()
+
+    assert [message['message'] for message in response.json['messages']] == ['other']
+    assert elapsed < 2
@@ -0,0 +1,42 @@
+# Testes do serviço de usuários: revogação de tokens nas escritas.
+
+import time
+
+import pytest
+
+from app import create_app
+from config import Config
+
+@pytest.fixture
+def app(environ):
+    app = create_app(Config.from_env({**environ, 'CHATAO_SCRYPT_N': str(2 ** 10)}))
+    app.test_client().post('/user', json={'email': 'a@x', 'password': '12345678', 'nickname': 'a'})
+    return app
+
+def _token(app):
+    token = app.extensions['chatao']['auth_service'].authenticate('a@x', '12345678')
+    #revogação vale para tokens emitidos até o instante dela
+    time.sleep(0.01)
+    return token
+
+def test_update_revokes_tokens(app):
+    services = app.extensions['chatao']
+    token = _token(app)
+
+    assert services['user_service'].update_user('a@x', '87654321', 'a')
+    assert not services['auth_service'].validate_token('a@x', token)
+
+def test_failed_update_keeps_tokens(app, monkeypatch):
+    services = app.extensions['chatao']
+    token = _token(app)
+    monkeypatch.setattr(services['user_service'].user_storage, 'update_user', lambda user: False)
+
+    assert not services['user_service'].update_user('a@x', '87654321', 'a')
+    assert services['auth_service'].validate_token('a@x', token)
+
+def test_delete_revokes_tokens(app):
+    services = app.extensions['chatao']
+    token = _token(app)
+
+    assert services['user_service'].delete_user('a@x')
+    assert not services['auth_service'].validate_token('a@x', token)